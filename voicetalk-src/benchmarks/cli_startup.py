@@ -0,0 +1,140 @@
+"""Cold-start time of the ``voice-talk`` sub-commands.
+
+Every sub-command is run in a fresh interpreter with ``python -X importtime``.
+The wall time of the whole invocation and the cumulative import time reported
+by the interpreter are collected over a few runs, and the slowest imports of
+the last run are listed.
+
+Usage::
+
+    python benchmarks/cli_startup.py [--runs 5] [--top 5] [--json]
+"""
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$')
+
+
+def get_sub_commands(work_dir: str) -> dict:
+    """Map a name to the arguments of every benchmarked sub-command
+
+    The sub-commands needing a database or a password prompt only parse their
+    arguments, the others really run.
+    """
+    return {
+        'version': ['--version'],
+        'help': ['--help'],
+        'start --help': ['start', '--help'],
+        'db create --help': ['db', 'create', '--help'],
+        'db gc --help': ['db', 'gc', '--help'],
+        'add-user --help': ['add-user', '--help'],
+        'genconf': ['genconf', str(Path(work_dir) / 'voicetalk.ini')],
+        'gen-sample-device-file': ['gen-sample-device-file',
+                                   str(Path(work_dir) / 'device.json')],
+    }
+
+
+def parse_import_times(stderr: str) -> list:
+    """Parse the output of ``-X importtime``
+
+    :return: ``(module, self_us, cumulative_us, depth)`` of every import
+    :rtype: list
+    """
+    imports = []
+
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+
+    return imports
+
+
+def run_once(argv: list) -> tuple:
+    """Run a sub-command in a fresh interpreter
+
+    :return: The wall time in seconds and the parsed import times
+    :rtype: tuple
+    """
+    env = dict(os.environ, PYTHONPATH=str(BASE_DIR))
+    started_at = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-m', 'voicetalk.cli'] + argv,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=env,
+        universal_newlines=True)
+    elapsed = time.perf_counter() - started_at
+
+    if result.returncode != 0:
+        raise RuntimeError(
+            'voice-talk {} failed:\n{}'.format(' '.join(argv), result.stderr))
+
+    return elapsed, parse_import_times(result.stderr)
+
+
+def benchmark(runs: int, top: int) -> dict:
+    report = {}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        for name, argv in get_sub_commands(work_dir).items():
+            wall_times, import_times = [], []
+
+            for _ in range(runs):
+                elapsed, imports = run_once(argv)
+                wall_times.append(elapsed)
+                # The top level imports add up to the total import time
+                import_times.append(sum(cumulative for _, _, cumulative, depth in imports
+                                        if depth == 0) / 1e6)
+
+            slowest = sorted((imp for imp in imports if imp[3] == 0),
+                             key=lambda imp: imp[2], reverse=True)[:top]
+            report[name] = {
+                'wall_median': statistics.median(wall_times),
+                'wall_min': min(wall_times),
+                'import_median': statistics.median(import_times),
+                'modules': len(imports),
+                'slowest_imports': [{'module': module, 'cumulative': cumulative / 1e6}
+                                    for module, _, cumulative, _ in slowest],
+            }
+
+    return report
+
+
+def main():
+    parser = ArgumentParser(description='Cold-start time of the voice-talk sub-commands')
+    parser.add_argument('--runs', type=int, default=5, help='Runs per sub-command')
+    parser.add_argument('--top', type=int, default=5, help='Slowest imports listed')
+    parser.add_argument('--json', action='store_true', help='Print the report in JSON')
+    args = parser.parse_args()
+
+    report = benchmark(max(1, args.runs), args.top)
+
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print('{:<24} {:>10} {:>10} {:>8}'.format('sub-command', 'wall (ms)', 'import (ms)',
+                                              'modules'))
+
+    for name, result in report.items():
+        print('{:<24} {:>10.1f} {:>10.1f} {:>8}'.format(
+            name, result['wall_median'] * 1000, result['import_median'] * 1000,
+            result['modules']))
+
+        for imp in result['slowest_imports']:
+            print('    {:<40} {:>8.1f} ms'.format(imp['module'], imp['cumulative'] * 1000))
+
+
+if __name__ == '__main__':
+    main()
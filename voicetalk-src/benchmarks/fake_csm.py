@@ -0,0 +1,213 @@
+"""A stand-in IoTtalk CSM server for the benchmarks.
+
+It implements the endpoints used by ``voicetalk.iottalk.csmapi``:
+
+- ``POST /{mac_addr}`` and ``DELETE /{mac_addr}`` to register and deregister
+- ``PUT /{mac_addr}/{df_name}`` and ``GET /{mac_addr}/{df_name}`` to push and pull
+- ``GET /get_alias/{mac_addr}/{df_name}``
+- ``GET /set_alias/{mac_addr}/{df_name}/alias?name=...``
+- ``GET /tree``
+
+Every device gets its own password, the ``password-key`` of the last push to
+a feature is kept in ``push_keys``. The control channel ``__Ctl_O__`` of every
+device answers ``RESUME``. Every request is delayed by ``latency`` seconds, plus
+up to ``jitter`` seconds, and fails with a 500 at the rate ``failure_rate``.
+
+Usage::
+
+    python benchmarks/fake_csm.py [--port 9999] [--latency 0.005] [--failure-rate 0]
+"""
+import json
+import random
+import threading
+import time
+
+from argparse import ArgumentParser
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeCSM:
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                 jitter: float = 0.0, failure_rate: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.devices = {}
+        self.samples = {}
+        self.aliases = {}
+        self.push_keys = {}
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.__make_handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+
+        return 'http://{}:{}'.format(host, port)
+
+    def start(self) -> str:
+        """Serve on a daemon thread
+
+        :return: The URL of the server
+        """
+        self.thread = threading.Thread(target=self.server.serve_forever, name='FakeCSM')
+        self.thread.daemon = True
+        self.thread.start()
+
+        return self.url
+
+    def stop(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, name: str) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def __make_handler(self):
+        csm = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep the connections alive like the real CSM
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                self.__handle('register', lambda parts, body: csm.register(parts, body))
+
+            def do_DELETE(self):
+                self.__handle('deregister', lambda parts, body: csm.deregister(parts))
+
+            def do_PUT(self):
+                self.__handle('push', lambda parts, body: csm.push(
+                    parts, body, self.headers.get('password-key')))
+
+            def do_GET(self):
+                self.__handle('get', lambda parts, body: csm.get(parts, self.path))
+
+            def __handle(self, name, action):
+                body = self.__read_body()
+                delay = csm.latency + random.uniform(0, csm.jitter)
+
+                if delay > 0:
+                    time.sleep(delay)
+
+                if random.random() < csm.failure_rate:
+                    csm.count('failed')
+                    return self.__send(500, 'Injected failure')
+
+                try:
+                    status, payload = action(urlparse(self.path).path.strip('/').split('/'),
+                                             body)
+                except (KeyError, IndexError, ValueError) as e:
+                    status, payload = 400, str(e)
+
+                csm.count(name)
+                self.__send(status, payload)
+
+            def __read_body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+
+                return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+            def __send(self, status, payload):
+                if isinstance(payload, str):
+                    body, content_type = payload.encode(), 'text/plain'
+                else:
+                    body, content_type = json.dumps(payload).encode(), 'application/json'
+
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def register(self, parts: list, body: dict) -> tuple:
+        mac_addr, = parts
+
+        with self.lock:
+            self.devices[mac_addr] = body['profile']
+
+        return 200, {'password': 'password-{}'.format(mac_addr)}
+
+    def deregister(self, parts: list) -> tuple:
+        mac_addr, = parts
+
+        with self.lock:
+            self.devices.pop(mac_addr, None)
+
+        return 200, 'OK'
+
+    def push(self, parts: list, body: dict, password: str = None) -> tuple:
+        mac_addr, df_name = parts
+
+        with self.lock:
+            if mac_addr not in self.devices:
+                return 404, 'Device not found'
+
+            self.samples[(mac_addr, df_name)] = [[str(datetime.now()), body['data']]]
+            self.push_keys[(mac_addr, df_name)] = password
+
+        return 200, 'OK'
+
+    def get(self, parts: list, path: str) -> tuple:
+        if parts == ['tree']:
+            with self.lock:
+                return 200, {'devices': list(self.devices)}
+
+        if parts[0] == 'get_alias':
+            _, mac_addr, df_name = parts
+
+            with self.lock:
+                return 200, {'alias_name': self.aliases.get((mac_addr, df_name), df_name)}
+
+        if parts[0] == 'set_alias':
+            _, mac_addr, df_name, _ = parts
+            name = parse_qs(urlparse(path).query)['name'][0]
+
+            with self.lock:
+                self.aliases[(mac_addr, df_name)] = name
+
+            return 200, 'OK'
+
+        mac_addr, df_name = parts
+
+        if df_name == '__Ctl_O__':
+            return 200, {'samples': [['2020-01-01 00:00:00.000000', ['RESUME', {}]]]}
+
+        with self.lock:
+            return 200, {'samples': self.samples.get((mac_addr, df_name), [])}
+
+
+def main():
+    parser = ArgumentParser(description='Fake IoTtalk CSM server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9999)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds every request is delayed')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='Maximum seconds added to the latency')
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='Fraction of the requests failing with a 500')
+    args = parser.parse_args()
+
+    csm = FakeCSM(args.host, args.port, args.latency, args.jitter, args.failure_rate)
+    print('Fake IoTtalk CSM on {}'.format(csm.url))
+
+    try:
+        csm.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,388 @@
+"""Load test of VoiceTalk against a fake IoTtalk CSM.
+
+The app is started in-process on a threaded werkzeug server, with a SQLite
+database in a temporary directory unless ``--db-url`` is given, and talks to
+``FakeCSM``. Every client links a user of its own through the OAuth2 flow,
+then sends a weighted mix of SYNC, EXECUTE and QUERY fulfillments and token
+refreshes as fast as it can for ``--duration`` seconds.
+
+The report gives the throughput and the p50/p95/p99 latencies of every
+operation, in JSON so the results can be compared over time.
+
+Usage::
+
+    python benchmarks/load.py [--clients 8] [--duration 30] \\
+        [--mix sync=1,execute=6,query=6,refresh=1] [--csm-latency 0.005] \\
+        [--csm-failure-rate 0] [--output result.json]
+"""
+import contextlib
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_DIR))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_csm import FakeCSM  # noqa: E402
+
+CLIENT_ID = 'benchmark-client'
+CLIENT_SECRET = 'benchmark-secret'
+REDIRECT_URI = 'http://localhost/callback'
+DEFAULT_MIX = 'sync=1,execute=6,query=6,refresh=1'
+CONFIG_TEMPLATE = """
+[core]
+bind = 127.0.0.1
+port = {port}
+flask_secret_key = benchmark
+username = benchmark-admin
+password = benchmark-admin
+
+[db]
+url = {db_url}
+
+[google-api]
+client_id = {client_id}
+client_secret = {client_secret}
+
+[iottalk]
+host = {csm_url}
+"""
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+
+    for item in mix.split(','):
+        name, weight = item.split('=')
+        weights[name.strip()] = float(weight)
+
+    unknown = set(weights) - set(OPERATIONS)
+
+    if unknown:
+        raise ValueError('Unknown operations: {}'.format(', '.join(sorted(unknown))))
+
+    return weights
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest-rank percentile"""
+    if not sorted_values:
+        return 0.0
+
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+
+    return sorted_values[index]
+
+
+def prepare(work_dir: str, csm_url: str, db_url: str = None, ini_extra: str = '',
+            port: int = 8000) -> Namespace:
+    """Generate the config, the device file and the database, then load the config
+
+    :return: The ``voice-talk`` arguments pointing to them
+    """
+    from voicetalk import cli, utils
+    from voicetalk.db import models
+
+    from sqlalchemy import create_engine
+
+    db_url = db_url or 'sqlite:///{}/voicetalk.db'.format(work_dir)
+    ini_path = Path(work_dir) / 'voicetalk.ini'
+    ini_path.write_text(CONFIG_TEMPLATE.format(db_url=db_url, client_id=CLIENT_ID,
+                                               client_secret=CLIENT_SECRET,
+                                               csm_url=csm_url, port=port) + ini_extra)
+    models.base.metadata.create_all(create_engine(db_url))
+
+    device_json_path = Path(work_dir) / 'device.json'
+
+    with utils.resource_path('device/device.json.sample') as sample_path:
+        device_json_path.write_bytes(Path(str(sample_path)).read_bytes())
+
+    args = Namespace(ini_path=str(ini_path), device_json_file_path=str(device_json_path))
+    cli.load_config(args)
+
+    return args
+
+
+def start_app(work_dir: str, csm_url: str, db_url: str = None, ini_extra: str = '') -> str:
+    """Build the app from a generated config and serve it on a daemon thread
+
+    :return: The URL of the app
+    """
+    from werkzeug.serving import make_server
+
+    from voicetalk import cli
+
+    args = prepare(work_dir, csm_url, db_url, ini_extra)
+
+    from voicetalk import server
+
+    cli.load_flask_config(server.app)
+    server.init_app(args)
+    server.warm_up()
+
+    httpd = make_server('127.0.0.1', 0, server.app, threaded=True)
+    thread = threading.Thread(target=httpd.serve_forever, name='VoiceTalk')
+    thread.daemon = True
+    thread.start()
+
+    return 'http://127.0.0.1:{}'.format(httpd.server_port)
+
+
+class Client:
+    """A Google Home user, linked through the OAuth2 flow"""
+
+    def __init__(self, app_url: str, username: str, password: str):
+        self.app_url = app_url
+        self.session = requests.Session()
+        self.access_token = None
+        self.refresh_token = None
+        self.request_ids = iter(range(1, sys.maxsize))
+        self.link(username, password)
+
+    def link(self, username: str, password: str) -> None:
+        query = {'redirect_uri': REDIRECT_URI, 'client_id': CLIENT_ID,
+                 'response_type': 'code', 'state': 'benchmark'}
+        response = self.session.post(self.app_url + '/login',
+                                     data={'username': username, 'password': password},
+                                     allow_redirects=False)
+        response.raise_for_status()
+        response = self.session.get(self.app_url + '/oauth', params=query,
+                                    allow_redirects=False)
+        code = parse_qs(urlparse(response.headers['Location']).query)['code'][0]
+        response = self.session.post(self.app_url + '/token', data={
+            'client_id': CLIENT_ID,
+            'client_secret': CLIENT_SECRET,
+            'grant_type': 'authorization_code',
+            'code': code,
+            'redirect_uri': REDIRECT_URI
+        })
+        response.raise_for_status()
+        self.access_token = response.json()['access_token']
+        self.refresh_token = response.json()['refresh_token']
+
+    def fulfillment(self, intent: str, payload: dict = None) -> requests.Response:
+        body = {
+            'requestId': str(next(self.request_ids)),
+            'inputs': [{'intent': intent, 'payload': payload or {}}]
+        }
+
+        return self.session.post(self.app_url + '/fulfillment', json=body,
+                                 headers={'Authorization': 'Bearer ' + self.access_token})
+
+    def sync(self):
+        return self.fulfillment('action.devices.SYNC')
+
+    def execute(self):
+        return self.fulfillment('action.devices.EXECUTE', {'commands': [{
+            'devices': [{'id': 'FluorescentLamp'}, {'id': 'BigFan'}],
+            'execution': [{'command': 'action.devices.commands.OnOff',
+                           'params': {'on': random.random() < 0.5}}]
+        }]})
+
+    def query(self):
+        return self.fulfillment('action.devices.QUERY', {
+            'devices': [{'id': 'FluorescentLamp'}, {'id': 'BigFan'}]
+        })
+
+    def refresh(self):
+        response = self.session.post(self.app_url + '/token', data={
+            'client_id': CLIENT_ID,
+            'client_secret': CLIENT_SECRET,
+            'grant_type': 'refresh_token',
+            'refresh_token': self.refresh_token
+        })
+
+        if response.status_code == 200:
+            self.access_token = response.json()['access_token']
+
+        return response
+
+
+OPERATIONS = {
+    'sync': Client.sync,
+    'execute': Client.execute,
+    'query': Client.query,
+    'refresh': Client.refresh,
+}
+
+
+def drive(client: Client, weights: dict, deadline: float, samples: dict, errors: dict):
+    names = list(weights)
+    name_weights = [weights[name] for name in names]
+
+    while time.monotonic() < deadline:
+        name = random.choices(names, name_weights)[0]
+        started_at = time.perf_counter()
+
+        try:
+            response = OPERATIONS[name](client)
+            failed = response.status_code != 200
+        except requests.RequestException:
+            failed = True
+
+        latency = time.perf_counter() - started_at
+        samples[name].append(latency)
+
+        if failed:
+            errors[name] += 1
+
+
+def load(app_url: str, usernames: list, weights: dict, duration: float) -> tuple:
+    """Link a client per user, then drive them all for ``duration`` seconds
+
+    :return: ``(samples, errors, elapsed)``, the latencies and the error count of
+      every operation, and the seconds the load lasted
+    """
+    clients = [Client(app_url, username, 'benchmark') for username in usernames]
+    samples = {name: [] for name in weights}
+    errors = {name: 0 for name in weights}
+    per_client = [({name: [] for name in weights}, {name: 0 for name in weights})
+                  for _ in clients]
+    started_at = time.monotonic()
+    deadline = started_at + duration
+    threads = [threading.Thread(target=drive,
+                                args=(client, weights, deadline) + per_client[index])
+               for index, client in enumerate(clients)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.monotonic() - started_at
+
+    for client_samples, client_errors in per_client:
+        for name in weights:
+            samples[name].extend(client_samples[name])
+            errors[name] += client_errors[name]
+
+    return samples, errors, elapsed
+
+
+def get_git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=str(BASE_DIR),
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              universal_newlines=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def summarize(samples: list, errors: int, elapsed: float) -> dict:
+    latencies = sorted(samples)
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': len(latencies) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 0.50),
+        'p95': percentile(latencies, 0.95),
+        'p99': percentile(latencies, 0.99),
+        'max': latencies[-1] if latencies else 0.0
+    }
+
+
+def run(args) -> dict:
+    weights = parse_mix(args.mix)
+    csm = FakeCSM(latency=args.csm_latency, jitter=args.csm_jitter,
+                  failure_rate=args.csm_failure_rate)
+    csm_url = csm.start()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        ini_extra = ''
+
+        if args.signed_tokens:
+            ini_extra = ('\n[oauth2]\naccess-token-format = signed\n'
+                         'signing-keys = benchmark:benchmark-secret\n')
+
+        app_url = args.target or start_app(work_dir, csm_url, args.db_url, ini_extra)
+
+        if not args.target:
+            from voicetalk import account
+
+            for index in range(args.clients):
+                account.add_an_user('benchmark-{}'.format(index), 'benchmark')
+
+        samples, errors, elapsed = load(
+            app_url, ['benchmark-{}'.format(index) for index in range(args.clients)],
+            weights, args.duration)
+
+    csm.stop()
+
+    return {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'revision': get_git_revision(),
+        'python': platform.python_version(),
+        'parameters': {
+            'clients': args.clients,
+            'duration': args.duration,
+            'mix': weights,
+            'csm_latency': args.csm_latency,
+            'csm_jitter': args.csm_jitter,
+            'csm_failure_rate': args.csm_failure_rate,
+            'db_url': 'sqlite' if not args.db_url else args.db_url.split(':')[0],
+            'access_token_format': 'signed' if args.signed_tokens else 'opaque',
+        },
+        'elapsed': elapsed,
+        'total': summarize([latency for values in samples.values() for latency in values],
+                           sum(errors.values()), elapsed),
+        'operations': {name: summarize(samples[name], errors[name], elapsed)
+                       for name in weights},
+        'csm_requests': dict(csm.counters)
+    }
+
+
+def main():
+    parser = ArgumentParser(description='Load test of VoiceTalk against a fake IoTtalk CSM')
+    parser.add_argument('--clients', type=int, default=8,
+                        help='Concurrent clients, each linking a user of its own')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds of load')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='Weights of the operations, default: {}'.format(DEFAULT_MIX))
+    parser.add_argument('--csm-latency', type=float, default=0.005,
+                        help='Seconds every request to the fake CSM takes')
+    parser.add_argument('--csm-jitter', type=float, default=0.0,
+                        help='Maximum seconds added to the CSM latency')
+    parser.add_argument('--csm-failure-rate', type=float, default=0.0,
+                        help='Fraction of the CSM requests failing')
+    parser.add_argument('--db-url', default=None,
+                        help='Database of the app, a temporary SQLite file by default')
+    parser.add_argument('--signed-tokens', action='store_true',
+                        help='Issue signed access tokens instead of opaque ones')
+    parser.add_argument('--target', default=None,
+                        help='URL of a running VoiceTalk instead of an in-process app. '
+                             'Its users benchmark-<N> must exist with password benchmark')
+    parser.add_argument('--output', default=None, help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    # DAN prints its progress, keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args)
+
+    output = json.dumps(report, indent=2)
+
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Concurrent-request throughput of VoiceTalk under uWSGI, per serving mode.
+
+For every mode, VoiceTalk is started by uWSGI with the command line of
+``voice-talk start``, from a generated config whose ``[uwsgi]`` section
+selects the mode, and talks to ``FakeCSM`` answering in ``--csm-latency``
+seconds to stand for a slow IoTtalk. The clients of ``load.py`` then drive it
+for ``--duration`` seconds. The modes are:
+
+- ``single``: one process with one thread, the former default
+- ``threads``: ``--processes`` processes with ``--threads`` threads each
+- ``gevent``: ``--processes`` processes with ``--gevent`` greenlets each
+
+``uwsgi`` must be on the ``PATH``, and ``gevent`` installed for the gevent
+mode. A mode that fails to start is reported with the tail of its log.
+
+Usage::
+
+    python benchmarks/serving.py [--modes single,threads,gevent] [--clients 32] \\
+        [--duration 20] [--processes 1] [--threads 8] [--gevent 100] \\
+        [--csm-latency 0.1] [--output result.json]
+"""
+import contextlib
+import json
+import logging
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from pathlib import Path
+
+import requests
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from fake_csm import FakeCSM  # noqa: E402
+from load import get_git_revision, load, parse_mix, prepare, summarize  # noqa: E402
+
+DEFAULT_MODES = 'single,threads,gevent'
+DEFAULT_MIX = 'execute=1,query=1'
+START_TIMEOUT = 60
+
+
+def get_uwsgi_conf(mode: str, args) -> dict:
+    if mode == 'single':
+        return {'processes': 1, 'threads': 1, 'gevent': 0}
+    elif mode == 'threads':
+        return {'processes': args.processes, 'threads': args.threads, 'gevent': 0}
+    elif mode == 'gevent':
+        return {'processes': args.processes, 'threads': 1, 'gevent': args.gevent}
+
+    raise ValueError('Unknown mode: {}'.format(mode))
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until_ready(app_url: str, process: subprocess.Popen) -> None:
+    """
+    :raise RuntimeError: If uWSGI exits or is not ready in time.
+    """
+    deadline = time.monotonic() + START_TIMEOUT
+
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError('uWSGI exited with {}'.format(process.returncode))
+
+        try:
+            if requests.get(app_url + '/ready', timeout=1).status_code == 200:
+                return
+        except requests.RequestException:
+            pass
+
+        time.sleep(0.2)
+
+    raise RuntimeError('uWSGI is not ready after {}s'.format(START_TIMEOUT))
+
+
+def run_mode(mode: str, args, weights: dict, csm_url: str, work_dir: str,
+             usernames: list) -> dict:
+    from voicetalk import cli
+
+    uwsgi_conf = get_uwsgi_conf(mode, args)
+    port = get_free_port()
+    app_url = 'http://127.0.0.1:{}'.format(port)
+    result = {'uwsgi': uwsgi_conf}
+    ini_extra = '\n[uwsgi]\n' + ''.join('{} = {}\n'.format(name, value)
+                                        for name, value in uwsgi_conf.items())
+    voicetalk_args = prepare(work_dir, csm_url, args.db_url, ini_extra, port)
+    command = cli.get_uwsgi_command(['-c', voicetalk_args.ini_path,
+                                     '-f', voicetalk_args.device_json_file_path, 'start'])
+    log_path = Path(work_dir) / 'uwsgi-{}.log'.format(mode)
+
+    with log_path.open('w') as log:
+        try:
+            process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT)
+        except OSError as e:
+            return dict(result, error=str(e))
+
+        try:
+            wait_until_ready(app_url, process)
+            samples, errors, elapsed = load(app_url, usernames, weights, args.duration)
+        except RuntimeError as e:
+            return dict(result, error=str(e), log=log_path.read_text().splitlines()[-20:])
+        finally:
+            # SIGINT stops uWSGI at once, SIGTERM waits for the workers to finish
+            process.send_signal(signal.SIGINT)
+
+            try:
+                process.wait(30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+
+    latencies = [latency for values in samples.values() for latency in values]
+
+    return dict(result,
+                elapsed=elapsed,
+                total=summarize(latencies, sum(errors.values()), elapsed),
+                operations={name: summarize(samples[name], errors[name], elapsed)
+                            for name in weights})
+
+
+def run(args) -> dict:
+    from voicetalk import account
+
+    weights = parse_mix(args.mix)
+    csm = FakeCSM(latency=args.csm_latency)
+    csm_url = csm.start()
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    usernames = ['benchmark-{}'.format(index) for index in range(args.clients)]
+
+    # The modes share the database and its users, each links them again
+    with tempfile.TemporaryDirectory() as work_dir:
+        try:
+            prepare(work_dir, csm_url, args.db_url)
+
+            for username in usernames:
+                account.add_an_user(username, 'benchmark')
+
+            results = {mode: run_mode(mode, args, weights, csm_url, work_dir, usernames)
+                       for mode in modes}
+        finally:
+            csm.stop()
+
+    return {
+        'started_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'revision': get_git_revision(),
+        'python': platform.python_version(),
+        'parameters': {
+            'clients': args.clients,
+            'duration': args.duration,
+            'mix': weights,
+            'csm_latency': args.csm_latency,
+            'db_url': 'sqlite' if not args.db_url else args.db_url.split(':')[0],
+        },
+        'modes': results
+    }
+
+
+def main():
+    parser = ArgumentParser(description='Throughput of VoiceTalk per uWSGI serving mode')
+    parser.add_argument('--modes', default=DEFAULT_MODES,
+                        help='Serving modes to compare, default: {}'.format(DEFAULT_MODES))
+    parser.add_argument('--clients', type=int, default=32,
+                        help='Concurrent clients, each linking a user of its own')
+    parser.add_argument('--duration', type=float, default=20,
+                        help='Seconds of load per mode')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help='Weights of the operations, default: {}'.format(DEFAULT_MIX))
+    parser.add_argument('--processes', type=int, default=1,
+                        help='Worker processes of the threads and gevent modes')
+    parser.add_argument('--threads', type=int, default=8,
+                        help='Threads per worker of the threads mode')
+    parser.add_argument('--gevent', type=int, default=100,
+                        help='Greenlets per worker of the gevent mode')
+    parser.add_argument('--csm-latency', type=float, default=0.1,
+                        help='Seconds every request to the fake CSM takes')
+    parser.add_argument('--db-url', default=None,
+                        help='Database of the app, a temporary SQLite file by default')
+    parser.add_argument('--output', default=None, help='Write the JSON report to this file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    # DAN prints its progress, keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run(args)
+
+    output = json.dumps(report, indent=2)
+
+    if args.output:
+        Path(args.output).write_text(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -77,6 +77,13 @@ setup(
         'console_scripts': ['voice-talk = voicetalk.cli:main'],
     },
     install_requires=get_requires(),
+    extras_require={
+        'async': ['aiohttp~=3.6.2'],
+        'homegraph': ['google-auth~=1.21'],
+        # The gevent loop of uWSGI 2.0 breaks with gevent 24 and later
+        'gevent': ['gevent>=20.9,<24'],
+        'test': ['pytest>=6'],
+    },
     classifiers=[
         'Programming Language :: Python :: 3.7',
     ]
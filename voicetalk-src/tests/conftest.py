@@ -0,0 +1,49 @@
+import sys
+
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'benchmarks'))
+
+from fake_csm import FakeCSM  # noqa: E402
+
+
+@pytest.fixture
+def fake_csm():
+    csm = FakeCSM()
+    csm.start()
+
+    yield csm
+
+    csm.stop()
+
+
+@pytest.fixture
+def db(tmp_path):
+    """``DB()`` connected to a new SQLite database with all the tables"""
+    from voicetalk.db import models
+    from voicetalk.db.db import DB
+
+    db_instance = DB()
+    db_instance.connect('sqlite:///{}'.format(tmp_path / 'voicetalk.db'),
+                        dispose_first=True)
+
+    with db_instance.get_session_scope() as db_session:
+        models.base.metadata.create_all(db_session.connection())
+
+    yield db_instance
+
+    db_instance.dispose()
+
+
+@pytest.fixture
+def user(db):
+    from voicetalk.db import models
+
+    with db.get_session_scope() as db_session:
+        user = models.User(username='tester', password='unused')
+        db_session.add(user)
+        db_session.flush()
+
+        return user.id
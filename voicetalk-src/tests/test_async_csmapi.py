@@ -0,0 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from voicetalk.iottalk.csmapi import CSMAPI, CSMError
+
+pytest.importorskip('aiohttp')
+
+from voicetalk.iottalk.async_csmapi import AsyncCSMAPI, AsyncHTTPClient  # noqa: E402
+
+PROFILE = {'d_name': 'test', 'dm_name': 'Voice', 'df_list': ['Voice-I']}
+
+
+@pytest.fixture
+def client():
+    client = AsyncHTTPClient(limit_per_host=2)
+
+    yield client
+
+    client.close()
+
+
+def test_async_csmapi_talks_to_the_csm(fake_csm, client):
+    api = AsyncCSMAPI(fake_csm.url, client)
+
+    assert client.run(api.register('mac', PROFILE))
+    assert api.password == 'password-mac'
+    assert client.run(api.push('mac', 'Voice-I', [{'on': True}]))
+    assert client.run(api.pull('mac', 'Voice-I'))[0][1] == [{'on': True}]
+    assert fake_csm.push_keys[('mac', 'Voice-I')] == 'password-mac'
+
+    with pytest.raises(CSMError) as excinfo:
+        client.run(api.push('unknown', 'Voice-I', [1]))
+
+    assert excinfo.value.status == 404
+
+
+def test_every_device_pushes_with_its_own_password(fake_csm, client):
+    apis = {mac_addr: CSMAPI(fake_csm.url, client) for mac_addr in ('first', 'second')}
+
+    for mac_addr, api in apis.items():
+        api.register(mac_addr, PROFILE)
+        assert api.password == 'password-{}'.format(mac_addr)
+
+    def push(mac_addr):
+        return apis[mac_addr].push(mac_addr, 'Voice-I', [1])
+
+    # Many threads push through the same client at once
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(push, ['first', 'second'] * 20))
+
+    assert results == [True] * 40
+    assert fake_csm.counters['push'] == 40
+    assert fake_csm.push_keys == {('first', 'Voice-I'): 'password-first',
+                                  ('second', 'Voice-I'): 'password-second'}
@@ -0,0 +1,78 @@
+import json
+
+import pytest
+
+from voicetalk.device.catalog import DeviceCatalog
+
+LIGHT = {'id': 'light', 'type': 'action.devices.types.LIGHT'}
+FAN = {'id': 'fan', 'type': 'action.devices.types.FAN'}
+
+
+@pytest.fixture
+def device_file(tmp_path):
+    path = tmp_path / 'devices.json'
+    path.write_text(json.dumps([LIGHT]))
+
+    return path
+
+
+def test_unchanged_file_reuses_the_snapshot(device_file):
+    catalog = DeviceCatalog(str(device_file))
+
+    assert catalog.load()
+    devices = catalog.devices
+
+    assert not catalog.load()
+    assert catalog.devices is devices
+    assert catalog.get('light') == LIGHT
+    assert json.loads(catalog.sync_response_json('1', 7)) == {
+        'requestId': '1', 'payload': {'agentUserId': 7, 'devices': [LIGHT]}}
+
+
+def test_changed_file_is_reloaded(device_file):
+    catalog = DeviceCatalog(str(device_file), check_interval=0)
+    reloads = []
+    catalog.add_listener(lambda: reloads.append(None))
+    catalog.load()
+
+    device_file.write_text(json.dumps([LIGHT, FAN]))
+
+    assert catalog.refresh()
+    assert catalog.devices == [LIGHT, FAN]
+    assert 'fan' in catalog
+    assert len(reloads) == 1
+
+
+def test_refresh_waits_for_the_check_interval(device_file):
+    catalog = DeviceCatalog(str(device_file), check_interval=60)
+    catalog.load()
+
+    device_file.write_text(json.dumps([LIGHT, FAN]))
+
+    assert not catalog.refresh()
+    assert catalog.devices == [LIGHT]
+
+
+def test_malformed_file_keeps_the_last_good_snapshot(device_file):
+    catalog = DeviceCatalog(str(device_file), check_interval=0)
+    catalog.load()
+
+    device_file.write_text('[{"id": "light"')
+
+    assert not catalog.refresh()
+    assert catalog.devices == [LIGHT]
+
+    device_file.unlink()
+
+    assert not catalog.refresh()
+    assert catalog.devices == [LIGHT]
+
+
+def test_malformed_file_fails_the_first_load(device_file):
+    device_file.write_text('{"id": "light"}')
+
+    with pytest.raises(ValueError):
+        DeviceCatalog(str(device_file)).load()
+
+    with pytest.raises(OSError):
+        DeviceCatalog(str(device_file.parent / 'missing.json')).load()
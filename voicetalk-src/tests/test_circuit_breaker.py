@@ -0,0 +1,121 @@
+import time
+
+import pytest
+import requests
+
+from voicetalk.iottalk import csmapi
+from voicetalk.iottalk.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+
+class Interface:
+    host = 'http://iottalk.test'
+    session = None
+
+    def __init__(self, func):
+        self.func = func
+
+    @csmapi.guard_wrapper(retry=False)
+    def call(self):
+        return self.func()
+
+
+class Interrupted(BaseException):
+    pass
+
+
+@pytest.fixture
+def breaker():
+    csmapi.breakers.configure(failure_threshold=1, open_seconds=0)
+
+    yield csmapi.breakers.get(Interface.host)
+
+    csmapi.breakers.configure()
+
+
+def test_base_exception_gives_the_probe_back(breaker):
+    def interrupt():
+        raise Interrupted()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    with pytest.raises(Interrupted):
+        Interface(interrupt).call()
+
+    assert breaker.state == OPEN
+    assert Interface(lambda: 'answered').call() == 'answered'
+    assert breaker.state == CLOSED
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, open_seconds=60)
+
+    for _ in range(2):
+        breaker.record_failure()
+
+    breaker.record_success()
+
+    for _ in range(2):
+        breaker.record_failure()
+
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+
+    breaker.record_failure()
+
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+    assert 59 < breaker.retry_after() <= 60
+    assert breaker.stats()['rejected'] == 1
+
+
+def test_half_open_probe_closes_or_reopens_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, open_seconds=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    # A single probe goes through
+    assert breaker.allow_request()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow_request()
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    assert not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert breaker.allow_request()
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.allow_request()
+    assert breaker.stats()['opened'] == 2
+
+
+def test_no_retry_while_the_breaker_is_not_closed():
+    breaker = CircuitBreaker(failure_threshold=1, retry_attempts=3)
+
+    assert breaker.get_retry_delay(1) is not None
+    assert breaker.get_retry_delay(3) is None
+
+    breaker.record_failure()
+    assert breaker.get_retry_delay(1) is None
+
+
+def test_only_host_failures_count_against_the_breaker():
+    assert csmapi.is_host_failure(csmapi.CSMError('Internal error', 503))
+    assert csmapi.is_host_failure(requests.ConnectionError())
+    assert csmapi.is_host_failure(requests.Timeout())
+    assert not csmapi.is_host_failure(csmapi.CSMError('Device not found', 404))
+    assert not csmapi.is_host_failure(ValueError('Invalid JSON'))
+
+
+def test_open_breaker_fails_fast(breaker):
+    calls = []
+    breaker.open_seconds = 60
+    breaker.record_failure()
+
+    with pytest.raises(csmapi.CircuitOpenError):
+        Interface(lambda: calls.append(1)).call()
+
+    assert calls == []
@@ -0,0 +1,49 @@
+from voicetalk import device
+
+
+def make_execute_intent(*device_ids, on=True):
+    return {
+        'intent': 'action.devices.EXECUTE',
+        'payload': {
+            'commands': [{
+                'devices': [{'id': device_id} for device_id in device_ids],
+                'execution': [{'command': 'action.devices.commands.OnOff',
+                               'params': {'on': on}}]
+            }]
+        }
+    }
+
+
+def test_split_commands_are_merged_back_into_one_intent():
+    commands = [*make_execute_intent('light', 'fan')['payload']['commands'],
+                *make_execute_intent('light', on=False)['payload']['commands']]
+
+    device_commands = device.split_execute_commands(commands)
+
+    assert list(device_commands) == ['light', 'fan']
+    assert [command['devices'] for command in device_commands['light']] == [
+        [{'id': 'light'}], [{'id': 'light'}]]
+    assert device.merge_execute_commands(device_commands.values()) == commands
+
+
+def test_merge_execute_commands_groups_the_devices_of_the_same_execution():
+    light, fan = device.split_execute_commands(
+        make_execute_intent('light', 'fan')['payload']['commands']).values()
+
+    merged = device.merge_execute_commands([light, fan, light])
+
+    assert merged == make_execute_intent('light', 'fan')['payload']['commands']
+
+
+def test_handle_execute_intent_groups_the_devices_by_result():
+    commands = [*make_execute_intent('light', 'fan', 'tv')['payload']['commands'],
+                *make_execute_intent('light')['payload']['commands']]
+    offline = {'status': 'ERROR', 'errorCode': 'deviceOffline'}
+
+    assert device.handle_execute_intent(commands) == [
+        {'ids': ['light', 'fan', 'tv'], 'status': 'SUCCESS'}]
+    assert device.handle_execute_intent(
+        commands, {'fan': offline, 'tv': {'status': 'PENDING'}}) == [
+            {'ids': ['light'], 'status': 'SUCCESS'},
+            dict(offline, ids=['fan']),
+            {'ids': ['tv'], 'status': 'PENDING'}]
@@ -0,0 +1,42 @@
+import time
+
+from voicetalk.device.state import DeviceStateStore
+
+
+def test_expired_states_are_not_merged_into():
+    store = DeviceStateStore(stale_after=10, expire_after=60)
+    store.update(1, 'light', {'on': True, 'brightness': 80}, time.time() - 120)
+
+    store.update(1, 'light', {'on': False})
+
+    states, _ = store.get(1, 'light')
+    assert states == {'on': False}
+
+
+def test_prune_forgets_the_expired_states():
+    store = DeviceStateStore(stale_after=10, expire_after=60)
+    store.update(1, 'light', {'on': True}, time.time() - 120)
+    store.update(1, 'fan', {'on': True})
+
+    assert store.prune() == 1
+    assert store.get(1, 'light') is None
+    assert store.get(1, 'fan')[0] == {'on': True}
+    assert store.prune() == 0
+
+
+def test_stale_states_are_answered_without_a_state_feed():
+    store = DeviceStateStore(expire_after=600)
+    store.update(1, 'light', {'on': True}, time.time() - 400)
+
+    assert store.query(1, ['light']) == {
+        'light': {'on': True, 'online': True, 'status': 'SUCCESS'}}
+
+
+def test_stale_states_are_offline_with_a_state_feed():
+    store = DeviceStateStore(stale_after=300, expire_after=600)
+    store.update(1, 'light', {'on': True}, time.time() - 400)
+    store.update(1, 'fan', {'on': True}, time.time() - 700)
+
+    assert store.query(1, ['light', 'fan']) == {
+        'light': {'online': False, 'errorCode': 'deviceOffline', 'status': 'OFFLINE'},
+        'fan': {'errorCode': 'actionNotAvailable', 'status': 'ERROR'}}
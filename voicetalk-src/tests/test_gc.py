@@ -0,0 +1,62 @@
+import time
+
+from voicetalk.db import gc, models
+
+from test_oauth2 import add_authorization_code
+
+
+def add_link(db, u_id: int, token: str, expires_at: float) -> None:
+    with db.get_session_scope() as db_session:
+        db_session.add(models.RefreshToken(
+            token=token, u_id=u_id,
+            access_token=models.AccessToken(token=token, u_id=u_id, expires_at=expires_at)))
+
+
+def get_tokens(db) -> tuple:
+    with db.get_session_scope() as db_session:
+        return (sorted(token for token, in db_session.query(models.AccessToken.token)),
+                sorted(token for token, in db_session.query(models.RefreshToken.token)))
+
+
+def test_expired_authorization_codes_are_deleted(db, user):
+    add_authorization_code(db, user, 'expired', time.time() - 60)
+    add_authorization_code(db, user, 'live')
+
+    report = gc.collect(batch_size=1, pause=0)
+
+    assert report['AuthorizationCode'] == 1
+
+    with db.get_session_scope() as db_session:
+        codes = [code for code, in db_session.query(models.AuthorizationCode.code)]
+
+    assert codes == ['live']
+
+
+def test_links_are_kept_by_default(db, user):
+    add_link(db, user, 'live', time.time() + 3600)
+    add_link(db, user, 'inactive', time.time() - 90 * 86400)
+
+    gc.collect(pause=0)
+
+    assert get_tokens(db) == (['inactive', 'live'], ['inactive', 'live'])
+
+
+def test_tokens_of_removed_users_are_deleted(db, user):
+    add_link(db, user, 'live', time.time() + 3600)
+    add_link(db, user + 1, 'orphan', time.time() + 3600)
+
+    report = gc.collect(batch_size=1, pause=0)
+
+    assert (report['AccessToken'], report['RefreshToken']) == (1, 1)
+    assert get_tokens(db) == (['live'], ['live'])
+
+
+def test_idle_links_are_deleted_when_enabled(db, user):
+    add_link(db, user, 'live', time.time() + 3600)
+    add_link(db, user, 'expired', time.time() - 600)
+    add_link(db, user, 'idle', time.time() - 7200)
+
+    report = gc.collect(pause=0, refresh_token_idle=3600)
+
+    assert (report['AccessToken'], report['RefreshToken']) == (1, 1)
+    assert get_tokens(db) == (['expired', 'live'], ['expired', 'live'])
@@ -0,0 +1,50 @@
+import subprocess
+import sys
+import textwrap
+import threading
+
+import pytest
+
+from voicetalk.metrics import Registry
+
+GEVENT_SCRIPT = textwrap.dedent('''
+    from gevent import monkey
+    monkey.patch_all()
+
+    import gevent
+
+    from voicetalk.metrics import Registry
+
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests')
+
+    for _ in range(2):
+        gevent.joinall([gevent.spawn(requests.inc) for _ in range(500)])
+        registry.collect()
+
+    print(len(registry._Registry__shards), registry.collect()[('requests_total', ())])
+''')
+
+
+def test_shards_of_finished_threads_are_retired():
+    registry = Registry()
+    requests = registry.counter('requests_total', 'Requests')
+    threads = [threading.Thread(target=requests.inc) for _ in range(20)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert registry.collect()[('requests_total', ())] == 20
+    assert registry._Registry__shards == []
+
+
+def test_greenlets_share_the_shard_of_their_thread():
+    pytest.importorskip('gevent')
+
+    output = subprocess.run([sys.executable, '-c', GEVENT_SCRIPT], check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+
+    assert output.split() == ['1', '1000']
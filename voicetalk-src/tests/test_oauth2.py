@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+from sqlalchemy.exc import IntegrityError
+
+from voicetalk.db import models
+from voicetalk.oauth2 import oauth2
+
+REDIRECT_URI = 'https://oauth-redirect.googleusercontent.com/r/project'
+
+
+def add_authorization_code(db, u_id: int, code: str = 'code',
+                           expires_at: float = None) -> None:
+    with db.get_session_scope() as db_session:
+        db_session.add(models.AuthorizationCode(
+            code=code, u_id=u_id, redirect_uri=REDIRECT_URI,
+            expires_at=expires_at or time.time() + 600))
+
+
+def claim(db, code: str = 'code', redirect_uri: str = REDIRECT_URI):
+    with db.get_session_scope() as db_session:
+        return oauth2.claim_authorization_code(db_session, code, redirect_uri)
+
+
+def test_authorization_code_is_exchanged_once(db, user):
+    add_authorization_code(db, user)
+
+    assert claim(db) == user
+    assert claim(db) is None
+
+
+def test_invalid_authorization_code_is_consumed(db, user):
+    add_authorization_code(db, user, 'expired', time.time() - 1)
+    add_authorization_code(db, user, 'redirected')
+
+    assert claim(db, 'expired') is None
+    assert claim(db, 'redirected', 'https://attacker.test') is None
+    assert claim(db, 'redirected') is None
+    assert claim(db, 'unknown') is None
+
+
+def test_issue_tokens_retries_on_conflict(db, user, monkeypatch):
+    oauth2_tokens = iter(['access-1', 'taken', 'access-2', 'refresh-2'])
+    monkeypatch.setattr(oauth2, 'get_random_token', lambda length: next(oauth2_tokens))
+
+    with db.get_session_scope() as db_session:
+        db_session.add(models.RefreshToken(token='taken', u_id=user))
+
+    with db.get_session_scope() as db_session:
+        assert oauth2.issue_tokens(db_session, user) == ('access-2', 'refresh-2')
+
+    with db.get_session_scope() as db_session:
+        assert oauth2.access_token_exists(db_session, 'access-2')
+        assert not oauth2.access_token_exists(db_session, 'access-1')
+        assert db_session.query(models.RefreshToken).count() == 2
+
+
+def test_issue_tokens_gives_up_after_the_attempts(db, user, monkeypatch):
+    monkeypatch.setattr(oauth2, 'get_random_token', lambda length: 'taken')
+
+    with db.get_session_scope() as db_session:
+        db_session.add(models.RefreshToken(token='taken', u_id=user))
+
+    with pytest.raises(IntegrityError), db.get_session_scope() as db_session:
+        oauth2.issue_tokens(db_session, user)
+
+
+def test_refresh_rotates_the_access_token(db, user):
+    with db.get_session_scope() as db_session:
+        old_access_token, refresh_token = oauth2.issue_tokens(db_session, user)
+
+    with db.get_session_scope() as db_session:
+        refresh_token_instance = (db_session.query(models.RefreshToken)
+                                            .filter_by(token=refresh_token)
+                                            .one())
+        new_access_token = oauth2.rotate_access_token(db_session, refresh_token_instance)
+
+    assert new_access_token != old_access_token
+
+    with db.get_session_scope() as db_session:
+        assert not oauth2.access_token_exists(db_session, old_access_token)
+        access_token_instance = (db_session.query(models.AccessToken)
+                                           .filter_by(token=new_access_token)
+                                           .one())
+        assert oauth2.validate_access_token(access_token_instance)
+        assert access_token_instance.refresh_token.token == refresh_token
+        assert db_session.query(models.AccessToken).count() == 1
@@ -0,0 +1,105 @@
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+
+import pytest
+
+from voicetalk.config import config
+from voicetalk.utils import password
+
+GEVENT_SCRIPT = textwrap.dedent('''
+    from gevent import monkey
+    monkey.patch_all()
+
+    import gevent
+
+    from voicetalk.config import config
+    from voicetalk.utils import password
+
+    config.password_hasher_conf.update(time_cost=3, memory_cost=131072, parallelism=1)
+    hashed_password = password.hash('secret')
+    ticks = []
+
+    def tick():
+        while True:
+            ticks.append(None)
+            gevent.sleep(0.001)
+
+    gevent.spawn(tick)
+    gevent.sleep(0.01)
+    ticks.clear()
+
+    print(password.verify(hashed_password, 'secret'), len(ticks))
+''')
+
+
+class BlockingHasher:
+    def __init__(self):
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def verify(self, hashed_password, plaintext_password):
+        self.started.set()
+        self.released.wait(5)
+
+        return True
+
+
+@pytest.fixture
+def saturated(monkeypatch):
+    """A single password worker busy with a verification, without queue"""
+    hasher = BlockingHasher()
+    monkeypatch.setitem(config.password_hasher_conf, 'workers', 1)
+    monkeypatch.setitem(config.password_hasher_conf, 'queue_size', 0)
+    monkeypatch.setattr(password, '_executor', None)
+    monkeypatch.setattr(password, '_slots', None)
+    monkeypatch.setattr(password, 'get_password_hasher', lambda: hasher)
+
+    thread = threading.Thread(target=password.verify, args=('hash', 'secret'))
+    thread.start()
+    assert hasher.started.wait(5)
+
+    yield hasher
+
+    hasher.released.set()
+    thread.join()
+
+
+def test_saturated_workers_reject_right_away(saturated):
+    with pytest.raises(password.PasswordHasherBusy):
+        password.verify('hash', 'secret')
+
+    saturated.released.set()
+
+    # The slot is given back once the verification is done
+    for _ in range(100):
+        try:
+            assert password.verify('hash', 'secret')
+            break
+        except password.PasswordHasherBusy:
+            time.sleep(0.01)
+    else:
+        pytest.fail('The password worker is still busy')
+
+
+def test_login_is_unavailable_while_the_workers_are_saturated(db, user, saturated):
+    from voicetalk import server
+
+    response = server.app.test_client().post(
+        '/login', data={'username': 'tester', 'password': 'secret'})
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+
+def test_verification_does_not_block_the_gevent_hub():
+    pytest.importorskip('gevent')
+
+    output = subprocess.run([sys.executable, '-c', GEVENT_SCRIPT], check=True,
+                            stdout=subprocess.PIPE, universal_newlines=True).stdout
+    verified, ticks = output.split()
+
+    assert verified == 'True'
+    assert int(ticks) > 10
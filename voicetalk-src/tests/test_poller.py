@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+
+from voicetalk.iottalk import poller as poller_module
+from voicetalk.iottalk.poller import Poller
+
+
+class FakeRandom:
+    """Draw the middle of every range, and remember the ranges"""
+
+    def __init__(self):
+        self.ranges = []
+
+    def uniform(self, a, b):
+        self.ranges.append((a, b))
+
+        return (a + b) / 2
+
+
+@pytest.fixture
+def fake_random(monkeypatch):
+    fake_random = FakeRandom()
+    monkeypatch.setattr(poller_module, 'random', fake_random)
+
+    return fake_random
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def test_due_jobs_run_in_order(fake_random):
+    poller = Poller(workers=1)
+    calls = []
+    jobs = {}
+
+    def make_func(name):
+        def func():
+            calls.append(name)
+            jobs[name].cancel()
+
+        return func
+
+    # The first polls are due after half of their interval
+    for name, interval in (('slow', 0.3), ('fast', 0.1), ('medium', 0.2)):
+        jobs[name] = poller.add(make_func(name), interval)
+
+    wait_for(lambda: len(calls) == 3)
+
+    assert calls == ['fast', 'medium', 'slow']
+
+
+def test_intervals_are_jittered(fake_random):
+    poller = Poller(jitter=0.2)
+    called = threading.Event()
+    job = poller.add(lambda: called.set() or True, interval=0.05)
+
+    assert called.wait(5)
+    wait_for(lambda: len(fake_random.ranges) == 2)
+    job.cancel()
+
+    assert fake_random.ranges[0] == (0, 0.05)
+    assert fake_random.ranges[1] == pytest.approx((-0.01, 0.01))
+
+
+def test_failing_and_idle_jobs_back_off(fake_random):
+    poller = Poller(jitter=0)
+    intervals = []
+    results = iter([ValueError('pull failed'), False, False, False, True])
+
+    def poll():
+        intervals.append(job.current_interval)
+        result = next(results)
+
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+    job = poller.add(poll, interval=0.01, max_interval=0.05, backoff=2)
+    wait_for(lambda: len(intervals) == 5)
+    wait_for(lambda: job.current_interval == 0.01)
+    job.cancel()
+
+    assert intervals == [0.01, 0.02, 0.04, 0.05, 0.05]
+    assert poller.stats()['errors'] == 1
+
+
+def test_jobs_of_a_group_run_back_to_back(fake_random):
+    poller = Poller(workers=2)
+    threads = {}
+    jobs = []
+
+    def make_func(index):
+        def func():
+            threads[index] = threading.current_thread()
+            jobs[index].cancel()
+            time.sleep(0.01)
+
+        return func
+
+    # Hold the scheduler until all the jobs are due
+    with poller._Poller__condition:
+        jobs.extend(poller.add(make_func(index), interval=0.02, group_key='host')
+                    for index in range(4))
+        time.sleep(0.05)
+
+    wait_for(lambda: len(threads) == 4)
+
+    # Split in one group per worker, each one running on a single thread
+    assert threads[0] is threads[1]
+    assert threads[2] is threads[3]
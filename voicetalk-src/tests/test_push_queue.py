@@ -0,0 +1,69 @@
+import threading
+import time
+
+from voicetalk import metrics
+from voicetalk.iottalk.coalescer import PushCoalescer
+from voicetalk.iottalk.push_queue import PushQueue, PushQueueFull
+
+
+def get_count(name: str, *label_values) -> int:
+    samples = metrics.registry.collect().get((name, label_values))
+
+    return samples[-1] if samples else 0
+
+
+def wait_for(condition, timeout: float = 5):
+    deadline = time.monotonic() + timeout
+
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_wait_and_service_times_are_exported():
+    waits = get_count('voicetalk_push_queue_wait_seconds')
+    completed = get_count('voicetalk_push_queue_service_seconds', 'completed')
+    failed = get_count('voicetalk_push_queue_service_seconds', 'failed')
+    push_queue = PushQueue(workers=1)
+
+    push_queue.submit(time.sleep, 0.01).result(5)
+    push_queue.submit(int, 'not a number').exception(5)
+
+    wait_for(lambda: get_count('voicetalk_push_queue_service_seconds', 'failed') > failed)
+    assert get_count('voicetalk_push_queue_wait_seconds') == waits + 2
+    assert get_count('voicetalk_push_queue_service_seconds', 'completed') == completed + 1
+
+
+class Interrupted(BaseException):
+    pass
+
+
+def interrupt():
+    raise Interrupted()
+
+
+def test_worker_outlives_a_base_exception():
+    push_queue = PushQueue(workers=1)
+
+    assert isinstance(push_queue.submit(interrupt, key='user').exception(5), Interrupted)
+    assert push_queue.submit(int, '1', key='user').result(5) == 1
+    assert push_queue.stats()['failed'] == 1
+
+
+def test_coalescer_does_not_wait_for_a_full_shard():
+    push_queue = PushQueue(workers=1, max_size=1, overflow_policy='block',
+                           block_timeout=5)
+    release = threading.Event()
+    push_queue.submit(release.wait, 5)
+    wait_for(lambda: push_queue.stats()['depth'] == 0)
+    push_queue.submit(int, '1')
+    coalescer = PushCoalescer(lambda key, items: [True] * len(items), push_queue, 0.01)
+
+    started_at = time.monotonic()
+    future = coalescer.submit('user', 'item')
+
+    try:
+        assert isinstance(future.exception(2), PushQueueFull)
+        assert time.monotonic() - started_at < 2
+    finally:
+        release.set()
@@ -0,0 +1,38 @@
+import threading
+import time
+
+from voicetalk.iottalk import registry as registry_module
+from voicetalk.iottalk.registry import DANRegistry
+
+PROFILE = {'d_name': 'VoiceTalk', 'dm_name': 'VoiceTalk', 'df_list': ['Voice-I'],
+           'is_sim': False}
+
+
+def test_dan_evicted_during_its_registration_is_released(fake_csm, monkeypatch):
+    dans = []
+
+    class TrackedDAN(registry_module.DAN):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            dans.append(self)
+
+    monkeypatch.setattr(registry_module, 'DAN', TrackedDAN)
+    fake_csm.latency = 0.2
+    registry = DANRegistry(fake_csm.url, PROFILE, max_instances=1)
+    registering = threading.Thread(target=registry.get, args=(1,))
+    registering.start()
+    time.sleep(0.05)
+
+    # Evicts the DAN of user 1 while it is being registered
+    registry.get(2)
+    registering.join()
+
+    held = {dan for _, dan in registry.items()}
+    assert len(registry) == 1
+    assert len(held) == 1
+
+    for dan in dans:
+        assert (dan.control_channel_thread is not None) == (dan in held)
+
+    for dan in held:
+        dan.stop_control_channel()
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from voicetalk import server
+from voicetalk.device.catalog import DeviceCatalog
+from voicetalk.device.state import DeviceStateStore
+from voicetalk.iottalk.coalescer import PushCoalescer
+from voicetalk.iottalk.csmapi import CSMError
+from voicetalk.iottalk.push_queue import PushQueue
+from voicetalk.oauth2.token_cache import TokenCache
+
+from test_device import make_execute_intent
+
+
+@pytest.fixture
+def client(monkeypatch):
+    token_cache = TokenCache()
+    token_cache.put('token', 1, time.time() + 3600)
+    monkeypatch.setattr(server, 'token_cache', token_cache)
+    monkeypatch.setattr(server, 'signed_token_codec', None)
+    monkeypatch.setattr(server, 'device_state_store', DeviceStateStore())
+
+    return server.app.test_client()
+
+
+def fulfill(client, *inputs) -> dict:
+    response = client.post('/fulfillment',
+                           json={'requestId': '1', 'inputs': list(inputs)},
+                           headers={'Authorization': 'Bearer token'})
+    assert response.status_code == 200
+
+    return response.get_json()['payload']
+
+
+def test_execute_reports_the_result_of_every_device(client, monkeypatch):
+    def flush(u_id, device_commands):
+        # The fan is unknown on the IoTtalk, the light is pushed
+        return [CSMError('not found', 404) if commands[0]['devices'][0]['id'] == 'fan'
+                else True
+                for commands in device_commands]
+
+    monkeypatch.setattr(server, 'push_coalescer', PushCoalescer(flush, PushQueue(), 0))
+
+    payload = fulfill(client, make_execute_intent('light', 'fan'))
+
+    assert payload['commands'] == [
+        {'ids': ['light'], 'status': 'SUCCESS'},
+        {'ids': ['fan'], 'status': 'ERROR', 'errorCode': 'transientError'}]
+    assert server.device_state_store.get(1, 'light') is not None
+    assert server.device_state_store.get(1, 'fan') is None
+
+
+def test_execute_reports_an_unacknowledged_device_as_pending(client, monkeypatch):
+    def flush(u_id, device_commands):
+        if device_commands[0][0]['devices'][0]['id'] == 'fan':
+            time.sleep(0.5)
+
+        return [True] * len(device_commands)
+
+    monkeypatch.setattr(server, 'push_coalescer',
+                        PushCoalescer(flush, PushQueue(workers=2), 0))
+    monkeypatch.setitem(server.config.iottalk_conf, 'execute_deadline', 0.2)
+
+    payload = fulfill(client, make_execute_intent('light', 'fan'))
+
+    assert payload['commands'] == [{'ids': ['light'], 'status': 'SUCCESS'},
+                                   {'ids': ['fan'], 'status': 'PENDING'}]
+
+
+def test_sync_does_not_skip_the_other_inputs(client, monkeypatch, tmp_path):
+    device_file = tmp_path / 'devices.json'
+    device_file.write_text('[{"id": "light"}]')
+    device_catalog = DeviceCatalog(str(device_file))
+    device_catalog.load()
+    monkeypatch.setattr(server, 'device_catalog', device_catalog)
+
+    payload = fulfill(client, {'intent': 'action.devices.SYNC'},
+                      {'intent': 'action.devices.QUERY',
+                       'payload': {'devices': [{'id': 'light'}]}})
+
+    assert payload['agentUserId'] == 1
+    assert payload['devices'] == {
+        'light': {'errorCode': 'actionNotAvailable', 'status': 'ERROR'}}
@@ -0,0 +1,83 @@
+import os
+import time
+
+from voicetalk.iottalk.session_pool import SessionPool
+
+
+class Pool(SessionPool):
+    """Remember the sessions closed by the pool"""
+
+    def __init__(self, *args, **kwargs):
+        self.closed = []
+        super().__init__(*args, **kwargs)
+
+    def acquire(self):
+        session = super().acquire()
+        session.close = lambda: self.closed.append(session)
+
+        return session
+
+
+def test_most_recently_used_session_is_reused():
+    pool = Pool(max_sessions=2)
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+
+    assert pool.acquire() is second
+    assert pool.stats()['reused'] == 1
+    assert pool.stats()['created'] == 2
+
+
+def test_least_recently_used_session_is_evicted_over_the_size():
+    pool = Pool(max_sessions=2)
+    first, second = pool.acquire(), pool.acquire()
+    pool.configure(max_sessions=1)
+
+    pool.release(first)
+    pool.release(second)
+
+    assert pool.closed == [first]
+    assert pool.stats()['evicted'] == 1
+    assert pool.acquire() is second
+
+
+def test_idle_sessions_are_closed_after_the_timeout():
+    pool = Pool(idle_timeout=0.05)
+    first = pool.acquire()
+    pool.release(first)
+    time.sleep(0.1)
+
+    assert pool.acquire() is not first
+    assert pool.closed == [first]
+    assert pool.stats()['evicted'] == 1
+
+
+def test_full_pool_creates_transient_sessions():
+    pool = Pool(max_sessions=1)
+    pool.acquire()
+    transient = pool.acquire()
+
+    assert pool.stats()['overflow'] == 1
+    assert pool.stats()['in_use'] == 1
+
+    pool.release(transient)
+
+    assert pool.closed == [transient]
+    assert pool.stats()['idle'] == 0
+
+
+def test_sessions_of_the_parent_process_are_dropped(monkeypatch):
+    pool = Pool()
+    idle, in_use = pool.acquire(), pool.acquire()
+    pool.release(idle)
+    parent_pid = os.getpid()
+
+    monkeypatch.setattr(os, 'getpid', lambda: parent_pid + 1)
+    session = pool.acquire()
+
+    # The sockets are shared with the parent, they are not closed
+    assert session not in (idle, in_use)
+    assert pool.closed == []
+    assert pool.stats()['in_use'] == 1
+    assert pool.stats()['idle'] == 0
@@ -0,0 +1,94 @@
+import base64
+import time
+
+from voicetalk.oauth2.signed_token import (RevocationList, RevocationStore,
+                                           SignedTokenCodec, is_signed)
+
+KEYS = [('k1', 'secret')]
+
+
+def tamper(part: str) -> str:
+    """Flip a bit of a base64url part of a token"""
+    data = bytearray(base64.urlsafe_b64decode(part + '=' * (-len(part) % 4)))
+    data[0] ^= 1
+
+    return base64.urlsafe_b64encode(bytes(data)).rstrip(b'=').decode()
+
+
+def make_codec(**options):
+    return SignedTokenCodec(KEYS, RevocationList(store=RevocationStore(), **options))
+
+
+def test_signed_token_is_verified():
+    codec = SignedTokenCodec(KEYS)
+    token = codec.encode(42, time.time() + 3600)
+
+    assert is_signed(token)
+    assert codec.verify(token) == 42
+
+
+def test_forged_tokens_are_rejected():
+    codec = SignedTokenCodec(KEYS)
+    kid, payload, signature = codec.encode(42, time.time() + 3600).split('.')
+    other_user = codec.encode(7, time.time() + 3600).split('.')[1]
+
+    assert codec.verify('.'.join([kid, other_user, signature])) is None
+    assert codec.verify('.'.join([kid, tamper(payload), signature])) is None
+    assert codec.verify('.'.join([kid, payload, tamper(signature)])) is None
+    assert codec.verify('.'.join(['k2', payload, signature])) is None
+    assert codec.verify('.'.join([kid, payload])) is None
+    assert codec.verify('not.a.token') is None
+    assert SignedTokenCodec([('k1', 'other secret')]).verify(
+        '.'.join([kid, payload, signature])) is None
+
+
+def test_expired_token_is_rejected():
+    codec = SignedTokenCodec(KEYS)
+
+    assert codec.verify(codec.encode(42, time.time() - 1)) is None
+
+
+def test_token_signed_by_a_retired_key_is_accepted_during_rotation():
+    token = SignedTokenCodec(KEYS).encode(42, time.time() + 3600)
+    rotated = SignedTokenCodec([('k2', 'new secret')] + KEYS)
+
+    assert rotated.verify(token) == 42
+    assert rotated.encode(42, time.time() + 3600).startswith('k2.')
+
+
+def test_revocations_survive_a_restart(user):
+    codec = make_codec()
+    refreshed = codec.encode(user, time.time() + 3600)
+    kept = codec.encode(user, time.time() + 3600)
+
+    codec.revoke(refreshed)
+
+    restarted = make_codec()
+    assert restarted.verify(refreshed) is None
+    assert restarted.verify(kept) == user
+
+
+def test_revocations_reach_the_other_processes(user):
+    worker = make_codec(sync_interval=0)
+    other_worker = make_codec(sync_interval=0)
+    token = worker.encode(user, time.time() + 3600)
+
+    assert other_worker.verify(token) == user
+
+    worker.revoke_user(user)
+
+    assert worker.verify(token) is None
+    assert other_worker.verify(token) is None
+    assert other_worker.verify(worker.encode(user, time.time() + 3600)) == user
+
+
+def test_expired_revocations_are_deleted(db, user):
+    store = RevocationStore()
+    store.add_token(user, b'nonce1', time.time() - 1)
+    store.add_token(user, b'nonce2', time.time() + 60)
+
+    tokens, users = store.load()
+
+    assert list(tokens) == [b'nonce2']
+    assert users == {}
+    assert store.load() == (tokens, users)
@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+from voicetalk.oauth2 import token_cache as token_cache_module
+from voicetalk.oauth2.token_cache import TokenCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000000.0]
+    monkeypatch.setattr(token_cache_module.time, 'time', lambda: now[0])
+
+    return now
+
+
+def test_refreshed_token_is_invalidated():
+    cache = TokenCache()
+    cache.put('old', 1, time.time() + 3600)
+    cache.put('other', 2, time.time() + 3600)
+
+    cache.invalidate('old')
+
+    assert cache.get('old') is None
+    assert cache.get('other') == 2
+
+
+def test_disconnect_invalidates_the_tokens_of_the_user():
+    cache = TokenCache()
+    cache.put('phone', 1, time.time() + 3600)
+    cache.put('speaker', 1, time.time() + 3600)
+    cache.put('other', 2, time.time() + 3600)
+
+    cache.invalidate_user(1)
+
+    assert cache.get('phone') is None
+    assert cache.get('speaker') is None
+    assert cache.get('other') == 2
+
+
+def test_token_of_removed_user_is_dropped_after_the_ttl(clock):
+    # A user removed by the CLI is not invalidated in the server process
+    cache = TokenCache(ttl=30)
+    cache.put('token', 1, clock[0] + 3600)
+
+    clock[0] += 29
+    assert cache.get('token') == 1
+
+    clock[0] += 2
+    assert cache.get('token') is None
+
+
+def test_token_is_never_served_after_it_expires(clock):
+    cache = TokenCache(ttl=30)
+    cache.put('token', 1, clock[0] + 10)
+
+    clock[0] += 11
+    assert cache.get('token') is None
@@ -1,6 +1,7 @@
 import logging
 
-from voicetalk.config import config
+from voicetalk import db
+from voicetalk.account.cache import UserIdentity, identity_cache
 from voicetalk.db import models
 from voicetalk.db.db import DB
 from voicetalk.utils import password
@@ -36,9 +37,54 @@ def get(db_session, username: str) -> models.User or None:
                       .first())
 
 
+def get_identity(u_id: int) -> UserIdentity or None:
+    """
+    Get the identity of the given user, from the cache if possible.
+
+    :param u_id: User ID
+    :type u_id: int
+    :return: The identity if the user exists, ``None`` otherwise.
+    :rtype: voicetalk.account.cache.UserIdentity or None
+    """
+    identity = identity_cache.get(u_id)
+
+    if identity is not None:
+        return identity
+
+    with DB().get_session_scope() as db_session:
+        row = (db_session.query(models.User.id, models.User.username,
+                                models.User.is_active, models.User.is_anonymous,
+                                models.User.is_authenticated)
+                         .filter_by(id=u_id)
+                         .first())
+
+    if row is None:
+        return None
+
+    identity = UserIdentity.from_user(row)
+    identity_cache.put(identity)
+
+    return identity
+
+
+def change_password(user: models.User, plaintext_password: str) -> None:
+    """
+    Hash and set the password of the given user, the change is committed with
+    the session of the user. The cached identities carry no password, they are
+    kept.
+
+    :param user: The mapped User object
+    :param plaintext_password: New password
+    :type plaintext_password: ``str``
+    :raise PasswordHasherBusy: If the password hasher is saturated.
+    :raise RuntimeError: If the password fails to be hashed.
+    """
+    user.password = password.hash(plaintext_password)
+
+
 def add_an_user(username: str, plaintext_password: str) -> models.User or None:
     db_instance = DB()
-    db_instance.connect(config.db_conf['url'])
+    db.connect()
 
     if not username or not plaintext_password:
         return None
@@ -57,8 +103,17 @@ def add_an_user(username: str, plaintext_password: str) -> models.User or None:
 
 
 def remove_an_user(username: str) -> None:
+    """
+    Remove the user whose username is the given username.
+
+    It runs in the CLI process, the servers keep the identity of the user in
+    their cache, so the user is logged out within ``user-cache-ttl`` seconds.
+
+    :param username: Username
+    :type username: ``str``
+    """
     db_instance = DB()
-    db_instance.connect(config.db_conf['url'])
+    db.connect()
 
     if not username:
         return
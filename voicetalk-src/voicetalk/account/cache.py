@@ -0,0 +1,140 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+__all__ = ['UserIdentity', 'UserIdentityCache', 'identity_cache']
+
+
+class UserIdentity:
+    """What Flask-Login needs of a user, detached from any DB session"""
+
+    __slots__ = ('id', 'username', 'is_active', 'is_anonymous', 'is_authenticated')
+
+    def __init__(self, id: int, username: str, is_active: bool = True,
+                 is_anonymous: bool = False, is_authenticated: bool = True):
+        self.id = id
+        self.username = username
+        self.is_active = bool(is_active)
+        self.is_anonymous = bool(is_anonymous)
+        self.is_authenticated = bool(is_authenticated)
+
+    @classmethod
+    def from_user(cls, user):
+        """
+        :param user: The mapped User object, or a row of its columns
+        :rtype: UserIdentity
+        """
+        return cls(user.id, user.username, user.is_active, user.is_anonymous,
+                   user.is_authenticated)
+
+    def get_id(self):
+        return self.id
+
+
+class UserIdentityCache:
+    """Bounded, TTL-aware cache of the identities of the logged in users.
+
+    Flask-Login loads the user of every request carrying a session cookie, the
+    cache maps a user ID to its ``UserIdentity`` so that it is not queried
+    again for ``ttl`` seconds. The least recently used entry is evicted when
+    the cache is full.
+
+    The cache lives in the process memory, so an invalidation only affects the
+    process that performs it, e.g. a user removed by the CLI is seen by the
+    server within ``ttl`` seconds.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60):
+        """
+        :param max_size: Maximum number of cached users. ``0`` disables the cache.
+        :type max_size: int
+        :param ttl: Seconds an identity is cached
+        :type ttl: float
+        """
+        self.max_size = max(0, max_size)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def configure(self, max_size: int = 1024, ttl: float = 60) -> None:
+        with self.__lock:
+            self.max_size = max(0, max_size)
+            self.ttl = ttl
+            self.__entries.clear()
+
+    def get(self, u_id: int) -> UserIdentity or None:
+        """Get the cached and unexpired identity of the given user
+
+        :param u_id: User ID
+        :type u_id: int
+        :return: The identity on a cache hit, ``None`` otherwise.
+        :rtype: UserIdentity or None
+        """
+        with self.__lock:
+            entry = self.__entries.get(u_id)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            identity, expires_at = entry
+
+            if time.monotonic() > expires_at:
+                del self.__entries[u_id]
+                self.misses += 1
+                return None
+
+            self.__entries.move_to_end(u_id)
+            self.hits += 1
+
+            return identity
+
+    def put(self, identity: UserIdentity) -> None:
+        if not self.max_size:
+            return
+
+        with self.__lock:
+            self.__entries[identity.id] = (identity, time.monotonic() + self.ttl)
+            self.__entries.move_to_end(identity.id)
+
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def invalidate(self, u_id: int) -> None:
+        """Drop the given user from the cache
+
+        :param u_id: User ID
+        :type u_id: int
+        """
+        with self.__lock:
+            self.__entries.pop(u_id, None)
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+
+    @property
+    def stats(self) -> dict:
+        """Hit/miss counters and the current occupancy of the cache
+
+        :rtype: dict
+        """
+        with self.__lock:
+            size = len(self.__entries)
+
+        lookups = self.hits + self.misses
+
+        return {
+            'size': size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
+
+
+# Shared by the server and the account functions invalidating it
+identity_cache = UserIdentityCache()
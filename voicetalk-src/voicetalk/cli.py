@@ -1,14 +1,14 @@
 import logging
-import pkg_resources
-import subprocess
 import sys
 
 from argparse import ArgumentParser
 
 from voicetalk import version
-from voicetalk import utils
 from voicetalk.config import config
 
+# Keep the imports of this module light, every ``voice-talk`` invocation pays
+# for them. The sub-commands import what they need themselves.
+
 
 def main():
     parser, args = parse_args()
@@ -102,6 +102,14 @@ def parse_db_subcommand(db_command_subparsers):
     db_create_parser = db_command_subparsers.add_parser('create', description=msg, help=msg)
     db_create_parser.set_defaults(func=create_db)
 
+    msg = 'Delete the expired authorization codes and tokens'
+    db_gc_parser = db_command_subparsers.add_parser('gc', description=msg, help=msg)
+    db_gc_parser.add_argument('--batch-size', dest='batch_size', type=int, default=None,
+                              help='Rows deleted per transaction')
+    db_gc_parser.add_argument('--pause', dest='pause', type=float, default=None,
+                              help='Seconds to sleep between two batches')
+    db_gc_parser.set_defaults(func=gc_db)
+
 
 def add_user(args):
     import getpass
@@ -127,19 +135,21 @@ def remove_user(args):
 
 
 def handle_genconf(args):
-    sample_configuration_file_path = \
-        pkg_resources.resource_filename('voicetalk', 'conf/voicetalk.ini.sample')
-    utils.copy_sample_file(sample_configuration_file_path,
-                           getattr(args, 'sample_conf_destination'),
-                           'Sample configuration file does not exist')
+    from voicetalk import utils
+
+    with utils.resource_path('conf/voicetalk.ini.sample') as sample_configuration_file_path:
+        utils.copy_sample_file(str(sample_configuration_file_path),
+                               getattr(args, 'sample_conf_destination'),
+                               'Sample configuration file does not exist')
 
 
 def handle_gen_device_file(args):
-    sample_device_json_file_path = \
-        pkg_resources.resource_filename('voicetalk', 'device/device.json.sample')
-    utils.copy_sample_file(sample_device_json_file_path,
-                           getattr(args, 'sample_device_json_file_destination'),
-                           'Sample device file does not exist')
+    from voicetalk import utils
+
+    with utils.resource_path('device/device.json.sample') as sample_device_json_file_path:
+        utils.copy_sample_file(str(sample_device_json_file_path),
+                               getattr(args, 'sample_device_json_file_destination'),
+                               'Sample device file does not exist')
 
 
 def create_db(args):
@@ -148,21 +158,84 @@ def create_db(args):
     db.create()
 
 
+def gc_db(args):
+    from voicetalk import db
+    from voicetalk.db import gc
+
+    batch_size = getattr(args, 'batch_size')
+    pause = getattr(args, 'pause')
+
+    db.connect()
+    gc.collect(
+        batch_size=config.db_conf['gc_batch_size'] if batch_size is None else batch_size,
+        pause=config.db_conf['gc_pause'] if pause is None else pause,
+        refresh_token_idle=config.db_conf['gc_refresh_token_idle'])
+
+
+def get_uwsgi_command(argv: list) -> list:
+    """Build the uWSGI command line serving VoiceTalk as configured in ``[uwsgi]``
+
+    The master process builds the app once and forks the workers. Every worker
+    serves the requests on its threads, or on gevent greenlets if enabled.
+    The background threads of VoiceTalk, e.g. the pollers, need
+    ``--enable-threads`` in both cases.
+
+    :param argv: Arguments of ``voice-talk``, passed to the app by uWSGI
+    :type argv: list
+    :rtype: list
+    """
+    uwsgi_conf = config.uwsgi_conf
+    command = ['uwsgi', '--master', '--die-on-term',
+               '--http-socket', '{}:{}'.format(config.bind_address, config.bind_port),
+               # The connection is closed after every response. Tell the clients not
+               # to reuse it, so that none of them sends a request on a closed one.
+               '--add-header', 'Connection: close',
+               '--buffer-size', '8192',
+               '--listen', str(uwsgi_conf['listen']),
+               '--processes', str(max(1, uwsgi_conf['processes'])),
+               '--enable-threads']
+
+    if uwsgi_conf['gevent'] > 0:
+        # Patch the standard library before the app is built in the master
+        command += ['--gevent', str(uwsgi_conf['gevent']), '--gevent-early-monkey-patch']
+    else:
+        command += ['--threads', str(max(1, uwsgi_conf['threads']))]
+
+    return command + ['--wsgi', 'voicetalk.wsgi', '--pyargv', ' '.join(argv)]
+
+
 def start_voicetalk(args):
     try:
         # Using this import statement to check whether it's in uwsgi or not
-        import uwsgi  # noqa: F401
+        import uwsgi
     except ModuleNotFoundError:
-        subprocess.run(['uwsgi', '--http-socket',
-                        '{}:{}'.format(config.bind_address, config.bind_port),
-                        '--buffer-size', '8192',
-                        '--wsgi', 'voicetalk.wsgi',
-                        '--pyargv', ' '.join(sys.argv[1:])])
-    else:
-        from voicetalk.server import app
-        load_flask_config(app)
+        import subprocess
+
+        uses_gevent = config.uwsgi_conf['gevent'] > 0
 
-        return app
+        if uses_gevent and config.iottalk_conf['http_client'] != 'requests':
+            print('gevent requires http-client = requests in [iottalk]')
+            sys.exit(1)
+
+        subprocess.run(get_uwsgi_command(sys.argv[1:]))
+    else:
+        from voicetalk import server
+        load_flask_config(server.app)
+        server.init_app(args)
+
+        def warm_up():
+            # The DAs of the linked users are registered once, by the first worker
+            server.warm_up(register_linked_users=uwsgi.worker_id() == 1)
+
+        if uwsgi.worker_id() == 0:
+            # Loaded in the master process, warm up every worker once forked
+            import uwsgidecorators
+            uwsgidecorators.postfork(warm_up)
+        else:
+            # Loaded in the worker itself, e.g. with ``--lazy-apps``
+            warm_up()
+
+        return server.app
 
 
 def load_config(args, config_file_arg_name: str = 'ini_path'):
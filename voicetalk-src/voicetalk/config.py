@@ -1,4 +1,5 @@
 import logging
+import os
 
 from configparser import ConfigParser
 from pathlib import Path
@@ -6,15 +7,50 @@ from pathlib import Path
 logger = logging.getLogger('VoiceTalk.config')
 
 
+def parse_bool(value: str) -> bool:
+    """Parse the booleans the way ``ConfigParser.getboolean`` does"""
+    value = str(value).lower()
+
+    if value not in ConfigParser.BOOLEAN_STATES:
+        raise ValueError('Not a boolean: {}'.format(value))
+
+    return ConfigParser.BOOLEAN_STATES[value]
+
+
 class Config:
     __bind_address = '0.0.0.0'
     __bind_port = 443
     __flask_secret_key = 'FLASK_SECRET_KEY'
     __username = ''
     __password = ''
+    __password_hasher_conf = {
+        'time_cost': 2,
+        'memory_cost': 102400,
+        'parallelism': 2 * (os.cpu_count() or 1),
+        'workers': 2,
+        'queue_size': 16
+    }
+    __user_cache_conf = {
+        'max_size': 1024,
+        'ttl': 60.0
+    }
+    __uwsgi_conf = {
+        'processes': 1,
+        'threads': 8,
+        'gevent': 0,
+        'listen': 100
+    }
     __db_conf = {
         'url': 'DB_URL',
-        'pool_recycle': 600
+        'pool_size': 5,
+        'max_overflow': 10,
+        'pool_timeout': 30.0,
+        'pool_recycle': 600,
+        'pool_pre_ping': False,
+        'echo_pool': False,
+        'gc_batch_size': 500,
+        'gc_pause': 0.1,
+        'gc_refresh_token_idle': 0
     }
     __google_conf = {
         'client_id': 'CLIENT_ID',
@@ -25,7 +61,68 @@ class Config:
         'host': 'http://iottalk.tw:9999',
         'device_name': '311_GoogleHome',
         'device_model_name': 'GoogleHome',
-        'device_feature': 'Voice-I'
+        'device_feature': 'Voice-I',
+        'state_feature': '',
+        'state_poll_interval': 1.0,
+        'state_poll_max_interval': 10.0,
+        'max_dan_instances': 256,
+        'dan_idle_timeout': 3600,
+        'registration_workers': 2,
+        'registration_attempts': 5,
+        'registration_backoff': 1.0,
+        'registration_max_backoff': 30.0,
+        'http_client': 'requests',
+        'http_pool_max_sessions': 16,
+        'http_pool_idle_timeout': 300.0,
+        'http_pool_connections': 10,
+        'http_pool_maxsize': 10,
+        'http_limit_per_host': 10,
+        'http_keepalive_timeout': 30.0,
+        'breaker_failure_threshold': 5,
+        'breaker_open_seconds': 5.0,
+        'timeout_min': 1.0,
+        'timeout_max': 10.0,
+        'timeout_percentile': 99.0,
+        'timeout_multiplier': 3.0,
+        'retry_attempts': 3,
+        'retry_backoff': 0.05,
+        'retry_max_backoff': 1.0,
+        'retry_budget': 0.1,
+        'poll_workers': 2,
+        'control_channel_interval': 2.0,
+        'control_channel_max_interval': 10.0,
+        'push_workers': 4,
+        'push_queue_size': 1024,
+        'push_overflow_policy': 'drop-oldest',
+        'push_block_timeout': 1.0,
+        'push_coalesce_window_ms': 20,
+        'execute_deadline': 2.0
+    }
+    __device_conf = {
+        'state_stale_after': 300,
+        'state_expire_after': 86400
+    }
+    __oauth2_conf = {
+        'token_cache_size': 1024,
+        'token_cache_ttl': 30.0,
+        'access_token_format': 'opaque',
+        'signing_keys': '',
+        'revocation_sync_interval': 5.0
+    }
+    __metrics_conf = {
+        'multiprocess_dir': '',
+        'flush_interval': 5.0
+    }
+    __tracing_conf = {
+        'sample_rate': 0.0,
+        'output': '-'
+    }
+    __homegraph_conf = {
+        'sink': 'none',
+        'service_account_file': '',
+        'report_state_debounce': 1.0,
+        'report_state_max_delay': 5.0,
+        'catalog_check_interval': 10.0
     }
 
     def read_config(self, path: str):
@@ -65,11 +162,41 @@ class Config:
             set_(self, 'flask_secret_key', s)
             set_(self, 'username', s)
             set_(self, 'password', s)
+            set_(self.__password_hasher_conf, 'time_cost', s, data_type=int,
+                 option='password-time-cost')
+            set_(self.__password_hasher_conf, 'memory_cost', s, data_type=int,
+                 option='password-memory-cost')
+            set_(self.__password_hasher_conf, 'parallelism', s, data_type=int,
+                 option='password-parallelism')
+            set_(self.__password_hasher_conf, 'workers', s, data_type=int,
+                 option='password-workers')
+            set_(self.__password_hasher_conf, 'queue_size', s, data_type=int,
+                 option='password-queue-size')
+            set_(self.__user_cache_conf, 'max_size', s, data_type=int,
+                 option='user-cache-size')
+            set_(self.__user_cache_conf, 'ttl', s, data_type=float, option='user-cache-ttl')
+
+        if config.has_section('uwsgi'):
+            s = dict(config.items('uwsgi'))
+            set_(self.__uwsgi_conf, 'processes', s, data_type=int)
+            set_(self.__uwsgi_conf, 'threads', s, data_type=int)
+            set_(self.__uwsgi_conf, 'gevent', s, data_type=int)
+            set_(self.__uwsgi_conf, 'listen', s, data_type=int)
 
         if config.has_section('db'):
             s = dict(config.items('db'))
             set_(self.__db_conf, 'url', s)
+            set_(self.__db_conf, 'pool_size', s, data_type=int, option='pool-size')
+            set_(self.__db_conf, 'max_overflow', s, data_type=int, option='max-overflow')
+            set_(self.__db_conf, 'pool_timeout', s, data_type=float, option='pool-timeout')
             set_(self.__db_conf, 'pool_recycle', s, data_type=int, option='pool-recycle')
+            set_(self.__db_conf, 'pool_pre_ping', s, parse_func=parse_bool,
+                 option='pool-pre-ping')
+            set_(self.__db_conf, 'echo_pool', s, parse_func=parse_bool, option='echo-pool')
+            set_(self.__db_conf, 'gc_batch_size', s, data_type=int, option='gc-batch-size')
+            set_(self.__db_conf, 'gc_pause', s, data_type=float, option='gc-pause')
+            set_(self.__db_conf, 'gc_refresh_token_idle', s, data_type=float,
+                 option='gc-refresh-token-idle')
 
         if config.has_section('google-api'):
             s = dict(config.items('google-api'))
@@ -83,6 +210,117 @@ class Config:
             set_(self.__iottalk_conf, 'device_name', s)
             set_(self.__iottalk_conf, 'device_model_name', s)
             set_(self.__iottalk_conf, 'device_feature', s)
+            set_(self.__iottalk_conf, 'state_feature', s, option='state-feature')
+            set_(self.__iottalk_conf, 'state_poll_interval', s, data_type=float,
+                 option='state-poll-interval')
+            set_(self.__iottalk_conf, 'state_poll_max_interval', s, data_type=float,
+                 option='state-poll-max-interval')
+            set_(self.__iottalk_conf, 'max_dan_instances', s, data_type=int,
+                 option='max-dan-instances')
+            set_(self.__iottalk_conf, 'dan_idle_timeout', s, data_type=float,
+                 option='dan-idle-timeout')
+            set_(self.__iottalk_conf, 'registration_workers', s, data_type=int,
+                 option='registration-workers')
+            set_(self.__iottalk_conf, 'registration_attempts', s, data_type=int,
+                 option='registration-attempts')
+            set_(self.__iottalk_conf, 'registration_backoff', s, data_type=float,
+                 option='registration-backoff')
+            set_(self.__iottalk_conf, 'registration_max_backoff', s, data_type=float,
+                 option='registration-max-backoff')
+            set_(self.__iottalk_conf, 'http_client', s, option='http-client')
+            set_(self.__iottalk_conf, 'http_pool_max_sessions', s, data_type=int,
+                 option='http-pool-max-sessions')
+            set_(self.__iottalk_conf, 'http_pool_idle_timeout', s, data_type=float,
+                 option='http-pool-idle-timeout')
+            set_(self.__iottalk_conf, 'http_pool_connections', s, data_type=int,
+                 option='http-pool-connections')
+            set_(self.__iottalk_conf, 'http_pool_maxsize', s, data_type=int,
+                 option='http-pool-maxsize')
+            set_(self.__iottalk_conf, 'http_limit_per_host', s, data_type=int,
+                 option='http-limit-per-host')
+            set_(self.__iottalk_conf, 'http_keepalive_timeout', s, data_type=float,
+                 option='http-keepalive-timeout')
+            set_(self.__iottalk_conf, 'breaker_failure_threshold', s, data_type=int,
+                 option='breaker-failure-threshold')
+            set_(self.__iottalk_conf, 'breaker_open_seconds', s, data_type=float,
+                 option='breaker-open-seconds')
+            set_(self.__iottalk_conf, 'timeout_min', s, data_type=float,
+                 option='timeout-min')
+            set_(self.__iottalk_conf, 'timeout_max', s, data_type=float,
+                 option='timeout-max')
+            set_(self.__iottalk_conf, 'timeout_percentile', s, data_type=float,
+                 option='timeout-percentile')
+            set_(self.__iottalk_conf, 'timeout_multiplier', s, data_type=float,
+                 option='timeout-multiplier')
+            set_(self.__iottalk_conf, 'retry_attempts', s, data_type=int,
+                 option='retry-attempts')
+            set_(self.__iottalk_conf, 'retry_backoff', s, data_type=float,
+                 option='retry-backoff')
+            set_(self.__iottalk_conf, 'retry_max_backoff', s, data_type=float,
+                 option='retry-max-backoff')
+            set_(self.__iottalk_conf, 'retry_budget', s, data_type=float,
+                 option='retry-budget')
+            set_(self.__iottalk_conf, 'poll_workers', s, data_type=int,
+                 option='poll-workers')
+            set_(self.__iottalk_conf, 'control_channel_interval', s, data_type=float,
+                 option='control-channel-interval')
+            set_(self.__iottalk_conf, 'control_channel_max_interval', s, data_type=float,
+                 option='control-channel-max-interval')
+            set_(self.__iottalk_conf, 'push_workers', s, data_type=int,
+                 option='push-workers')
+            set_(self.__iottalk_conf, 'push_queue_size', s, data_type=int,
+                 option='push-queue-size')
+            set_(self.__iottalk_conf, 'push_overflow_policy', s,
+                 option='push-overflow-policy')
+            set_(self.__iottalk_conf, 'push_block_timeout', s, data_type=float,
+                 option='push-block-timeout')
+            set_(self.__iottalk_conf, 'push_coalesce_window_ms', s, data_type=float,
+                 option='push-coalesce-window-ms')
+            set_(self.__iottalk_conf, 'execute_deadline', s, data_type=float,
+                 option='execute-deadline')
+
+        if config.has_section('device'):
+            s = dict(config.items('device'))
+            set_(self.__device_conf, 'state_stale_after', s, data_type=float,
+                 option='state-stale-after')
+            set_(self.__device_conf, 'state_expire_after', s, data_type=float,
+                 option='state-expire-after')
+
+        if config.has_section('oauth2'):
+            s = dict(config.items('oauth2'))
+            set_(self.__oauth2_conf, 'token_cache_size', s, data_type=int,
+                 option='token-cache-size')
+            set_(self.__oauth2_conf, 'token_cache_ttl', s, data_type=float,
+                 option='token-cache-ttl')
+            set_(self.__oauth2_conf, 'access_token_format', s,
+                 option='access-token-format')
+            set_(self.__oauth2_conf, 'signing_keys', s, option='signing-keys')
+            set_(self.__oauth2_conf, 'revocation_sync_interval', s, data_type=float,
+                 option='revocation-sync-interval')
+
+        if config.has_section('metrics'):
+            s = dict(config.items('metrics'))
+            set_(self.__metrics_conf, 'multiprocess_dir', s, option='multiprocess-dir')
+            set_(self.__metrics_conf, 'flush_interval', s, data_type=float,
+                 option='flush-interval')
+
+        if config.has_section('tracing'):
+            s = dict(config.items('tracing'))
+            set_(self.__tracing_conf, 'sample_rate', s, data_type=float,
+                 option='sample-rate')
+            set_(self.__tracing_conf, 'output', s)
+
+        if config.has_section('homegraph'):
+            s = dict(config.items('homegraph'))
+            set_(self.__homegraph_conf, 'sink', s)
+            set_(self.__homegraph_conf, 'service_account_file', s,
+                 option='service-account-file')
+            set_(self.__homegraph_conf, 'report_state_debounce', s, data_type=float,
+                 option='report-state-debounce')
+            set_(self.__homegraph_conf, 'report_state_max_delay', s, data_type=float,
+                 option='report-state-max-delay')
+            set_(self.__homegraph_conf, 'catalog_check_interval', s, data_type=float,
+                 option='catalog-check-interval')
 
     @property
     def bind_address(self):
@@ -127,6 +365,18 @@ class Config:
     def password(self, password: str):
         self.__password = password
 
+    @property
+    def password_hasher_conf(self):
+        return self.__password_hasher_conf
+
+    @property
+    def user_cache_conf(self):
+        return self.__user_cache_conf
+
+    @property
+    def uwsgi_conf(self):
+        return self.__uwsgi_conf
+
     @property
     def db_conf(self):
         return self.__db_conf
@@ -139,6 +389,26 @@ class Config:
     def iottalk_conf(self):
         return self.__iottalk_conf
 
+    @property
+    def device_conf(self):
+        return self.__device_conf
+
+    @property
+    def oauth2_conf(self):
+        return self.__oauth2_conf
+
+    @property
+    def metrics_conf(self):
+        return self.__metrics_conf
+
+    @property
+    def tracing_conf(self):
+        return self.__tracing_conf
+
+    @property
+    def homegraph_conf(self):
+        return self.__homegraph_conf
+
     def __parse_port(self, port: int) -> int:
         port = int(port)
 
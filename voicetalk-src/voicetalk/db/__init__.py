@@ -1,18 +1,47 @@
 import logging
-import pkg_resources
 import subprocess
 
 from voicetalk.config import config
+from voicetalk.utils import resource_path
 
 logger = logging.getLogger('VoiceTalk.db')
 
 
-def create():
-    alembic_directory = pkg_resources.resource_filename('voicetalk', 'alembic/alembic.ini')
+def get_engine_options(db_conf: dict) -> dict:
+    """Map the ``[db]`` pool options to the ``create_engine`` keyword arguments
+
+    SQLite uses a pool without a size, so the sizing options are dropped for it.
+
+    :param db_conf: ``config.db_conf``
+    :type db_conf: dict
+    :rtype: dict
+    """
+    options = {
+        'pool_recycle': db_conf['pool_recycle'],
+        'pool_pre_ping': db_conf['pool_pre_ping'],
+        'echo_pool': db_conf['echo_pool']
+    }
+
+    if not db_conf['url'].startswith('sqlite'):
+        options.update(pool_size=db_conf['pool_size'],
+                       max_overflow=db_conf['max_overflow'],
+                       pool_timeout=db_conf['pool_timeout'])
+
+    return options
 
-    result = subprocess.run(
-        ['alembic', '-c', alembic_directory,
-            '-x', 'db_url={}'.format(config.db_conf['url']), 'upgrade', 'head'])
+
+def connect() -> None:
+    """Connect ``DB()`` to the configured database with the configured pool"""
+    from voicetalk.db.db import DB
+
+    DB().connect(config.db_conf['url'], **get_engine_options(config.db_conf))
+
+
+def create():
+    with resource_path('alembic/alembic.ini') as alembic_directory:
+        result = subprocess.run(
+            ['alembic', '-c', str(alembic_directory),
+                '-x', 'db_url={}'.format(config.db_conf['url']), 'upgrade', 'head'])
 
     if result.returncode == 0:
         logger.info('Database migration was successful')
@@ -1,16 +1,37 @@
 import contextlib
+import threading
+import time
 
 from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.orm.session import sessionmaker
 
+from voicetalk import metrics
+from voicetalk import tracing
+
 
 class DB:
+    """Process-wide singleton holding the engine and its connection pool.
+
+    ``DB()`` and ``connect()`` may be called by concurrent requests, threads
+    or greenlets, they build a single instance and a single engine.
+    """
     __engine = None
     __session = None
+    __instance_lock = threading.Lock()
+    __engine_lock = threading.RLock()
+    __stats_lock = threading.Lock()
+    __checkouts = 0
+    __checkout_timeouts = 0
+    __checkout_wait_total = 0.0
+    __checkout_wait_max = 0.0
 
     def __new__(cls, *args, **kwargs):
-        if not hasattr(cls, '_instance'):
-            cls._instance = super().__new__(cls, *args, **kwargs)
+        # Double-checked, the lock is only taken until the instance exists
+        if '_instance' not in cls.__dict__:
+            with cls.__instance_lock:
+                if '_instance' not in cls.__dict__:
+                    cls._instance = super().__new__(cls, *args, **kwargs)
 
         return cls._instance
 
@@ -22,39 +43,131 @@ class DB:
             :param dispose_first: Dispose the engine first or not. Defaults to False.
             **kwargs: Keyword arguments accepted by sqlalchemy create_engine function
         """
-        if dispose_first and self.__engine:
+        if self.__engine and not dispose_first:
+            return
+
+        with self.__engine_lock:
+            if dispose_first and self.__engine:
+                self.__engine.dispose()
+                self.__engine = None
+
+            if self.__engine:
+                return
+
+            engine = create_engine(url, **kwargs)
+            self.__session = sessionmaker(bind=engine)
+            # Published last, a concurrent caller seeing the engine also sees
+            # its sessionmaker
+            self.__engine = engine
+
+    def dispose(self) -> None:
+        """Close the connections of the pool, e.g. before forking workers.
+
+        The engine stays usable, it opens new connections on demand.
+        """
+        if self.__engine is not None:
             self.__engine.dispose()
-            self.__engine = None
 
-        if self.__engine:
-            return
+    def fill_pool(self, size: int) -> None:
+        """Open up to ``size`` connections and keep them in the pool"""
+        connections = []
 
-        self.__engine = create_engine(url, **kwargs)
-        self.__session = sessionmaker(bind=self.__engine)
+        try:
+            for _ in range(size):
+                connections.append(self.__checkout())
+        finally:
+            for connection in connections:
+                connection.close()
 
     @contextlib.contextmanager
     def get_session_scope(self) -> None:
         """Provide a transaction scope to isolate a group of orm operations.
 
+        The connection is checked out of the pool up front, so the time spent
+        waiting for it is accounted in ``pool_stats()``.
+
         Reference: https://bit.ly/2NMiZgY
         """
-        session = self.get_raw_session()
+        started_at = time.perf_counter()
 
-        try:
-            yield session
-            session.commit()
-        except:  # noqa: E722
-            session.rollback()
-            raise
-        finally:
-            session.close()
+        with tracing.span('db.session'):
+            with tracing.span('db.checkout'):
+                connection = self.__checkout()
+
+            session = self.get_raw_session(bind=connection)
 
-    def get_raw_session(self):
+            try:
+                yield session
+                session.commit()
+            except:  # noqa: E722
+                session.rollback()
+                raise
+            finally:
+                session.close()
+                connection.close()
+                metrics.db_session_duration.observe(time.perf_counter() - started_at)
+
+    def get_raw_session(self, **kwargs):
         """Get raw DB session to execute SQL
+
+        Args:
+            **kwargs: Keyword arguments accepted by sqlalchemy sessionmaker, e.g. ``bind``
         """
         if self.__engine is None:
             raise Exception('You should invoke connect() first')
-        elif self.__session is None:
-            self.__session = sessionmaker(bind=self.__engine)
 
-        return self.__session()
+        return self.__session(**kwargs)
+
+    def pool_stats(self) -> dict:
+        """Occupancy of the connection pool and the latency of the checkouts
+
+        ``saturation`` is the ratio of checked out connections to the capacity of
+        the pool, including the overflow. The occupancy is only reported by the
+        pools keeping connections, e.g. not by the ``NullPool`` of SQLite.
+
+        :rtype: dict
+        """
+        with self.__stats_lock:
+            checkouts = self.__checkouts
+            stats = {
+                'checkouts': checkouts,
+                'checkout_timeouts': self.__checkout_timeouts,
+                'checkout_wait_avg': (self.__checkout_wait_total / checkouts
+                                      if checkouts else 0.0),
+                'checkout_wait_max': self.__checkout_wait_max
+            }
+
+        pool = self.__engine.pool if self.__engine is not None else None
+
+        if hasattr(pool, 'checkedout'):
+            capacity = pool.size() + max(0, pool._max_overflow)
+            stats.update(size=pool.size(),
+                         checked_in=pool.checkedin(),
+                         checked_out=pool.checkedout(),
+                         overflow=max(0, pool.overflow()),
+                         saturation=pool.checkedout() / capacity if capacity else 0.0)
+
+        return stats
+
+    def __checkout(self):
+        if self.__engine is None:
+            raise Exception('You should invoke connect() first')
+
+        started_at = time.monotonic()
+
+        try:
+            connection = self.__engine.connect()
+        except PoolTimeoutError:
+            with self.__stats_lock:
+                self.__checkout_timeouts += 1
+            raise
+
+        wait = time.monotonic() - started_at
+        metrics.db_checkout_duration.observe(wait)
+
+        with self.__stats_lock:
+            self.__checkouts += 1
+            self.__checkout_wait_total += wait
+            self.__checkout_wait_max = max(self.__checkout_wait_max, wait)
+
+        return connection
@@ -0,0 +1,153 @@
+import logging
+import time
+
+from datetime import datetime
+
+from sqlalchemy import exists
+
+from voicetalk.db import models
+from voicetalk.db.db import DB
+
+logger = logging.getLogger('VoiceTalk.db.gc')
+
+
+def collect(batch_size: int = 500, pause: float = 0.1,
+            refresh_token_idle: float = 0) -> dict:
+    """Delete the expired OAuth2 rows in small batches.
+
+    The following rows are deleted:
+
+    - Authorization codes past their expiry
+    - Access and refresh tokens whose user no longer exists, e.g. removed from
+      a database not enforcing the foreign keys
+    - If ``refresh_token_idle`` is set, refresh tokens whose access token
+      expired more than ``refresh_token_idle`` seconds ago, along with their
+      access token. Google refreshes the access token of a linked account
+      every hour, so such a pair most likely belongs to an unlinked account.
+      Refresh tokens without an access token are deleted too.
+
+    Every batch is its own short transaction and the expiry condition is checked
+    again by the ``DELETE`` itself, so a token refreshed meanwhile is kept and
+    the server can keep taking traffic.
+
+    :param batch_size: Maximum number of rows deleted per transaction
+    :type batch_size: int
+    :param pause: Seconds to sleep between two batches
+    :type pause: float
+    :param refresh_token_idle: Seconds since the access token expired after
+      which the refresh token is deleted. Defaults to ``0``, which keeps the
+      tokens of every existing user.
+    :type refresh_token_idle: float
+    :return: Number of deleted rows per table and the elapsed seconds
+    :rtype: dict
+    """
+    started_at = time.monotonic()
+    now = datetime.now().timestamp()
+    batch_size = max(1, batch_size)
+    report = {'AuthorizationCode': 0, 'AccessToken': 0, 'RefreshToken': 0}
+
+    report['AuthorizationCode'] = _delete_in_batches(
+        lambda db_session: _delete_expired_authorization_codes(db_session, now, batch_size),
+        pause)
+
+    # The access tokens first, they reference the refresh tokens
+    for model in (models.AccessToken, models.RefreshToken):
+        report[model.__name__] = _delete_in_batches(
+            lambda db_session: _delete_orphans(db_session, model, batch_size), pause)
+
+    if refresh_token_idle > 0:
+        def delete_idle_tokens(db_session):
+            access_tokens, refresh_tokens = _delete_idle_tokens(
+                db_session, now - refresh_token_idle, batch_size)
+            report['AccessToken'] += access_tokens
+
+            return refresh_tokens
+
+        report['RefreshToken'] += _delete_in_batches(delete_idle_tokens, pause)
+
+    report['elapsed'] = time.monotonic() - started_at
+    logger.info('Removed %d authorization codes, %d access tokens and %d refresh tokens'
+                ' in %.3f seconds', report['AuthorizationCode'], report['AccessToken'],
+                report['RefreshToken'], report['elapsed'])
+
+    return report
+
+
+def _delete_in_batches(delete_batch, pause: float) -> int:
+    """Call ``delete_batch(db_session)`` until it deletes nothing
+
+    :return: Total number of deleted rows
+    :rtype: int
+    """
+    db_instance = DB()
+    total = 0
+
+    while True:
+        with db_instance.get_session_scope() as db_session:
+            deleted = delete_batch(db_session)
+
+        if not deleted:
+            return total
+
+        total += deleted
+
+        if pause > 0:
+            time.sleep(pause)
+
+
+def _delete_expired_authorization_codes(db_session, now: float, batch_size: int) -> int:
+    Code = models.AuthorizationCode
+    ids = [id_ for id_, in (db_session.query(Code.id)
+                                      .filter(Code.expires_at < now)
+                                      .limit(batch_size))]
+
+    if not ids:
+        return 0
+
+    return (db_session.query(Code)
+                      .filter(Code.id.in_(ids), Code.expires_at < now)
+                      .delete(synchronize_session=False))
+
+
+def _delete_orphans(db_session, model, batch_size: int) -> int:
+    """Delete a batch of rows of ``model`` whose user no longer exists"""
+    has_owner = exists().where(models.User.id == model.u_id)
+    ids = [id_ for id_, in (db_session.query(model.id)
+                                      .filter(~has_owner)
+                                      .limit(batch_size))]
+
+    if not ids:
+        return 0
+
+    return (db_session.query(model)
+                      .filter(model.id.in_(ids))
+                      .delete(synchronize_session=False))
+
+
+def _delete_idle_tokens(db_session, expired_before: float, batch_size: int) -> tuple:
+    """Delete a batch of idle access and refresh tokens
+
+    :return: Number of deleted access tokens and refresh tokens
+    :rtype: tuple
+    """
+    AccessToken, RefreshToken = models.AccessToken, models.RefreshToken
+    owns_access_token = AccessToken.refresh_token_id == RefreshToken.id
+    has_access_token = exists().where(owns_access_token)
+    has_live_access_token = exists().where(owns_access_token) \
+                                    .where(AccessToken.expires_at >= expired_before)
+    ids = [id_ for id_, in (db_session.query(RefreshToken.id)
+                                      .filter(~has_live_access_token)
+                                      .limit(batch_size))]
+
+    if not ids:
+        return 0, 0
+
+    access_tokens = (db_session.query(AccessToken)
+                               .filter(AccessToken.refresh_token_id.in_(ids),
+                                       AccessToken.expires_at < expired_before)
+                               .delete(synchronize_session=False))
+    refresh_tokens = (db_session.query(RefreshToken)
+                                .filter(RefreshToken.id.in_(ids), ~has_access_token)
+                                .delete(synchronize_session=False))
+
+    return access_tokens, refresh_tokens
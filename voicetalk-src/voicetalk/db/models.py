@@ -1,7 +1,7 @@
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.schema import Column, DefaultClause, ForeignKeyConstraint, UniqueConstraint
-from sqlalchemy.types import Integer, String, Boolean
+from sqlalchemy.types import BigInteger, Integer, String, Boolean
 
 base = declarative_base()
 
@@ -26,6 +26,9 @@ class User(base):
     authorization_codes = relationship('AuthorizationCode', back_populates='user',
                                        cascade='all, delete-orphan')
 
+    revoked_tokens = relationship('RevokedToken', back_populates='user',
+                                  cascade='all, delete-orphan')
+
     def get_id(self):
         return self.id
 
@@ -80,3 +83,21 @@ class AuthorizationCode(base):
     u_id = Column('u_id', Integer, nullable=False)
 
     user = relationship('User', back_populates='authorization_codes')
+
+
+class RevokedToken(base):
+    __tablename__ = 'RevokedToken'
+    __table_args__ = (ForeignKeyConstraint(['u_id'], ['User.id'],
+                                           onupdate='CASCADE', ondelete='CASCADE'),)
+
+    id = Column('id', Integer, autoincrement=True, primary_key=True)
+    # Nonce of the revoked signed token, NULL revokes every token of the user
+    # issued until revoked_at
+    nonce = Column('nonce', String(16), nullable=True)
+    # Timestamp in milliseconds
+    revoked_at = Column('revoked_at', BigInteger, nullable=False)
+    # The revoked tokens have expired after it
+    expires_at = Column('expires_at', Integer, nullable=False)
+    u_id = Column('u_id', Integer, nullable=False)
+
+    user = relationship('User', back_populates='revoked_tokens')
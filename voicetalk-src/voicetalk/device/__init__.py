@@ -1,63 +1,103 @@
 import json
 
-from pathlib import Path
 
+def split_execute_commands(commands: list) -> dict:
+    """Split the commands of an EXECUTE intent by device
 
-def get_device_data(device_json_file_path: str) -> list:
-    """Parse the device json file and return its content as a list of devices
+    :param commands: ``commands`` of the EXECUTE intent payload
+    :type commands: list
+    :return: The commands of every device ID, each one targeting only this
+      device, e.g. ``{'BigFan': [{'devices': [{'id': 'BigFan'}], 'execution': [...]}]}``
+    :rtype: dict
+    """
+    device_commands = {}
+
+    for command in commands:
+        for device in command['devices']:
+            device_commands.setdefault(device['id'], []).append(
+                dict(command, devices=[device]))
+
+    return device_commands
+
+
+def merge_execute_commands(device_commands: list) -> list:
+    """Merge the commands of many devices into the commands of one EXECUTE intent
 
-    :param device_json_file_path: Device json file path
-    :type device_json_file_path: str
-    :return: List of devices
+    The devices sharing the same execution are merged into one command.
+
+    :param device_commands: List of the commands of a device, see
+      ``split_execute_commands()``
+    :type device_commands: list
+    :return: ``commands`` of the merged EXECUTE intent payload
     :rtype: list
     """
-    if not device_json_file_path or not Path(device_json_file_path).exists():
-        raise OSError('Device json file does not exist')
+    merged_commands = {}
 
-    with open(device_json_file_path) as f:
-        file_content = f.read()
+    for commands in device_commands:
+        for command in commands:
+            key = json.dumps(command.get('execution', []), sort_keys=True)
+            merged_command = merged_commands.setdefault(key, dict(command, devices=[]))
 
-    try:
-        device_data = json.loads(file_content)
-    except json.JSONDecodeError:
-        device_data = []
+            for device in command['devices']:
+                if device not in merged_command['devices']:
+                    merged_command['devices'].append(device)
 
-    return device_data
+    return list(merged_commands.values())
 
 
-def handle_execute_intent(commands: list) -> list:
+def handle_execute_intent(commands: list, results: dict = None) -> list:
     """Handle EXECUTE intent
 
+    The IDs of the devices with the same result are grouped in one execution
+    result.
+
     :param commands: List of commands
     :type commands: list
+    :param results: Result of every device ID, e.g. ``{'BigFan': {'status': 'ERROR',
+      'errorCode': 'deviceOffline'}}``. A device without result is ``SUCCESS``.
+    :type results: dict
     :return: List of execution results
     :rtype: list
     """
-    return [
-        {
-            'ids': [device['id'] for command in commands for device in command['devices']],
-            'status': 'SUCCESS'
-        }
-    ]
+    results = results or {}
+    groups = {}
+
+    for command in commands:
+        for device in command['devices']:
+            result = results.get(device['id'], {'status': 'SUCCESS'})
+            _, ids = groups.setdefault(tuple(sorted(result.items())), (result, []))
 
+            if device['id'] not in ids:
+                ids.append(device['id'])
 
-def hanlde_query_intent(devices: list) -> dict:
-    """Currently, this intent is not available.
+    return [dict(result, ids=ids) for result, ids in groups.values()]
 
-    Use ``actionNotAvailable`` ERROR to response
+
+def handle_query_intent(devices: list, state_store=None, agent_user_id=None) -> dict:
+    """Handle QUERY intent
+
+    The states are answered from ``state_store``. Devices without known states,
+    or all devices if no state store is given, are answered with
+    ``actionNotAvailable`` ERROR.
 
     :param devices: List of devices
     :type devices: list
+    :param state_store: The store of the last known device states
+    :type state_store: voicetalk.device.state.DeviceStateStore
+    :param agent_user_id: ID of the user who sent the intent
     :return: List of query results
     :rtype: list
     """
-    response_dict = {}
+    device_ids = [device.get('id') for device in devices if device.get('id')]
+
+    if state_store is not None:
+        return state_store.query(agent_user_id, device_ids)
 
-    for device in devices:
-        device_id = device.get('id')
+    return {
+        device_id: {'errorCode': 'actionNotAvailable', 'status': 'ERROR'}
+        for device_id in device_ids
+    }
 
-        if device_id:
-            response_dict[device_id] = \
-                {'errorCode': 'actionNotAvailable', 'status': 'ERROR'}
 
-    return response_dict
+# Keep the misspelled name for backward compatibility
+hanlde_query_intent = handle_query_intent
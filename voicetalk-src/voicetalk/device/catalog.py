@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import namedtuple
+
+logger = logging.getLogger('VoiceTalk.device.catalog')
+
+_Snapshot = namedtuple('_Snapshot',
+                       ['signature', 'devices', 'devices_by_id', 'devices_json'])
+_EMPTY_SNAPSHOT = _Snapshot(None, [], {}, '[]')
+
+
+class DeviceCatalog:
+    """In-memory view of the device json file.
+
+    The file is parsed once and kept as an id-indexed snapshot together with the
+    serialized ``devices`` list of the SYNC response. ``refresh()`` reloads the
+    file only when its mtime or inode changed, and a file that can not be
+    parsed keeps the last good snapshot. The first load fails if the file can
+    not be parsed, there is no good snapshot to keep yet.
+
+    Listeners added by ``add_listener()`` are called with no argument when a new
+    catalog replaces a loaded one.
+    """
+
+    def __init__(self, device_json_file_path: str, check_interval: float = 1.0):
+        """
+        :param device_json_file_path: Device json file path
+        :type device_json_file_path: str
+        :param check_interval: Minimum seconds between two ``stat`` of the file.
+          Defaults to 1 second.
+        :type check_interval: float
+        """
+        self.device_json_file_path = device_json_file_path
+        self.check_interval = check_interval
+        self.__snapshot = _EMPTY_SNAPSHOT
+        self.__loaded = False
+        self.__checked_at = 0.0
+        self.__lock = threading.Lock()
+        self.__listeners = []
+
+    def add_listener(self, listener) -> None:
+        self.__listeners.append(listener)
+
+    @property
+    def devices(self) -> list:
+        return self.__snapshot.devices
+
+    @property
+    def devices_json(self) -> str:
+        """The ``devices`` list serialized in JSON"""
+        return self.__snapshot.devices_json
+
+    def get(self, device_id: str) -> dict or None:
+        return self.__snapshot.devices_by_id.get(device_id)
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self.__snapshot.devices_by_id
+
+    def load(self) -> bool:
+        """Load the device json file if it changed since the last load
+
+        :raise OSError: If the file does not exist and nothing was loaded yet.
+        :raise ValueError: If the file is malformed and nothing was loaded yet.
+        :return: ``True`` if a new catalog is loaded, ``False`` otherwise.
+        :rtype: bool
+        """
+        with self.__lock:
+            replaced = self.__loaded
+            loaded = self.__load()
+
+        if loaded and replaced:
+            for listener in self.__listeners:
+                try:
+                    listener()
+                except Exception:
+                    logger.exception('Catalog listener %r failed', listener)
+
+        return loaded
+
+    def __load(self) -> bool:
+        """The caller should hold the lock"""
+        self.__checked_at = time.monotonic()
+
+        try:
+            stat = os.stat(self.device_json_file_path or '')
+        except OSError:
+            if not self.__loaded:
+                raise OSError('Device json file does not exist')
+
+            logger.error('Device json file %s disappeared, keep the last catalog',
+                         self.device_json_file_path)
+            return False
+
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+        if self.__loaded and signature == self.__snapshot.signature:
+            return False
+
+        try:
+            with open(self.device_json_file_path) as f:
+                devices = json.load(f)
+
+            if not isinstance(devices, list):
+                raise ValueError('the device json file should contain a list')
+
+            devices_by_id = {device['id']: device for device in devices}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            if not self.__loaded:
+                raise ValueError('Malformed device json file {}: {}'.format(
+                    self.device_json_file_path, e))
+
+            logger.error('Malformed device json file %s, keep the last catalog: %s',
+                         self.device_json_file_path, e)
+
+            # Remember the signature so the broken file is not parsed again
+            self.__snapshot = self.__snapshot._replace(signature=signature)
+            return False
+
+        self.__snapshot = _Snapshot(signature, devices, devices_by_id,
+                                    json.dumps(devices, separators=(',', ':')))
+        self.__loaded = True
+        logger.info('Load %d devices from %s', len(devices), self.device_json_file_path)
+
+        return True
+
+    def refresh(self) -> bool:
+        """Reload the catalog if it is due for a check and the file changed
+
+        :return: ``True`` if a new catalog is loaded, ``False`` otherwise.
+        :rtype: bool
+        """
+        if self.__loaded and time.monotonic() - self.__checked_at < self.check_interval:
+            return False
+
+        return self.load()
+
+    def sync_response_json(self, request_id: str, agent_user_id) -> str:
+        """Render a SYNC response around the pre-serialized ``devices`` list
+
+        :param request_id: The ``requestId`` of the SYNC request
+        :param agent_user_id: The ``agentUserId`` of the linked user
+        :return: SYNC response in JSON
+        :rtype: str
+        """
+        return '{{"requestId":{},"payload":{{"agentUserId":{},"devices":{}}}}}'.format(
+            json.dumps(request_id), json.dumps(agent_user_id), self.devices_json)
@@ -0,0 +1,243 @@
+import logging
+import threading
+import time
+
+from datetime import datetime
+
+logger = logging.getLogger('VoiceTalk.device.state')
+
+# Parameters of EXECUTE commands that are not named after the state they set.
+# Parameters of other commands are recorded as states with the same name.
+COMMAND_STATE_NAMES = {
+    'action.devices.commands.SetFanSpeed': {'fanSpeed': 'currentFanSpeedSetting'},
+    'action.devices.commands.SetModes': {'updateModeSettings': 'currentModeSettings'},
+    'action.devices.commands.SetToggles': {'updateToggleSettings': 'currentToggleSettings'},
+    'action.devices.commands.StartStop': {'start': 'isRunning'},
+    'action.devices.commands.PauseUnpause': {'pause': 'isPaused'},
+    'action.devices.commands.LockUnlock': {'lock': 'isLocked'},
+    'action.devices.commands.setVolume': {'volumeLevel': 'currentVolume'},
+    'action.devices.commands.mute': {'mute': 'isMuted'},
+}
+
+IOTTALK_TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class DeviceStateStore:
+    """Last known states of the devices, answered from memory on QUERY.
+
+    States are recorded per linked user (``agentUserId``) from EXECUTE
+    commands and from IoTtalk samples, each device keeps the timestamp of its
+    last update. If ``stale_after`` is set, a device whose state is older than
+    ``stale_after`` seconds is reported offline, otherwise the last known state
+    is answered. The state is forgotten after ``expire_after`` seconds.
+
+    Listeners added by ``add_listener()`` are called with
+    ``(agent_user_id, device_id, states)`` whenever the states of a device change.
+    """
+
+    def __init__(self, stale_after: float = None, expire_after: float = 86400):
+        self.stale_after = stale_after
+        self.expire_after = max(stale_after or 0, expire_after)
+        self.__states = {}
+        self.__lock = threading.Lock()
+        self.__listeners = []
+
+    def add_listener(self, listener) -> None:
+        """Call ``listener(agent_user_id, device_id, states)`` on every change,
+        ``states`` being all the known states of the device
+        """
+        self.__listeners.append(listener)
+
+    def update(self, agent_user_id, device_id: str, states: dict,
+               timestamp: float = None) -> None:
+        """Merge the given states into the states of a device
+
+        :param agent_user_id: ID of the user owning the device
+        :param device_id: Device ID
+        :type device_id: str
+        :param states: States in the format of the QUERY response
+        :type states: dict
+        :param timestamp: When the states were observed. Defaults to now.
+        :type timestamp: float
+        """
+        if not device_id or not isinstance(states, dict):
+            return
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        key = (agent_user_id, device_id)
+
+        with self.__lock:
+            current_states, updated_at = self.__states.get(key, ({}, 0))
+
+            # The expired states are forgotten, not merged into
+            if time.time() - updated_at > self.expire_after:
+                current_states, updated_at = {}, 0
+
+            # Ignore samples that are older than what we already know
+            if timestamp < updated_at:
+                return
+
+            new_states = dict(current_states, **states)
+            self.__states[key] = (new_states, timestamp)
+
+        if new_states == current_states:
+            return
+
+        for listener in self.__listeners:
+            try:
+                listener(agent_user_id, device_id, new_states)
+            except Exception:
+                logger.exception('State listener %r failed', listener)
+
+    def get(self, agent_user_id, device_id: str) -> tuple or None:
+        """Get the states of a device and the timestamp of its last update
+
+        :return: ``(states, updated_at)`` or ``None`` if the device is unknown
+          or its states expired.
+        :rtype: tuple or None
+        """
+        entry = self.__states.get((agent_user_id, device_id))
+
+        if entry is None or time.time() - entry[1] > self.expire_after:
+            return None
+
+        return entry
+
+    def prune(self) -> int:
+        """Forget the expired states, run it periodically
+
+        :return: Number of forgotten devices
+        :rtype: int
+        """
+        expired_before = time.time() - self.expire_after
+
+        with self.__lock:
+            expired_keys = [key for key, (_, updated_at) in self.__states.items()
+                            if updated_at < expired_before]
+
+            for key in expired_keys:
+                del self.__states[key]
+
+        return len(expired_keys)
+
+    def record_execute_commands(self, agent_user_id, commands: list) -> None:
+        """Record the states set by the commands of an EXECUTE intent
+
+        :param agent_user_id: ID of the user who sent the intent
+        :param commands: ``commands`` of the EXECUTE intent payload
+        :type commands: list
+        """
+        now = time.time()
+
+        for command in commands:
+            states = {}
+
+            for execution in command.get('execution', []):
+                names = COMMAND_STATE_NAMES.get(execution.get('command'), {})
+
+                for param, value in execution.get('params', {}).items():
+                    states[names.get(param, param)] = value
+
+            if not states:
+                continue
+
+            for device in command.get('devices', []):
+                self.update(agent_user_id, device.get('id'), states, now)
+
+    def record_iottalk_sample(self, agent_user_id, sample: tuple) -> None:
+        """Record the states carried by an IoTtalk sample
+
+        The first value of the sample maps device IDs to their states, e.g.
+        ``('2020-08-01 12:00:00.000000', [{'BigFan': {'on': True}}])``.
+
+        :param agent_user_id: ID of the user owning the DA which pulled the sample
+        :param sample: ``(timestamp, data)`` returned by ``DAN.pull_with_timestamp``
+        :type sample: tuple
+        """
+        timestamp, data = sample
+
+        try:
+            timestamp = datetime.strptime(timestamp, IOTTALK_TIMESTAMP_FORMAT).timestamp()
+        except (TypeError, ValueError):
+            timestamp = time.time()
+
+        if not data or not isinstance(data[0], dict):
+            logger.warning('Ignore malformed IoTtalk state sample: %s', data)
+            return
+
+        for device_id, states in data[0].items():
+            self.update(agent_user_id, device_id, states, timestamp)
+
+    def query(self, agent_user_id, device_ids: list) -> dict:
+        """Answer a QUERY intent from the recorded states
+
+        :param agent_user_id: ID of the user who sent the intent
+        :param device_ids: IDs of the requested devices
+        :type device_ids: list
+        :return: The ``devices`` object of the QUERY response
+        :rtype: dict
+        """
+        now = time.time()
+        response_dict = {}
+
+        for device_id in device_ids:
+            entry = self.__states.get((agent_user_id, device_id))
+
+            if entry is None or now - entry[1] > self.expire_after:
+                response_dict[device_id] = \
+                    {'errorCode': 'actionNotAvailable', 'status': 'ERROR'}
+            elif self.stale_after is not None and now - entry[1] > self.stale_after:
+                response_dict[device_id] = \
+                    {'online': False, 'errorCode': 'deviceOffline', 'status': 'OFFLINE'}
+            else:
+                response_dict[device_id] = dict(entry[0], online=True, status='SUCCESS')
+
+        return response_dict
+
+
+class IoTtalkStateFeed:
+    """Feed a ``DeviceStateStore`` from an IoTtalk output feature
+
+    The feature of every registered DAN of ``dan_registry`` is subscribed to,
+    the states are recorded for the user owning the DAN as soon as the poller
+    sees a new sample. The feature is pulled every ``interval`` seconds while
+    it changes, up to every ``max_interval`` seconds while it is idle.
+    """
+
+    def __init__(self, dan_registry, df_name: str, state_store: DeviceStateStore,
+                 interval: float = 1.0, max_interval: float = 10.0):
+        self.dan_registry = dan_registry
+        self.df_name = df_name
+        self.state_store = state_store
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.started = False
+        self.__subscriptions = {}
+        self.__lock = threading.Lock()
+
+    def start(self) -> None:
+        if self.started:
+            return
+
+        self.started = True
+        self.dan_registry.add_listener(self.subscribe)
+
+        for agent_user_id, dan in self.dan_registry.items():
+            self.subscribe(agent_user_id, dan)
+
+    def subscribe(self, agent_user_id, dan) -> None:
+        """Subscribe to the feature of a DAN, once per DAN"""
+        with self.__lock:
+            current = self.__subscriptions.get(agent_user_id)
+
+            if current is not None and current[0] is dan and not current[1].cancelled:
+                return
+
+            def record(df_name, timestamp, data):
+                self.state_store.record_iottalk_sample(agent_user_id, (timestamp, data))
+
+            subscription = dan.subscribe([self.df_name], record, self.interval,
+                                         self.max_interval)
+            self.__subscriptions[agent_user_id] = (dan, subscription)
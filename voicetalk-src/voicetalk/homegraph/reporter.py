@@ -0,0 +1,142 @@
+import logging
+import threading
+import time
+import uuid
+
+from voicetalk.homegraph.sink import HomeGraphError
+
+logger = logging.getLogger('VoiceTalk.homegraph.reporter')
+
+
+class _PendingReport:
+    def __init__(self, now: float):
+        self.states = {}
+        self.first_changed_at = now
+        self.last_changed_at = now
+
+
+class StateReporter:
+    """Report the state changes of the devices to Home Graph, batched per user.
+
+    The changes of a user (``agentUserId``) are merged until none arrived for
+    ``debounce`` seconds, or for at most ``max_delay`` seconds since the first
+    one, then a single Report State carries the latest states of every
+    changed device. Request Syncs are sent as soon as possible.
+
+    The calls are made by a daemon thread of the reporter, a slow Home Graph
+    never blocks the requests or the IoTtalk polls. A failed call is logged
+    and dropped, the next change of the devices reports them again.
+    """
+
+    def __init__(self, sink, debounce: float = 1.0, max_delay: float = 5.0,
+                 device_catalog=None):
+        """
+        :param sink: Where the calls go
+        :type sink: voicetalk.homegraph.sink.HomeGraphSink
+        :param debounce: Seconds without change before the states of a user
+          are reported
+        :type debounce: float
+        :param max_delay: Maximum seconds the first change of a user waits
+        :type max_delay: float
+        :param device_catalog: Only report the devices of the catalog with
+          ``willReportState``. Every device is reported without a catalog.
+        :type device_catalog: voicetalk.device.catalog.DeviceCatalog
+        """
+        self.sink = sink
+        self.debounce = debounce
+        self.max_delay = max(debounce, max_delay)
+        self.device_catalog = device_catalog
+        self.__reports = {}
+        self.__syncs = set()
+        self.__condition = threading.Condition()
+        self.__thread = None
+
+    def record(self, agent_user_id, device_id: str, states: dict) -> None:
+        """Queue the states of a device, a listener of ``DeviceStateStore``
+
+        :param agent_user_id: ID of the user owning the device
+        :param device_id: Device ID
+        :type device_id: str
+        :param states: All the known states of the device
+        :type states: dict
+        """
+        if self.device_catalog is not None:
+            device = self.device_catalog.get(device_id)
+
+            if device is None or not device.get('willReportState'):
+                return
+
+        now = time.monotonic()
+
+        with self.__condition:
+            self.__ensure_started()
+            report = self.__reports.get(agent_user_id)
+
+            if report is None:
+                report = self.__reports[agent_user_id] = _PendingReport(now)
+                self.__condition.notify()
+
+            report.states[device_id] = dict(states)
+            report.last_changed_at = now
+
+    def request_sync(self, agent_user_ids) -> None:
+        """Queue a Request Sync of every given user"""
+        with self.__condition:
+            self.__ensure_started()
+            self.__syncs.update(agent_user_ids)
+            self.__condition.notify()
+
+    def pending(self) -> int:
+        """Number of users waiting for a Report State or a Request Sync"""
+        with self.__condition:
+            return len(self.__reports) + len(self.__syncs)
+
+    def __ensure_started(self):
+        """The caller should hold the condition lock"""
+        if self.__thread is not None:
+            return
+
+        self.__thread = threading.Thread(target=self.__run, name='StateReporter')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __get_due_at(self, report: _PendingReport) -> float:
+        return min(report.last_changed_at + self.debounce,
+                   report.first_changed_at + self.max_delay)
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while True:
+                    now = time.monotonic()
+                    due_users = [agent_user_id
+                                 for agent_user_id, report in self.__reports.items()
+                                 if self.__get_due_at(report) <= now]
+
+                    if due_users or self.__syncs:
+                        break
+                    elif self.__reports:
+                        self.__condition.wait(
+                            min(map(self.__get_due_at, self.__reports.values())) - now)
+                    else:
+                        self.__condition.wait()
+
+                due_reports = [(agent_user_id, self.__reports.pop(agent_user_id).states)
+                               for agent_user_id in due_users]
+                syncs, self.__syncs = self.__syncs, set()
+
+            for agent_user_id in syncs:
+                self.__call(self.sink.request_sync, agent_user_id)
+
+            for agent_user_id, states in due_reports:
+                self.__call(self.sink.report_state, str(uuid.uuid4()), agent_user_id,
+                            states)
+
+    @staticmethod
+    def __call(func, *args):
+        try:
+            func(*args)
+        except HomeGraphError as e:
+            logger.warning('Home Graph %s failed: %s', func.__name__, e)
+        except Exception:
+            logger.exception('Home Graph %s failed', func.__name__)
@@ -0,0 +1,179 @@
+import collections
+import json
+import logging
+import threading
+import time
+
+import requests
+
+from voicetalk import metrics
+from voicetalk import tracing
+
+try:
+    # Optional dependency, install it with ``pip install VoiceTalk[homegraph]``
+    from google.auth.transport.requests import AuthorizedSession
+    from google.oauth2 import service_account
+except ModuleNotFoundError:
+    AuthorizedSession = None
+    service_account = None
+
+logger = logging.getLogger('VoiceTalk.homegraph.sink')
+
+HOMEGRAPH_URL = 'https://homegraph.googleapis.com/v1'
+HOMEGRAPH_SCOPE = 'https://www.googleapis.com/auth/homegraph'
+TIMEOUT = 10
+
+
+class HomeGraphError(Exception):
+    def __init__(self, message='', status=None):
+        """
+        :param status: HTTP status of the failed request, if any
+        """
+        super().__init__(message)
+        self.status = status
+
+
+class HomeGraphSink:
+    """Where the Report State and Request Sync calls of ``StateReporter`` go"""
+
+    def report_state(self, request_id: str, agent_user_id, states: dict) -> None:
+        """Report the states of the devices of a user
+
+        :param request_id: ID of the report
+        :type request_id: str
+        :param agent_user_id: ID of the user owning the devices
+        :param states: Map a device ID to its states, in the format of the QUERY
+          response
+        :type states: dict
+        :raise HomeGraphError: If the report failed.
+        """
+        raise NotImplementedError
+
+    def request_sync(self, agent_user_id) -> None:
+        """Ask Google to send a SYNC intent for the given user
+
+        :raise HomeGraphError: If the request failed.
+        """
+        raise NotImplementedError
+
+    def observe(self, method: str, func, *args) -> None:
+        """Call ``func(*args)``, tracing it and observing its latency"""
+        started_at = time.perf_counter()
+        status = 'error'
+
+        with tracing.span('homegraph.{}'.format(method)) as span:
+            try:
+                func(*args)
+                status = '200'
+            except HomeGraphError as e:
+                if e.status is not None:
+                    status = str(e.status)
+                raise
+            finally:
+                span.set(status=status)
+                metrics.homegraph_duration.observe(time.perf_counter() - started_at,
+                                                   method, status)
+
+
+class LocalSink(HomeGraphSink):
+    """Stand-in for Home Graph, it logs the calls and keeps the last ones"""
+
+    def __init__(self, max_calls: int = 1024):
+        self.calls = collections.deque(maxlen=max_calls)
+        self.__lock = threading.Lock()
+
+    def report_state(self, request_id: str, agent_user_id, states: dict) -> None:
+        self.observe('reportState', self.__record, 'reportState', {
+            'requestId': request_id,
+            'agentUserId': str(agent_user_id),
+            'payload': {'devices': {'states': states}}
+        })
+
+    def request_sync(self, agent_user_id) -> None:
+        self.observe('requestSync', self.__record, 'requestSync',
+                     {'agentUserId': str(agent_user_id), 'async': True})
+
+    def __record(self, method: str, body: dict) -> None:
+        logger.info('%s %s', method, json.dumps(body, separators=(',', ':')))
+
+        with self.__lock:
+            self.calls.append((method, body))
+
+
+class GoogleSink(HomeGraphSink):
+    """Call the Home Graph API of Google
+
+    Report State needs the key file of a service account with the Home Graph
+    API enabled. Without it, only Request Sync is available, authorized by
+    the API key.
+    """
+
+    def __init__(self, service_account_file: str = None, api_key: str = None):
+        """
+        :param service_account_file: JSON key file of the service account
+        :type service_account_file: str
+        :param api_key: API key of the project, used without a service account
+        :type api_key: str
+        :raise RuntimeError: If the service account is given but google-auth is
+          not installed, or if neither is given.
+        """
+        self.api_key = api_key
+
+        if service_account_file:
+            if service_account is None:
+                raise RuntimeError('google-auth is required by the service account, '
+                                   'install it with `pip install VoiceTalk[homegraph]`')
+
+            credentials = service_account.Credentials.from_service_account_file(
+                service_account_file, scopes=[HOMEGRAPH_SCOPE])
+            self.session = AuthorizedSession(credentials)
+            self.authorized = True
+        elif api_key:
+            self.session = requests.Session()
+            self.authorized = False
+        else:
+            raise RuntimeError('Home Graph needs a service account or an API key')
+
+    def report_state(self, request_id: str, agent_user_id, states: dict) -> None:
+        if not self.authorized:
+            raise HomeGraphError('Report State needs a service account')
+
+        self.observe('reportState', self.__post, 'devices:reportStateAndNotification', {
+            'requestId': request_id,
+            'agentUserId': str(agent_user_id),
+            'payload': {'devices': {'states': states}}
+        })
+
+    def request_sync(self, agent_user_id) -> None:
+        self.observe('requestSync', self.__post, 'devices:requestSync',
+                     {'agentUserId': str(agent_user_id), 'async': True})
+
+    def __post(self, method: str, body: dict) -> None:
+        params = None if self.authorized else {'key': self.api_key}
+
+        try:
+            response = self.session.post('{}/{}'.format(HOMEGRAPH_URL, method),
+                                         params=params, json=body, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            raise HomeGraphError(str(e))
+
+        if response.status_code != 200:
+            raise HomeGraphError(response.text, response.status_code)
+
+
+def create_sink(name: str, service_account_file: str = None, api_key: str = None):
+    """Build the sink named in the config
+
+    :param name: ``none``, ``local`` or ``google``
+    :type name: str
+    :return: The sink, ``None`` if Home Graph is disabled
+    :rtype: HomeGraphSink or None
+    """
+    if not name or name == 'none':
+        return None
+    elif name == 'local':
+        return LocalSink()
+    elif name == 'google':
+        return GoogleSink(service_account_file, api_key)
+
+    raise ValueError('Unknown Home Graph sink: {}'.format(name))
@@ -2,7 +2,10 @@ import random
 import threading
 import time
 
-from voicetalk.iottalk.csmapi import CSMAPI
+from voicetalk.iottalk.circuit_breaker import get_backoff
+from voicetalk.iottalk.csmapi import CSMAPI, CircuitOpenError
+from voicetalk.iottalk.poller import Poller
+from voicetalk.iottalk.subscription import FeatureFeed, Subscription
 
 # example
 """
@@ -21,12 +24,13 @@ class DANError(Exception):
 
 
 class DAN():
-    def __init__(self, profile=None, host=None, mac_addr=None):
+    def __init__(self, profile=None, host=None, mac_addr=None, poller=None,
+                 async_client=None):
         self.profile = profile
         if host:
-            self.csmapi = CSMAPI(host)
+            self.csmapi = CSMAPI(host, async_client)
         else:
-            self.csmapi = CSMAPI(None)
+            self.csmapi = CSMAPI(None, async_client)
 
         self.mac_addr = mac_addr
 
@@ -38,6 +42,15 @@ class DAN():
         self.pre_data_timestamp = {}
         self.control_channel_timestamp = None
         self.control_channel_thread = None
+        self.control_channel_stop = None
+
+        # Poll the control channel on a shared ``Poller`` instead of a thread of its own
+        self.poller = poller
+        self.control_channel_job = None
+
+        # Output features polled for their subscriptions, by df_name
+        self.feeds = {}
+        self.feeds_lock = threading.Lock()
 
     @staticmethod
     def get_mac_addr():
@@ -46,30 +59,41 @@ class DAN():
         mac = ''.join(("%012X" % mac)[i:i + 2] for i in range(0, 12, 2))
         return mac
 
-    def control_channel(self):
-        while True:
-            time.sleep(2)
-            try:
-                cc = self.csmapi.pull(self.mac_addr, '__Ctl_O__')
-                if not cc:
-                    continue
+    def poll_control_channel(self):
+        """Pull the control channel once and handle the new command if any
 
-                if self.control_channel_timestamp == cc[0][0]:
-                    continue
+        :return: ``True`` if a new command is handled, ``False`` otherwise.
+        """
+        cc = self.csmapi.pull(self.mac_addr, '__Ctl_O__')
+        if not cc:
+            return False
+
+        if self.control_channel_timestamp == cc[0][0]:
+            return False
 
-                self.control_channel_timestamp = cc[0][0]
-                self.state = cc[0][1][0]
-                if self.state == 'SET_DF_STATUS':
-                    self.csmapi.push(self.mac_addr,
-                                     '__Ctl_I__',
-                                     ['SET_DF_STATUS_RSP',
-                                      {'cmd_params': cc[0][1][1]['cmd_params']}])
-                    df_status = list(cc[0][1][1]['cmd_params'][0])
-
-                    self.selected_DF.clear
-                    for index, status in enumerate(df_status):
-                        if status == '1':
-                            self.selected_DF.add(self.profile['df_list'][index])
+        self.control_channel_timestamp = cc[0][0]
+        self.state = cc[0][1][0]
+        if self.state == 'SET_DF_STATUS':
+            self.csmapi.push(self.mac_addr,
+                             '__Ctl_I__',
+                             ['SET_DF_STATUS_RSP',
+                              {'cmd_params': cc[0][1][1]['cmd_params']}])
+            df_status = list(cc[0][1][1]['cmd_params'][0])
+
+            self.selected_DF.clear()
+            for index, status in enumerate(df_status):
+                if status == '1':
+                    self.selected_DF.add(self.profile['df_list'][index])
+
+        return True
+
+    def control_channel(self, stop_event=None):
+        if stop_event is None:
+            stop_event = threading.Event()
+
+        while not stop_event.wait(2):
+            try:
+                self.poll_control_channel()
             except Exception as e:
                 print('Control error', e)
 
@@ -140,10 +164,16 @@ class DAN():
             print('This device has successfully registered.')
             print('Device name = ' + self.profile['d_name'])
 
-            if self.control_channel_thread is None:
+            if self.poller is not None:
+                if self.control_channel_job is None:
+                    self.control_channel_job = self.poller.add(self.poll_control_channel,
+                                                               group_key=self.csmapi.host)
+            elif self.control_channel_thread is None:
                 print('Create control threading')
                 # for control channel
-                self.control_channel_thread = threading.Thread(target=self.control_channel)
+                self.control_channel_stop = threading.Event()
+                self.control_channel_thread = threading.Thread(
+                    target=self.control_channel, args=(self.control_channel_stop,))
                 self.control_channel_thread.daemon = True
                 self.control_channel_thread.start()
 
@@ -152,17 +182,50 @@ class DAN():
             print('Registration failed.')
             return False
 
-    def device_registration_with_retry(self, profile=None, host=None, mac_addr=None):
+    def stop_control_channel(self):
+        if self.control_channel_job is not None:
+            self.control_channel_job.cancel()
+            self.control_channel_job = None
+
+        if self.control_channel_thread is None:
+            return
+
+        self.control_channel_stop.set()
+        self.control_channel_thread = None
+        self.control_channel_stop = None
+
+    def device_registration_with_retry(self, profile=None, host=None, mac_addr=None,
+                                       max_attempts=5, backoff=1.0, max_backoff=30.0):
+        """Register the device, retry with exponential backoff and full jitter
+
+        :param max_attempts: Give up after this many attempts, retry forever if None
+        :param backoff: Maximum seconds to wait after the first failed attempt,
+          doubled after every failure
+        :param max_backoff: Upper bound of the wait between two attempts
+        :return: True if the device is registered, False otherwise.
+        """
+        attempt = 0
 
         while True:
+            retry_after = 0
+
             try:
                 if self.register_device(profile, host, mac_addr):
-                    break
+                    return True
+            except CircuitOpenError as e:
+                # No attempt is made while the breaker of the host is open
+                retry_after = e.retry_after
             except Exception as e:
                 # TODO: check error
                 print('Attach failed: '),
                 print(e)
-            time.sleep(1)
+
+            attempt += 1
+
+            if max_attempts is not None and attempt >= max_attempts:
+                return False
+
+            time.sleep(max(retry_after, get_backoff(attempt, backoff, max_backoff)))
 
     def pull(self, df_name):
         if self.state == 'RESUME':
@@ -186,6 +249,67 @@ class DAN():
 
         return None
 
+    def subscribe(self, df_names, callback=None, interval=None, max_interval=None,
+                  max_queue=256):
+        """Get the new samples of some output features without polling them
+
+        Every feature is pulled by a job of the poller, every ``interval``
+        seconds while its samples change, backing off up to ``max_interval``
+        seconds while it is idle. The subscriptions of a feature share its polls,
+        the intervals are the ones of its first subscription.
+
+        :param df_names: Names of the output features
+        :param callback: ``callback(df_name, timestamp, data)`` called for every
+          new sample. Without it, iterate the samples with ``async for``.
+        :param interval: Seconds between two polls of a changing feature.
+          Defaults to the interval of the poller.
+        :param max_interval: Seconds between two polls of an idle feature.
+          Defaults to the maximum interval of the poller.
+        :param max_queue: Samples kept for the iteration without a callback
+        :return: The subscription, call its ``cancel()`` to stop the polls.
+        :rtype: voicetalk.iottalk.subscription.Subscription
+        """
+        subscription = Subscription(df_names, callback, max_queue, self.unsubscribe)
+
+        with self.feeds_lock:
+            if self.poller is None:
+                self.poller = Poller(workers=1)
+
+            for df_name in subscription.df_names:
+                feed = self.feeds.get(df_name)
+
+                if feed is None:
+                    feed = self.feeds[df_name] = FeatureFeed(self, df_name)
+                    feed.job = self.poller.add(feed.poll_feature, interval, max_interval,
+                                               group_key=self.csmapi.host)
+
+                feed.subscriptions.append(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Stop polling the features no other subscription needs"""
+        with self.feeds_lock:
+            for df_name in subscription.df_names:
+                feed = self.feeds.get(df_name)
+
+                if feed is None or subscription not in feed.subscriptions:
+                    continue
+
+                feed.subscriptions.remove(subscription)
+
+                if not feed.subscriptions:
+                    feed.job.cancel()
+                    del self.feeds[df_name]
+
+    def cancel_subscriptions(self):
+        with self.feeds_lock:
+            subscriptions = {subscription for feed in self.feeds.values()
+                             for subscription in feed.subscriptions}
+
+        for subscription in subscriptions:
+            subscription.cancel()
+
     def push(self, df_name, *data):
         if self.state == 'RESUME':
             return self.csmapi.push(self.mac_addr, df_name, list(data))
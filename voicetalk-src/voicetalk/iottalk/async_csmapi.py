@@ -0,0 +1,189 @@
+import asyncio
+import threading
+
+from voicetalk.iottalk.csmapi import CSMError
+
+try:
+    # Optional dependency, install it with ``pip install VoiceTalk[async]``
+    import aiohttp
+except ModuleNotFoundError:
+    aiohttp = None
+
+
+class AsyncHTTPClient:
+    """A single pooled aiohttp session shared by many ``AsyncCSMAPI``.
+
+    Connections are kept alive for ``keepalive_timeout`` seconds and at most
+    ``limit_per_host`` connections are opened to the same IoTtalk host.
+
+    The session is bound to the event loop it is first used on. Synchronous
+    code runs coroutines through ``run()``, which uses an event loop on a
+    daemon thread of the client.
+    """
+
+    def __init__(self, limit: int = 100, limit_per_host: int = 10,
+                 keepalive_timeout: float = 30):
+        if aiohttp is None:
+            raise CSMError('aiohttp is required by the asynchronous CSMAPI')
+
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.__session = None
+        self.__loop = None
+        self.__lock = threading.Lock()
+
+    async def get_session(self):
+        """Get the shared ``aiohttp.ClientSession``, create it if needed"""
+        if self.__session is None or self.__session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit,
+                                             limit_per_host=self.limit_per_host,
+                                             keepalive_timeout=self.keepalive_timeout)
+            self.__session = aiohttp.ClientSession(connector=connector)
+
+        return self.__session
+
+    def run(self, coro):
+        """Run a coroutine on the event loop thread and wait for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self.__get_loop()).result()
+
+    def close(self) -> None:
+        if self.__loop is None:
+            return
+
+        if self.__session is not None:
+            self.run(self.__session.close())
+
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__loop = None
+
+    def __get_loop(self):
+        with self.__lock:
+            if self.__loop is None:
+                self.__loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self.__loop.run_forever,
+                                          name='AsyncHTTPClient')
+                thread.daemon = True
+                thread.start()
+
+            return self.__loop
+
+
+class AsyncCSMAPI():
+    def __init__(self, host, client: AsyncHTTPClient = None, password: str = None,
+                 timeout: float = 10):
+        """
+        :param host: IoTtalk host
+        :param client: The pooled HTTP client. Defaults to a new one.
+        :type client: AsyncHTTPClient
+        :param password: ``password-key`` of the device, set by ``register()``
+        :type password: str
+        :param timeout: Seconds to wait for the host. Defaults to 10.
+        :type timeout: float
+        """
+        self.TIMEOUT = timeout
+        self.host = host
+        self.password = password
+        self.client = client or AsyncHTTPClient()
+
+    async def _request(self, method, url, parse_json=True, **kwargs):
+        if not self.host:
+            raise CSMError('no host given')
+
+        session = await self.client.get_session()
+
+        async with session.request(method, url, **kwargs) as response:
+            if response.status != 200:
+                raise CSMError(await response.text(), response.status)
+
+            if parse_json:
+                return await response.json(content_type=None)
+
+    def _headers(self):
+        # requests drops the headers set to None, aiohttp rejects them
+        return {'password-key': self.password} if self.password else {}
+
+    def _timeout(self):
+        return aiohttp.ClientTimeout(total=self.TIMEOUT)
+
+    async def register(self, mac_addr, profile):
+        url = '{host}/{mac_addr}'.format(
+            host=self.host,
+            mac_addr=mac_addr
+        )
+        result = await self._request(
+            'POST',
+            url,
+            json={'profile': profile},
+            timeout=self._timeout()
+        )
+
+        self.password = result.get('password')
+        return True
+
+    async def deregister(self, mac_addr):
+        url = '{host}/{mac_addr}'.format(
+            host=self.host,
+            mac_addr=mac_addr
+        )
+        await self._request('DELETE', url, parse_json=False, timeout=self._timeout())
+
+        return True
+
+    async def push(self, mac_addr, df_name, data):
+        url = '{host}/{mac_addr}/{df_name}'.format(
+            host=self.host,
+            mac_addr=mac_addr,
+            df_name=df_name
+        )
+        await self._request(
+            'PUT',
+            url,
+            parse_json=False,
+            json={'data': data},
+            headers=self._headers(),
+            timeout=self._timeout()
+        )
+
+        return True
+
+    async def pull(self, mac_addr, df_name):
+        url = '{host}/{mac_addr}/{df_name}'.format(
+            host=self.host,
+            mac_addr=mac_addr,
+            df_name=df_name
+        )
+        result = await self._request(
+            'GET',
+            url,
+            headers=self._headers(),
+            timeout=self._timeout()
+        )
+
+        return result['samples']
+
+    async def get_alias(self, mac_addr, df_name):
+        url = '{host}/get_alias/{mac_addr}/{df_name}'.format(
+            host=self.host,
+            mac_addr=mac_addr,
+            df_name=df_name
+        )
+        result = await self._request('GET', url, timeout=self._timeout())
+
+        return result['alias_name']
+
+    async def set_alias(self, mac_addr, df_name, new_alias):
+        url = '{host}/set_alias/{mac_addr}/{df_name}/alias?name={new_alias}'.format(
+            host=self.host,
+            mac_addr=mac_addr,
+            df_name=df_name,
+            new_alias=new_alias
+        )
+        await self._request('GET', url, parse_json=False, timeout=self._timeout())
+
+        return True
+
+    async def tree(self):
+        url = '{host}/tree'.format(host=self.host)
+
+        return await self._request('GET', url, timeout=self._timeout())
@@ -0,0 +1,224 @@
+import collections
+import math
+import random
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Value of each state in the breaker state gauge
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitBreaker:
+    """Circuit breaker, adaptive timeout and retry budget of an IoTtalk host.
+
+    The breaker is closed while the host answers. After ``failure_threshold``
+    consecutive failures it opens and every call is rejected at once for
+    ``open_seconds``. Then it is half-open: ``half_open_calls`` probe calls go
+    through, a successful probe closes the breaker and a failed one opens it
+    again.
+
+    The timeout of a call is the ``timeout_percentile`` of the latencies of
+    the last ``latency_samples`` answered or timed out calls times
+    ``timeout_multiplier``, clamped between ``min_timeout`` and
+    ``max_timeout``. It is ``max_timeout`` until 16 latencies are observed.
+
+    A call is attempted at most ``retry_attempts`` times, waiting a random
+    time up to ``retry_backoff`` seconds after the first failure, doubled
+    after every failure, up to ``retry_max_backoff``. Every successful call
+    deposits ``retry_budget`` tokens in a bucket of at most
+    ``max_retry_tokens`` and every retry takes one, so the retries stay a
+    small fraction of the calls when the host fails for good.
+    """
+
+    def __init__(self, failure_threshold: int = 5, open_seconds: float = 5.0,
+                 half_open_calls: int = 1, min_timeout: float = 1.0,
+                 max_timeout: float = 10.0, timeout_percentile: float = 99,
+                 timeout_multiplier: float = 3.0, latency_samples: int = 128,
+                 retry_attempts: int = 3, retry_backoff: float = 0.05,
+                 retry_max_backoff: float = 1.0, retry_budget: float = 0.1,
+                 max_retry_tokens: float = 10):
+        self.failure_threshold = max(1, failure_threshold)
+        self.open_seconds = open_seconds
+        self.half_open_calls = max(1, half_open_calls)
+        self.min_timeout = min_timeout
+        self.max_timeout = max(min_timeout, max_timeout)
+        self.timeout_percentile = timeout_percentile
+        self.timeout_multiplier = timeout_multiplier
+        self.retry_attempts = max(1, retry_attempts)
+        self.retry_backoff = retry_backoff
+        self.retry_max_backoff = retry_max_backoff
+        self.retry_budget = retry_budget
+        self.max_retry_tokens = max_retry_tokens
+        self.state = CLOSED
+        self.counters = {'rejected': 0, 'opened': 0, 'retries': 0}
+        self.__failures = 0
+        self.__opened_at = 0.0
+        self.__probes = 0
+        self.__latencies = collections.deque(maxlen=max(1, latency_samples))
+        self.__timeout = self.max_timeout
+        self.__stale_samples = 0
+        self.__retry_tokens = max_retry_tokens
+        self.__lock = threading.Lock()
+
+    @property
+    def timeout(self) -> float:
+        """Seconds a call waits for the host"""
+        return self.__timeout
+
+    def allow_request(self) -> bool:
+        """Tell if a call may be sent to the host, it is counted as a probe when
+        the breaker is half-open
+        """
+        with self.__lock:
+            if self.state == OPEN:
+                if time.monotonic() < self.__opened_at + self.open_seconds:
+                    self.counters['rejected'] += 1
+                    return False
+
+                self.state = HALF_OPEN
+                self.__probes = 0
+
+            if self.state == HALF_OPEN:
+                if self.__probes >= self.half_open_calls:
+                    self.counters['rejected'] += 1
+                    return False
+
+                self.__probes += 1
+
+            return True
+
+    def retry_after(self) -> float:
+        """Seconds until the open breaker lets a probe call through"""
+        with self.__lock:
+            if self.state != OPEN:
+                return 0.0
+
+            return max(0.0, self.__opened_at + self.open_seconds - time.monotonic())
+
+    def record_success(self, latency: float = None) -> None:
+        """Record a call answered by the host, even with an error
+
+        :param latency: Seconds the call took, if it is worth sampling
+        :type latency: float
+        """
+        with self.__lock:
+            self.state = CLOSED
+            self.__failures = 0
+            self.__retry_tokens = min(self.max_retry_tokens,
+                                      self.__retry_tokens + self.retry_budget)
+
+            if latency is not None:
+                self.__sample(latency)
+
+    def record_failure(self, latency: float = None) -> None:
+        """Record a call the host did not answer, or answered with a 5xx
+
+        :param latency: Seconds the call took if it timed out, sampled so that
+          a slower host raises the timeout
+        :type latency: float
+        """
+        with self.__lock:
+            self.__failures += 1
+
+            if latency is not None:
+                self.__sample(latency)
+
+            if self.state == HALF_OPEN or self.__failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.counters['opened'] += 1
+
+                self.state = OPEN
+                self.__opened_at = time.monotonic()
+
+    def get_retry_delay(self, attempt: int) -> float or None:
+        """Take a token of the retry budget for the given retry
+
+        :param attempt: Number of failed attempts of the call so far
+        :type attempt: int
+        :return: Seconds to wait before the retry, ``None`` if the call should
+          not be retried: out of attempts or budget, or the breaker is open.
+        :rtype: float or None
+        """
+        with self.__lock:
+            if attempt >= self.retry_attempts or self.state != CLOSED:
+                return None
+            elif self.__retry_tokens < 1:
+                return None
+
+            self.__retry_tokens -= 1
+            self.counters['retries'] += 1
+
+        return get_backoff(attempt, self.retry_backoff, self.retry_max_backoff)
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return dict(self.counters, state=self.state, failures=self.__failures,
+                        timeout=self.__timeout, retry_tokens=self.__retry_tokens)
+
+    def __sample(self, latency):
+        """The caller should hold the lock"""
+        self.__latencies.append(latency)
+        self.__stale_samples += 1
+
+        # Sorting the samples on every call is wasted, the percentile moves slowly
+        if self.__stale_samples >= 16:
+            self.__update_timeout()
+
+    def __update_timeout(self):
+        """The caller should hold the lock"""
+        self.__stale_samples = 0
+
+        latencies = sorted(self.__latencies)
+        index = min(len(latencies) - 1,
+                    math.ceil(len(latencies) * self.timeout_percentile / 100) - 1)
+        self.__timeout = min(self.max_timeout,
+                             max(self.min_timeout,
+                                 latencies[max(0, index)] * self.timeout_multiplier))
+
+
+class BreakerRegistry:
+    """The ``CircuitBreaker`` of every IoTtalk host, created on first use"""
+
+    def __init__(self, **options):
+        self.__options = options
+        self.__breakers = {}
+        self.__lock = threading.Lock()
+
+    def configure(self, **options) -> None:
+        """Set the ``CircuitBreaker`` arguments, the breakers start over"""
+        with self.__lock:
+            self.__options = options
+            self.__breakers.clear()
+
+    def get(self, host: str) -> CircuitBreaker:
+        breaker = self.__breakers.get(host)
+
+        if breaker is None:
+            with self.__lock:
+                breaker = self.__breakers.get(host)
+
+                if breaker is None:
+                    breaker = self.__breakers[host] = CircuitBreaker(**self.__options)
+
+        return breaker
+
+    def stats(self) -> dict:
+        """Map a host to the stats of its breaker"""
+        with self.__lock:
+            breakers = list(self.__breakers.items())
+
+        return {host: breaker.stats() for host, breaker in breakers}
+
+
+def get_backoff(attempt: int, backoff: float, max_backoff: float) -> float:
+    """Random wait before the given retry, with exponential backoff and full jitter
+
+    :param attempt: 1 for the first retry
+    :type attempt: int
+    :rtype: float
+    """
+    return random.uniform(0, min(max_backoff, backoff * 2 ** (attempt - 1)))
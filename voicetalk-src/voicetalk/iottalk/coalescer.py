@@ -0,0 +1,130 @@
+import threading
+import time
+
+from concurrent.futures import Future
+
+from voicetalk import tracing
+from voicetalk.iottalk.push_queue import PushQueueFull
+
+
+class PushCoalescer:
+    """Coalesce the pushes arriving within a short window into one batch.
+
+    The first push of a key opens a window of ``window`` seconds. Every push
+    of the same key arriving in that window joins the batch, then the batch is
+    handed to ``flush(key, items)`` on the ``push_queue`` workers. ``flush``
+    returns one result per item, an ``Exception`` result fails the future of
+    its item.
+
+    With a zero window every push is flushed on its own right away.
+    """
+
+    def __init__(self, flush, push_queue, window: float = 0.02):
+        """
+        :param flush: ``flush(key, items) -> list of results``, e.g. a single
+          ``DAN.push`` of the merged items
+        :param push_queue: The queue running the flushes
+        :type push_queue: voicetalk.iottalk.push_queue.PushQueue
+        :param window: Seconds a batch stays open. Defaults to 20 ms.
+        :type window: float
+        """
+        self.flush = flush
+        self.push_queue = push_queue
+        self.window = window
+        self.__batches = {}
+        self.__condition = threading.Condition()
+        self.__thread = None
+
+    def submit(self, key, item) -> Future:
+        """Add an item to the open batch of the key
+
+        :return: A future resolved with the result of the item
+        :rtype: concurrent.futures.Future
+        """
+        future = Future()
+        entry = (item, future, tracing.capture())
+
+        if self.window <= 0:
+            self.__dispatch(key, [entry])
+            return future
+
+        with self.__condition:
+            self.__ensure_started()
+            batch = self.__batches.get(key)
+
+            if batch is None:
+                batch = self.__batches[key] = (time.monotonic() + self.window, [])
+                self.__condition.notify()
+
+            batch[1].append(entry)
+
+        return future
+
+    def __ensure_started(self):
+        """The caller should hold the condition lock"""
+        if self.__thread is not None:
+            return
+
+        self.__thread = threading.Thread(target=self.__run, name='PushCoalescer')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while True:
+                    now = time.monotonic()
+                    due_keys = [key for key, (deadline, _) in self.__batches.items()
+                                if deadline <= now]
+
+                    if due_keys:
+                        break
+                    elif self.__batches:
+                        self.__condition.wait(
+                            min(deadline for deadline, _ in self.__batches.values()) - now)
+                    else:
+                        self.__condition.wait()
+
+                due_batches = [(key, self.__batches.pop(key)[1]) for key in due_keys]
+
+            for key, entries in due_batches:
+                self.__dispatch(key, entries)
+
+    def __dispatch(self, key, entries: list):
+        try:
+            # Never wait for room, a full shard would stall the batches of every
+            # other key behind it
+            job = self.push_queue.submit(self.__flush_batch, key, entries, key=key,
+                                         block_timeout=0)
+        except PushQueueFull as e:
+            for _, future, _ in entries:
+                future.set_exception(e)
+        else:
+            # The job fails without being run if the queue drops it
+            job.add_done_callback(lambda job: self.__fail_unresolved(job, entries))
+
+    @staticmethod
+    def __fail_unresolved(job: Future, entries: list):
+        if job.exception() is None:
+            return
+
+        for _, future, _ in entries:
+            if not future.done():
+                future.set_exception(job.exception())
+
+    def __flush_batch(self, key, entries: list):
+        # A batch mixes requests, it is traced with the first traced one
+        trace_context = next((context for _, _, context in entries if context), None)
+
+        try:
+            with tracing.attach(trace_context), \
+                    tracing.span('coalescer.flush', size=len(entries)):
+                results = self.flush(key, [item for item, _, _ in entries])
+        except Exception as e:
+            results = [e] * len(entries)
+
+        for (_, future, _), result in zip(entries, results):
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
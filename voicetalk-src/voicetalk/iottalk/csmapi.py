@@ -1,43 +1,197 @@
-import requests
+import asyncio
 import threading
+import time
 
 from functools import wraps
 
-session_pool = {}
+import requests
+
+from voicetalk import metrics
+from voicetalk import tracing
+from voicetalk.iottalk.circuit_breaker import BreakerRegistry
+from voicetalk.iottalk.session_pool import SessionPool
+
+session_pool = SessionPool()
+breakers = BreakerRegistry()
 
 
 class CSMError(Exception):
-    pass
+    def __init__(self, message='', status=None):
+        """
+        :param status: HTTP status of the failed request, if any
+        """
+        super().__init__(message)
+        self.status = status
 
 
-def session_wrapper(func):
+class CircuitOpenError(CSMError):
+    def __init__(self, host, retry_after: float):
+        """
+        :param retry_after: Seconds until the breaker of the host lets a call
+          through
+        """
+        super().__init__('circuit breaker of {} is open, retry after {:.1f}s'.format(
+            host, retry_after))
+        self.retry_after = retry_after
+
+
+def is_host_failure(e: Exception) -> bool:
+    """Tell if the exception of a call means the host is unavailable
+
+    Timeouts, connection errors and 5xx responses count against the circuit
+    breaker, other errors come from a host that answered.
+    """
+    if isinstance(e, CSMError):
+        return e.status is not None and e.status >= 500
+    elif isinstance(e, ValueError):
+        # Invalid JSON, requests raises it as a RequestException
+        return False
+
+    return isinstance(e, (requests.RequestException, OSError, asyncio.TimeoutError))
+
+
+def is_timeout(e: Exception) -> bool:
+    return isinstance(e, (requests.Timeout, asyncio.TimeoutError))
+
+
+def observe_wrapper(func):
+    """Trace the method and observe its latency, labeled with the HTTP status"""
+    span_name = 'csmapi.{}'.format(func.__name__)
+
     @wraps(func)
     def wrap(interface, *args, **kwargs):
-        global session_pool
-        t_id = threading.get_ident()
-        if t_id in (session_pool):
-            session = session_pool.get(t_id)
-        else:
-            session = requests.Session()
-            session_pool[t_id] = session
+        started_at = time.perf_counter()
+        status = 'error'
+
+        with tracing.span(span_name) as span:
+            try:
+                result = func(interface, *args, **kwargs)
+                status = '200'
+                return result
+            except CircuitOpenError:
+                status = 'open'
+                raise
+            except CSMError as e:
+                if e.status is not None:
+                    status = str(e.status)
+                raise
+            finally:
+                span.set(status=status)
+                metrics.csmapi_duration.observe(time.perf_counter() - started_at,
+                                                func.__name__, status)
+
+    return wrap
+
+
+def guard_wrapper(retry: bool = True):
+    """Call the method through the circuit breaker of the host
+
+    The call fails at once with ``CircuitOpenError`` while the breaker is
+    open. A call failing for the host, see ``is_host_failure()``, is retried
+    with exponential backoff and full jitter if ``retry`` is set, as long as
+    the breaker allows it, see ``CircuitBreaker.get_retry_delay()``. A timed
+    out call is not retried, it already waited for the whole timeout. A call
+    interrupted by a ``BaseException`` counts as a failure.
+
+    :param retry: The method is idempotent and may be retried
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrap(interface, *args, **kwargs):
+            # A nested call is guarded by the outer call
+            if interface.session:
+                return func(interface, *args, **kwargs)
+
+            breaker = breakers.get(interface.host)
+            attempt = 0
+
+            while True:
+                if not breaker.allow_request():
+                    raise CircuitOpenError(interface.host, breaker.retry_after())
+
+                started_at = time.perf_counter()
+
+                try:
+                    result = func(interface, *args, **kwargs)
+                except Exception as e:
+                    if not is_host_failure(e):
+                        breaker.record_success()
+                        raise
+
+                    attempt += 1
+                    delay = None
+
+                    if is_timeout(e):
+                        breaker.record_failure(time.perf_counter() - started_at)
+                    else:
+                        breaker.record_failure()
+
+                        if retry:
+                            delay = breaker.get_retry_delay(attempt)
 
+                    if delay is None:
+                        raise
+
+                    time.sleep(delay)
+                    continue
+                except BaseException:
+                    # E.g. a gevent Timeout or GreenletExit, the probe slot of a
+                    # half-open breaker must be given back
+                    breaker.record_failure()
+                    raise
+
+                breaker.record_success(time.perf_counter() - started_at)
+
+                return result
+
+        return wrap
+
+    return decorator
+
+
+def session_wrapper(func):
+    @wraps(func)
+    def wrap(interface, *args, **kwargs):
         if not interface.host:
             raise CSMError('no host given')
 
+        # A nested call uses the session of the outer call
         if interface.session:
-            result = func(interface, *args, **kwargs)
-        else:
+            return func(interface, *args, **kwargs)
+
+        with session_pool.session() as session:
             interface.session = session
 
             try:
-                result = func(interface, *args, **kwargs)
-            except Exception as e:
-                if interface.session:
-                    interface.session = None
+                return func(interface, *args, **kwargs)
+            finally:
+                interface.session = None
+
+    return wrap
 
-                raise e
 
-            interface.session = None
+def async_wrapper(func):
+    """Run the method on an ``AsyncCSMAPI`` if the interface has an async client
+
+    The interface is shared by the threads of a DA, so every call gets its own
+    ``AsyncCSMAPI`` given the host, password and timeout of the call.
+    """
+    @wraps(func)
+    def wrap(interface, *args, **kwargs):
+        if interface.async_client is None:
+            return func(interface, *args, **kwargs)
+
+        from voicetalk.iottalk.async_csmapi import AsyncCSMAPI
+
+        password = interface.password
+        async_api = AsyncCSMAPI(interface.host, interface.async_client,
+                                password=password, timeout=interface.timeout)
+        result = interface.async_client.run(
+            getattr(async_api, func.__name__)(*args, **kwargs))
+
+        # Only a registration changes the password
+        if async_api.password != password:
+            interface.password = async_api.password
 
         return result
 
@@ -45,45 +199,70 @@ def session_wrapper(func):
 
 
 class CSMAPI():
-    def __init__(self, host):
-        self.TIMEOUT = 10
+    def __init__(self, host, async_client=None):
+        """
+        :param host: IoTtalk host
+        :param async_client: Send the requests with an ``AsyncCSMAPI`` on this
+          ``AsyncHTTPClient`` instead of ``requests``. Defaults to None.
+        """
         self.host = host
-        self.session = None
         self.password = None
-
+        self.async_client = async_client
+        self.__local = threading.local()
+
+    @property
+    def session(self):
+        """The session checked out by the current thread for the ongoing call"""
+        return getattr(self.__local, 'session', None)
+
+    @session.setter
+    def session(self, session):
+        self.__local.session = session
+
+    @property
+    def timeout(self):
+        """Seconds to wait for the host, adapted to its latency"""
+        return breakers.get(self.host).timeout
+
+    @observe_wrapper
+    @guard_wrapper()
+    @async_wrapper
     @session_wrapper
     def register(self, mac_addr, profile):
         url = '{host}/{mac_addr}'.format(
             host=self.host,
             mac_addr=mac_addr
         )
-        response = self.session.post(
+        with self.session.post(
             url,
             json={'profile': profile},
-            timeout=self.TIMEOUT
-        )
+            timeout=self.timeout
+        ) as response:
+            if response.status_code != 200:
+                raise CSMError(response.text, response.status_code)
 
-        response.close()
-        if response.status_code != 200:
-            raise CSMError(response.text)
+            self.password = response.json().get('password')
 
-        self.password = response.json().get('password')
         return True
 
+    @observe_wrapper
+    @guard_wrapper()
+    @async_wrapper
     @session_wrapper
     def deregister(self, mac_addr):
         url = '{host}/{mac_addr}'.format(
             host=self.host,
             mac_addr=mac_addr
         )
-        response = self.session.delete(url)
-
-        response.close()
-        if response.status_code != 200:
-            raise CSMError(response.text)
+        with self.session.delete(url, timeout=self.timeout) as response:
+            if response.status_code != 200:
+                raise CSMError(response.text, response.status_code)
 
         return True
 
+    @observe_wrapper
+    @guard_wrapper(retry=False)
+    @async_wrapper
     @session_wrapper
     def push(self, mac_addr, df_name, data):
         url = '{host}/{mac_addr}/{df_name}'.format(
@@ -91,19 +270,20 @@ class CSMAPI():
             mac_addr=mac_addr,
             df_name=df_name
         )
-        response = self.session.put(
+        with self.session.put(
             url,
             json={'data': data},
             headers={'password-key': self.password},
-            timeout=self.TIMEOUT
-        )
-
-        response.close()
-        if response.status_code != 200:
-            raise CSMError(response.text)
+            timeout=self.timeout
+        ) as response:
+            if response.status_code != 200:
+                raise CSMError(response.text, response.status_code)
 
         return True
 
+    @observe_wrapper
+    @guard_wrapper()
+    @async_wrapper
     @session_wrapper
     def pull(self, mac_addr, df_name):
         url = '{host}/{mac_addr}/{df_name}'.format(
@@ -111,18 +291,19 @@ class CSMAPI():
             mac_addr=mac_addr,
             df_name=df_name
         )
-        response = self.session.get(
+        with self.session.get(
             url,
             headers={'password-key': self.password},
-            timeout=self.TIMEOUT
-        )
+            timeout=self.timeout
+        ) as response:
+            if response.status_code != 200:
+                raise CSMError(response.text, response.status_code)
 
-        response.close()
-        if response.status_code != 200:
-            raise CSMError(response.text)
-
-        return response.json()['samples']
+            return response.json()['samples']
 
+    @observe_wrapper
+    @guard_wrapper()
+    @async_wrapper
     @session_wrapper
     def get_alias(self, mac_addr, df_name):
         url = '{host}/get_alias/{mac_addr}/{df_name}'.format(
@@ -130,16 +311,18 @@ class CSMAPI():
             mac_addr=mac_addr,
             df_name=df_name
         )
-        response = self.session.get(
+        with self.session.get(
             url,
-            timeout=self.TIMEOUT)
-
-        response.close()
-        if response.status_code != 200:
-            raise CSMError(response.text)
+            timeout=self.timeout
+        ) as response:
+            if response.status_code != 200:
+                raise CSMError(response.text, response.status_code)
 
-        return response.json()['alias_name']
+            return response.json()['alias_name']
 
+    @observe_wrapper
+    @guard_wrapper()
+    @async_wrapper
     @session_wrapper
     def set_alias(self, mac_addr, df_name, new_alias):
         url = '{host}/set_alias/{mac_addr}/{df_name}/alias?name={new_alias}'.format(
@@ -148,22 +331,23 @@ class CSMAPI():
             df_name=df_name,
             new_alias=new_alias
         )
-        response = self.session.get(
+        with self.session.get(
             url,
-            timeout=self.TIMEOUT)
+            timeout=self.timeout
+        ) as response:
+            if response.status_code != 200:
+                raise CSMError(response.text, response.status_code)
 
-        response.close()
-        if response.status_code != 200:
-            raise CSMError(response.text)
         return True
 
+    @observe_wrapper
+    @guard_wrapper()
+    @async_wrapper
     @session_wrapper
     def tree(self):
         url = '{host}/tree'.format(host=self.host)
-        response = self.session.get(url)
-
-        response.close()
-        if response.status_code != 200:
-            raise CSMError(response.text)
+        with self.session.get(url, timeout=self.timeout) as response:
+            if response.status_code != 200:
+                raise CSMError(response.text, response.status_code)
 
-        return response.json()
+            return response.json()
@@ -0,0 +1,188 @@
+import heapq
+import itertools
+import logging
+import math
+import random
+import threading
+import time
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from voicetalk import metrics
+
+logger = logging.getLogger('VoiceTalk.iottalk.poller')
+
+
+class PollJob:
+    """A periodic job scheduled by ``Poller``.
+
+    ``func`` returns a truthy value when it saw new data. The job is then polled
+    again after ``interval`` seconds, otherwise the interval grows by
+    ``backoff`` up to ``max_interval``.
+    """
+
+    def __init__(self, func, interval: float, max_interval: float, backoff: float,
+                 group_key=None):
+        self.func = func
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.backoff = backoff
+        self.group_key = group_key
+        self.current_interval = interval
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        self.cancelled = True
+
+
+class Poller:
+    """Run the periodic pulls of many DANs on one scheduler and a few workers.
+
+    A single scheduler thread keeps the jobs in a heap ordered by their due
+    time and hands the due ones to a fixed pool of ``workers`` threads, so the
+    number of threads stays flat however many DANs are registered. Intervals
+    are jittered by ``jitter`` (a fraction of the interval) to spread the
+    requests, and idle jobs back off.
+
+    IoTtalk has no endpoint pulling many features at once, so the pulls are
+    never batched into one request. Due jobs sharing a ``group_key`` (e.g. the
+    IoTtalk host) are only split in at most ``workers`` groups, the jobs of a
+    group running back to back on one worker, which saves a task per job.
+    """
+
+    def __init__(self, workers: int = 2, interval: float = 2.0, max_interval: float = 10.0,
+                 backoff: float = 1.5, jitter: float = 0.1):
+        self.workers = max(1, workers)
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.__heap = []
+        self.__sequence = itertools.count()
+        self.__condition = threading.Condition()
+        self.__executor = None
+        self.__thread = None
+        self.__stats_lock = threading.Lock()
+        self.__runs = 0
+        self.__errors = 0
+        self.__latency_total = 0.0
+        self.__latency_max = 0.0
+
+    def add(self, func, interval: float = None, max_interval: float = None,
+            backoff: float = None, group_key=None) -> PollJob:
+        """Schedule ``func`` to be called periodically
+
+        The intervals default to the ones of the poller.
+
+        :param func: The callable to poll, returning a truthy value on new data
+        :param group_key: Due jobs with the same key are run back to back on
+          the same worker, each one still pulls on its own.
+        :return: The scheduled job, call its ``cancel()`` to stop polling.
+        :rtype: PollJob
+        """
+        job = PollJob(func,
+                      self.interval if interval is None else interval,
+                      self.max_interval if max_interval is None else max_interval,
+                      self.backoff if backoff is None else backoff,
+                      group_key)
+
+        self.__ensure_started()
+
+        # Spread the first polls over an interval
+        self.__schedule(job, random.uniform(0, job.interval))
+
+        return job
+
+    def stats(self) -> dict:
+        """Number of jobs and the latency of the polls in seconds
+
+        :rtype: dict
+        """
+        with self.__stats_lock:
+            runs = self.__runs
+
+            return {
+                'scheduled': len(self.__heap),
+                'workers': self.workers,
+                'runs': runs,
+                'errors': self.__errors,
+                'latency_avg': self.__latency_total / runs if runs else 0.0,
+                'latency_max': self.__latency_max
+            }
+
+    def __ensure_started(self):
+        with self.__condition:
+            if self.__thread is not None:
+                return
+
+            self.__executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                 thread_name_prefix='Poller')
+            self.__thread = threading.Thread(target=self.__run_scheduler, name='Poller')
+            self.__thread.daemon = True
+            self.__thread.start()
+
+    def __schedule(self, job: PollJob, delay: float):
+        due = time.monotonic() + delay
+
+        with self.__condition:
+            heapq.heappush(self.__heap, (due, next(self.__sequence), job))
+            self.__condition.notify()
+
+    def __run_scheduler(self):
+        while True:
+            with self.__condition:
+                while not self.__heap or self.__heap[0][0] > time.monotonic():
+                    timeout = self.__heap[0][0] - time.monotonic() if self.__heap else None
+                    self.__condition.wait(timeout)
+
+                groups = defaultdict(list)
+                now = time.monotonic()
+
+                while self.__heap and self.__heap[0][0] <= now:
+                    _, _, job = heapq.heappop(self.__heap)
+
+                    if not job.cancelled:
+                        groups[job.group_key].append(job)
+
+            for group_key, jobs in groups.items():
+                size = 1 if group_key is None else math.ceil(len(jobs) / self.workers)
+
+                for index in range(0, len(jobs), size):
+                    self.__executor.submit(self.__run_group, jobs[index:index + size])
+
+    def __run_group(self, jobs: list):
+        for job in jobs:
+            if job.cancelled:
+                continue
+
+            started_at = time.monotonic()
+            error = False
+
+            try:
+                active = job.func()
+            except Exception as e:
+                logger.debug('Poll failed: %s', e)
+                active = False
+                error = True
+
+            latency = time.monotonic() - started_at
+            metrics.poll_duration.observe(latency, getattr(job.func, '__name__', 'job'))
+
+            with self.__stats_lock:
+                self.__runs += 1
+                self.__errors += error
+                self.__latency_total += latency
+                self.__latency_max = max(self.__latency_max, latency)
+
+            if job.cancelled:
+                continue
+
+            if active:
+                job.current_interval = job.interval
+            else:
+                job.current_interval = min(job.current_interval * job.backoff,
+                                           job.max_interval)
+
+            jitter = job.current_interval * self.jitter
+            self.__schedule(job, job.current_interval + random.uniform(-jitter, jitter))
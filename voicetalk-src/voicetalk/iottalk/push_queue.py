@@ -0,0 +1,204 @@
+import collections
+import itertools
+import logging
+import math
+import threading
+import time
+
+from concurrent.futures import Future
+
+from voicetalk import metrics, tracing
+
+logger = logging.getLogger('VoiceTalk.iottalk.push_queue')
+
+OVERFLOW_POLICIES = ('drop-oldest', 'reject', 'block')
+
+
+class PushQueueFull(Exception):
+    pass
+
+
+class _Shard:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.items = collections.deque()
+        self.condition = threading.Condition()
+
+
+class PushQueue:
+    """Bounded in-process queue drained by a pool of worker threads.
+
+    Every job is bound to a shard chosen by its ``key`` and each shard is
+    drained by exactly one worker, so jobs sharing a key (e.g. the same DAN)
+    are delivered in order while different keys are pushed concurrently.
+
+    What happens when a shard is full depends on ``overflow_policy``:
+
+    - ``drop-oldest``: the oldest queued job fails with ``PushQueueFull``
+    - ``reject``: the new job fails with ``PushQueueFull``
+    - ``block``: the caller waits up to ``block_timeout`` seconds for room,
+      then the new job fails with ``PushQueueFull``
+
+    A job raising any exception, even a ``BaseException``, fails its future and
+    leaves its worker draining the shard.
+    """
+
+    def __init__(self, workers: int = 4, max_size: int = 1024,
+                 overflow_policy: str = 'drop-oldest', block_timeout: float = 1.0):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy: {}'.format(overflow_policy))
+
+        self.workers = max(1, workers)
+        self.max_size = max(self.workers, max_size)
+        self.overflow_policy = overflow_policy
+        self.block_timeout = block_timeout
+
+        shard_size = math.ceil(self.max_size / self.workers)
+        self.__shards = [_Shard(shard_size) for _ in range(self.workers)]
+        self.__round_robin = itertools.count()
+        self.__threads = []
+        self.__lock = threading.Lock()
+        self.__counters = collections.Counter()
+        self.__wait_time_total = 0.0
+        self.__wait_time_max = 0.0
+        self.__service_time_total = 0.0
+
+    def submit(self, func, *args, key=None, block_timeout=None, **kwargs) -> Future:
+        """Enqueue ``func(*args, **kwargs)`` and return immediately
+
+        :param func: The callable to run on a worker thread, e.g. ``DAN.push``
+        :param key: Jobs with the same key are run in submission order.
+        :param block_timeout: Seconds to wait for room with the ``block``
+          policy, ``0`` rejects right away. Defaults to ``block_timeout`` of
+          the queue.
+        :return: A future resolved with the return value of ``func``
+        :rtype: concurrent.futures.Future
+        :raise PushQueueFull: If the job is rejected by the overflow policy.
+        """
+        self.__ensure_started()
+
+        if key is None:
+            shard = self.__shards[next(self.__round_robin) % self.workers]
+        else:
+            shard = self.__shards[hash(key) % self.workers]
+
+        future = Future()
+        item = (future, func, args, kwargs, time.monotonic(), tracing.capture())
+        dropped = None
+
+        with shard.condition:
+            if len(shard.items) >= shard.max_size:
+                if self.overflow_policy == 'drop-oldest':
+                    dropped = shard.items.popleft()
+                elif self.overflow_policy == 'block':
+                    shard.condition.wait_for(
+                        lambda: len(shard.items) < shard.max_size,
+                        self.block_timeout if block_timeout is None else block_timeout)
+
+                if len(shard.items) >= shard.max_size:
+                    self.__count('rejected')
+                    raise PushQueueFull('IoTtalk push queue is full')
+
+            shard.items.append(item)
+            shard.condition.notify_all()
+
+        self.__count('submitted')
+
+        if dropped is not None:
+            self.__count('dropped')
+            dropped[0].set_exception(PushQueueFull('Dropped by a newer push'))
+
+        return future
+
+    def stats(self) -> dict:
+        """Queue depth, counters and drain latency of the queue
+
+        ``wait`` is the time a job spent queued and ``service`` is the time
+        spent running it, both in seconds.
+
+        :rtype: dict
+        """
+        with self.__lock:
+            counters = dict(self.__counters)
+            finished = counters.get('completed', 0) + counters.get('failed', 0)
+            started = finished + counters.get('running', 0)
+            wait_avg = self.__wait_time_total / started if started else 0.0
+            wait_max = self.__wait_time_max
+            service_avg = self.__service_time_total / finished if finished else 0.0
+
+        return {
+            'depth': sum(len(shard.items) for shard in self.__shards),
+            'max_size': self.max_size,
+            'workers': self.workers,
+            'overflow_policy': self.overflow_policy,
+            'submitted': counters.get('submitted', 0),
+            'completed': counters.get('completed', 0),
+            'failed': counters.get('failed', 0),
+            'dropped': counters.get('dropped', 0),
+            'rejected': counters.get('rejected', 0),
+            'wait_avg': wait_avg,
+            'wait_max': wait_max,
+            'service_avg': service_avg
+        }
+
+    def __count(self, name: str, value: int = 1):
+        with self.__lock:
+            self.__counters[name] += value
+
+    def __ensure_started(self):
+        if self.__threads:
+            return
+
+        with self.__lock:
+            if self.__threads:
+                return
+
+            for index, shard in enumerate(self.__shards):
+                thread = threading.Thread(target=self.__drain, args=(shard,),
+                                          name='PushQueue-{}'.format(index))
+                thread.daemon = True
+                thread.start()
+                self.__threads.append(thread)
+
+    def __drain(self, shard: _Shard):
+        while True:
+            with shard.condition:
+                shard.condition.wait_for(lambda: shard.items)
+                future, func, args, kwargs, enqueued_at, trace_context = \
+                    shard.items.popleft()
+                shard.condition.notify_all()
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            started_at = time.monotonic()
+            wait_time = started_at - enqueued_at
+
+            with self.__lock:
+                self.__counters['running'] += 1
+                self.__wait_time_total += wait_time
+                self.__wait_time_max = max(self.__wait_time_max, wait_time)
+
+            metrics.push_wait_duration.observe(wait_time)
+
+            try:
+                with tracing.attach(trace_context), \
+                        tracing.span('push_queue.job', wait=wait_time):
+                    result = func(*args, **kwargs)
+            except BaseException as e:
+                # E.g. a gevent Timeout, the worker must outlive it or every key
+                # of the shard would stall
+                logger.warning('IoTtalk push failed: %s', e)
+                outcome = 'failed'
+                future.set_exception(e)
+            else:
+                outcome = 'completed'
+                future.set_result(result)
+
+            service_time = time.monotonic() - started_at
+            metrics.push_service_duration.observe(service_time, outcome)
+
+            with self.__lock:
+                self.__counters['running'] -= 1
+                self.__counters[outcome] += 1
+                self.__service_time_total += service_time
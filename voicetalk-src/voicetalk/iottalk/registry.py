@@ -0,0 +1,300 @@
+import copy
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from voicetalk.iottalk.DAN import DAN
+
+logger = logging.getLogger('VoiceTalk.iottalk.registry')
+
+
+# Lookups of a user whose DAN is evicted while it is being registered
+TENANT_ATTEMPTS = 2
+
+
+class _Tenant:
+    def __init__(self, dan: DAN):
+        self.dan = dan
+        self.lock = threading.Lock()
+        self.registered = False
+        self.last_used = time.monotonic()
+        # Evicted, its DAN is released by the last holder of the lock
+        self.closed = False
+        self.released = False
+
+
+class DANRegistry:
+    """Map every linked user (``agentUserId``) to a DA of its own on IoTtalk.
+
+    A DAN is created and registered lazily the first time a user needs it. The
+    device name and the MAC address of the DA are derived from the user ID, so
+    a user gets the same DA back after its DAN is evicted or the server restarts.
+
+    DANs idle for more than ``idle_timeout`` seconds, and the least recently
+    used DANs beyond ``max_instances``, are evicted. Eviction only releases the
+    local resources, the DA stays registered on IoTtalk.
+
+    The registry lock only guards the map itself. Registration happens under a
+    per-user lock, so a slow registration never blocks the other users. A DAN
+    evicted while it is being registered is released once the registration
+    completes, and the user is looked up again.
+    ``register_in_background()`` retries it with backoff on a few threads of
+    the registry, off the request path.
+
+    Listeners added by ``add_listener()`` are called with ``(u_id, dan)`` once
+    the DAN of a user is registered, e.g. to subscribe to its features. The
+    subscriptions are cancelled when the DAN is evicted.
+    """
+
+    def __init__(self, host: str, profile: dict, max_instances: int = 256,
+                 idle_timeout: float = 3600, poller=None, async_client=None,
+                 registration_workers: int = 2, registration_attempts: int = 5,
+                 registration_backoff: float = 1.0,
+                 registration_max_backoff: float = 30.0):
+        """
+        :param host: IoTtalk host
+        :type host: str
+        :param profile: Profile shared by the DAs of all users. ``d_name`` is
+          suffixed with the user ID.
+        :type profile: dict
+        :param max_instances: Maximum number of DANs kept in memory
+        :type max_instances: int
+        :param idle_timeout: Seconds after which an unused DAN is evicted
+        :type idle_timeout: float
+        :param poller: Shared poller of the control channels
+        :type poller: voicetalk.iottalk.poller.Poller
+        :param async_client: Send the requests of the DANs on this client
+          instead of ``requests``
+        :type async_client: voicetalk.iottalk.async_csmapi.AsyncHTTPClient
+        :param registration_workers: Threads of ``register_in_background()``
+        :type registration_workers: int
+        :param registration_attempts: Attempts of a registration with retry
+        :type registration_attempts: int
+        :param registration_backoff: Maximum seconds to wait after the first
+          failed attempt, doubled after every failure
+        :type registration_backoff: float
+        :param registration_max_backoff: Upper bound of the wait between two attempts
+        :type registration_max_backoff: float
+        """
+        self.host = host
+        self.profile = profile
+        self.max_instances = max(1, max_instances)
+        self.idle_timeout = idle_timeout
+        self.poller = poller
+        self.async_client = async_client
+        self.registration_workers = max(1, registration_workers)
+        self.registration_attempts = max(1, registration_attempts)
+        self.registration_backoff = registration_backoff
+        self.registration_max_backoff = registration_max_backoff
+        self.__base_mac_addr = DAN.get_mac_addr()
+        self.__tenants = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__executor = None
+        self.__registrations = {}
+        self.__listeners = []
+
+    def __len__(self):
+        return len(self.__tenants)
+
+    def add_listener(self, listener) -> None:
+        """Call ``listener(u_id, dan)`` whenever a DAN is registered"""
+        self.__listeners.append(listener)
+
+    def get_profile(self, u_id) -> dict:
+        """Get the IoTtalk profile of the DA of the given user"""
+        profile = copy.deepcopy(self.profile)
+        profile['d_name'] = '{}-{}'.format(profile['d_name'], u_id)
+
+        return profile
+
+    def get_mac_addr(self, u_id) -> str:
+        """Get the MAC address of the DA of the given user"""
+        return '{}-{}'.format(self.__base_mac_addr, u_id)
+
+    def get(self, u_id, retry: bool = False) -> DAN:
+        """Get the registered DAN of the given user, create it if needed
+
+        :param u_id: User ID, aka ``agentUserId``
+        :param retry: Retry the registration with backoff, up to
+          ``registration_attempts`` times. Defaults to False.
+        :type retry: bool
+        :raise DANError: If the registration failed.
+        :raise CSMError: If the registration failed.
+        :return: The DAN of the given user
+        :rtype: voicetalk.iottalk.DAN.DAN
+        """
+        for _ in range(TENANT_ATTEMPTS):
+            with self.__lock:
+                tenant = self.__tenants.get(u_id)
+
+                if tenant is None:
+                    tenant = _Tenant(self.__create_dan(u_id))
+                    self.__tenants[u_id] = tenant
+
+                tenant.last_used = time.monotonic()
+                self.__tenants.move_to_end(u_id)
+                evicted = self.__pop_evictable()
+
+            for evicted_tenant in evicted:
+                self.__release(evicted_tenant)
+
+            with tenant.lock:
+                if not tenant.closed and not tenant.registered:
+                    self.__register_tenant(u_id, tenant, retry)
+
+            if not tenant.closed:
+                break
+
+            # Evicted meanwhile, the registry no longer holds this DAN
+            self.__release(tenant)
+
+        return tenant.dan
+
+    def register_in_background(self, u_id) -> Future:
+        """Register the DA of the given user on a thread of the registry, with retry
+
+        A registration already in progress for the user is not started twice.
+
+        :param u_id: User ID, aka ``agentUserId``
+        :return: A future of the DAN, see ``get()``
+        :rtype: concurrent.futures.Future
+        """
+        with self.__lock:
+            future = self.__registrations.get(u_id)
+
+            if future is not None:
+                return future
+
+            if self.__executor is None:
+                self.__executor = ThreadPoolExecutor(
+                    max_workers=self.registration_workers,
+                    thread_name_prefix='DANRegistration')
+
+            future = self.__executor.submit(self.__register, u_id)
+            self.__registrations[u_id] = future
+
+        return future
+
+    def is_registered(self, u_id) -> bool:
+        with self.__lock:
+            tenant = self.__tenants.get(u_id)
+
+            return tenant is not None and tenant.registered
+
+    def items(self) -> list:
+        """Get ``(u_id, DAN)`` of the registered DANs without marking them as used
+
+        :rtype: list
+        """
+        with self.__lock:
+            return [(u_id, tenant.dan) for u_id, tenant in self.__tenants.items()
+                    if tenant.registered]
+
+    def deregister(self, u_id) -> bool:
+        """Deregister the DA of the given user from IoTtalk and drop its DAN
+
+        The DA is deregistered even if its DAN is not in memory.
+
+        :param u_id: User ID, aka ``agentUserId``
+        :return: ``True`` on success
+        :rtype: bool
+        """
+        with self.__lock:
+            tenant = self.__tenants.pop(u_id, None)
+
+        if tenant is None:
+            dan = self.__create_dan(u_id)
+        else:
+            dan = tenant.dan
+            self.__release(tenant)
+
+        return dan.deregister()
+
+    def evict_idle(self) -> None:
+        with self.__lock:
+            evicted = self.__pop_evictable()
+
+        for tenant in evicted:
+            self.__release(tenant)
+
+    def __register(self, u_id) -> DAN:
+        try:
+            dan = self.get(u_id, retry=True)
+
+            if not self.is_registered(u_id):
+                logger.warning('Give up registering the DA of user %s', u_id)
+
+            return dan
+        except Exception:
+            logger.exception('Fail to register the DA of user %s', u_id)
+            raise
+        finally:
+            with self.__lock:
+                self.__registrations.pop(u_id, None)
+
+    def __register_tenant(self, u_id, tenant: _Tenant, retry: bool) -> None:
+        """The caller should hold the tenant lock"""
+        if retry:
+            tenant.registered = tenant.dan.device_registration_with_retry(
+                max_attempts=self.registration_attempts,
+                backoff=self.registration_backoff,
+                max_backoff=self.registration_max_backoff)
+        else:
+            tenant.registered = tenant.dan.register_device()
+
+        if not tenant.registered:
+            return
+
+        # Under the tenant lock, the subscriptions of the listeners are not
+        # added while the DAN is released
+        for listener in self.__listeners:
+            try:
+                listener(u_id, tenant.dan)
+            except Exception:
+                logger.exception('Registry listener %r failed', listener)
+
+    @staticmethod
+    def __release(tenant: _Tenant) -> None:
+        """Close the tenant and release its DAN
+
+        The DAN is released under the tenant lock. If it is held, e.g. by a
+        registration, its holder releases the DAN after unlocking, see ``get()``.
+        """
+        tenant.closed = True
+
+        while not tenant.released and tenant.lock.acquire(blocking=False):
+            try:
+                if not tenant.released:
+                    tenant.dan.stop_control_channel()
+                    tenant.dan.cancel_subscriptions()
+                    tenant.released = True
+            finally:
+                tenant.lock.release()
+
+    def __create_dan(self, u_id) -> DAN:
+        return DAN(self.get_profile(u_id), self.host, self.get_mac_addr(u_id),
+                   self.poller, self.async_client)
+
+    def __pop_evictable(self) -> list:
+        """Pop the idle tenants and the tenants beyond the capacity.
+
+        The caller should hold the registry lock.
+        """
+        evicted = []
+        now = time.monotonic()
+
+        while self.__tenants:
+            u_id, tenant = next(iter(self.__tenants.items()))
+
+            if len(self.__tenants) <= self.max_instances and \
+               now - tenant.last_used <= self.idle_timeout:
+                break
+
+            del self.__tenants[u_id]
+            evicted.append(tenant)
+            logger.info('Evict the DAN of user %s', u_id)
+
+        return evicted
@@ -0,0 +1,158 @@
+import contextlib
+import os
+import threading
+import time
+
+from collections import OrderedDict
+
+import requests
+
+from requests.adapters import HTTPAdapter
+
+
+class SessionPool:
+    """Bounded pool of ``requests.Session`` shared by every thread.
+
+    A session is checked out for the duration of one CSMAPI call, so a thread
+    never holds a session between calls and recycled threads leak nothing.
+    Idle sessions are reused most recently used first to keep their
+    connections warm, sessions idle for more than ``idle_timeout`` seconds are
+    closed, and at most ``max_sessions`` sessions are kept. When all of them
+    are checked out, a transient session is created and closed on release.
+
+    Every session mounts an ``HTTPAdapter`` holding ``pool_connections`` host
+    pools of ``pool_maxsize`` connections each.
+    """
+
+    def __init__(self, max_sessions: int = 16, idle_timeout: float = 300,
+                 pool_connections: int = 10, pool_maxsize: int = 10):
+        self.__lock = threading.Lock()
+        self.__idle = OrderedDict()
+        self.__in_use = set()
+        self.__counters = {'created': 0, 'reused': 0, 'evicted': 0, 'overflow': 0}
+        self.__pid = os.getpid()
+        self.configure(max_sessions, idle_timeout, pool_connections, pool_maxsize)
+
+    def configure(self, max_sessions: int = 16, idle_timeout: float = 300,
+                  pool_connections: int = 10, pool_maxsize: int = 10) -> None:
+        """Resize the pool, the idle sessions are closed to apply the new sizes"""
+        with self.__lock:
+            self.max_sessions = max(1, max_sessions)
+            self.idle_timeout = idle_timeout
+            self.pool_connections = pool_connections
+            self.pool_maxsize = pool_maxsize
+            idle_sessions = list(self.__idle)
+            self.__idle.clear()
+
+        for session in idle_sessions:
+            session.close()
+
+    def acquire(self) -> requests.Session:
+        """Check a session out of the pool"""
+        with self.__lock:
+            self.__reset_after_fork()
+            evicted = self.__pop_expired()
+
+            if self.__idle:
+                session, _ = self.__idle.popitem(last=True)
+                self.__in_use.add(session)
+                self.__counters['reused'] += 1
+            elif len(self.__in_use) >= self.max_sessions:
+                # A transient session, it is closed on release
+                session = self.__create_session()
+                self.__counters['overflow'] += 1
+            else:
+                session = self.__create_session()
+                self.__in_use.add(session)
+
+        for evicted_session in evicted:
+            evicted_session.close()
+
+        return session
+
+    def release(self, session: requests.Session) -> None:
+        """Check a session back into the pool"""
+        evicted = []
+
+        with self.__lock:
+            if session in self.__in_use:
+                self.__in_use.remove(session)
+                self.__idle[session] = time.monotonic()
+
+                while len(self.__idle) + len(self.__in_use) > self.max_sessions:
+                    evicted.append(self.__idle.popitem(last=False)[0])
+                    self.__counters['evicted'] += 1
+            else:
+                evicted.append(session)
+
+        for evicted_session in evicted:
+            evicted_session.close()
+
+    @contextlib.contextmanager
+    def session(self) -> requests.Session:
+        session = self.acquire()
+
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def stats(self) -> dict:
+        """Occupancy, reuse and eviction counters of the pool
+
+        :rtype: dict
+        """
+        with self.__lock:
+            return dict(self.__counters,
+                        in_use=len(self.__in_use),
+                        idle=len(self.__idle),
+                        max_sessions=self.max_sessions)
+
+    def close(self) -> None:
+        """Close the idle sessions"""
+        with self.__lock:
+            idle_sessions = list(self.__idle)
+            self.__idle.clear()
+
+        for session in idle_sessions:
+            session.close()
+
+    def __create_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_connections,
+                              pool_maxsize=self.pool_maxsize)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self.__counters['created'] += 1
+
+        return session
+
+    def __pop_expired(self) -> list:
+        """Pop the sessions idle for too long, the caller should hold the lock"""
+        evicted = []
+        now = time.monotonic()
+
+        while self.__idle:
+            session, last_used = next(iter(self.__idle.items()))
+
+            if now - last_used <= self.idle_timeout:
+                break
+
+            del self.__idle[session]
+            evicted.append(session)
+            self.__counters['evicted'] += 1
+
+        return evicted
+
+    def __reset_after_fork(self):
+        """Forget the sessions inherited from the parent process.
+
+        Their sockets are shared with the parent, so they are dropped without
+        being closed. The caller should hold the lock.
+        """
+        if self.__pid == os.getpid():
+            return
+
+        self.__pid = os.getpid()
+        self.__idle.clear()
+        self.__in_use.clear()
@@ -0,0 +1,145 @@
+import asyncio
+import collections
+import logging
+import threading
+
+logger = logging.getLogger('VoiceTalk.iottalk.subscription')
+
+
+class Subscription:
+    """Samples of some output features of a DAN, pushed to a callback or iterated.
+
+    With a callback, ``callback(df_name, timestamp, data)`` is called on a
+    poller worker for every new sample. Without one, the samples are iterated
+    with ``async for df_name, timestamp, data in subscription``. At most
+    ``max_queue`` samples wait for the iteration, the oldest ones are dropped.
+
+    Returned by ``DAN.subscribe()``, call ``cancel()`` to stop the polls.
+    """
+
+    def __init__(self, df_names, callback=None, max_queue: int = 256, unsubscribe=None):
+        self.df_names = frozenset(df_names)
+        self.callback = callback
+        self.cancelled = False
+        self.__unsubscribe = unsubscribe
+        self.__backlog = collections.deque(maxlen=max(1, max_queue))
+        self.__loop = None
+        self.__queue = None
+        self.__lock = threading.Lock()
+
+    def deliver(self, df_name: str, timestamp: str, data) -> None:
+        if self.cancelled:
+            return
+
+        if self.callback is not None:
+            try:
+                self.callback(df_name, timestamp, data)
+            except Exception:
+                logger.exception('Subscriber of %s failed', df_name)
+            return
+
+        with self.__lock:
+            if self.__loop is None:
+                self.__backlog.append((df_name, timestamp, data))
+                return
+
+            loop = self.__loop
+
+        loop.call_soon_threadsafe(self.__put, (df_name, timestamp, data))
+
+    def cancel(self) -> None:
+        """Stop the polls of the subscription, the iteration ends"""
+        if self.cancelled:
+            return
+
+        self.cancelled = True
+
+        if self.__unsubscribe is not None:
+            self.__unsubscribe(self)
+
+        with self.__lock:
+            loop = self.__loop
+
+        if loop is not None:
+            loop.call_soon_threadsafe(self.__queue.put_nowait, None)
+
+    def __aiter__(self):
+        with self.__lock:
+            if self.__loop is None:
+                self.__loop = asyncio.get_event_loop()
+                self.__queue = asyncio.Queue()
+
+                for sample in self.__backlog:
+                    self.__queue.put_nowait(sample)
+
+                self.__backlog.clear()
+
+        return self
+
+    async def __anext__(self):
+        if self.cancelled and self.__queue.empty():
+            raise StopAsyncIteration
+
+        sample = await self.__queue.get()
+
+        if sample is None:
+            raise StopAsyncIteration
+
+        return sample
+
+    def __put(self, sample):
+        """Run in the event loop"""
+        if self.__queue.qsize() >= self.__backlog.maxlen:
+            self.__queue.get_nowait()
+
+        self.__queue.put_nowait(sample)
+
+
+class FeatureFeed:
+    """Poll an output feature of a DAN for all its subscriptions.
+
+    The samples are deduplicated by timestamp: every sample newer than the
+    last one seen is delivered once, oldest first. The first poll only
+    delivers the latest sample.
+    """
+
+    def __init__(self, dan, df_name: str):
+        self.dan = dan
+        self.df_name = df_name
+        self.subscriptions = []
+        self.timestamp = None
+        self.job = None
+
+    def poll_feature(self) -> bool:
+        """Pull the feature once
+
+        :return: ``True`` if a new sample is delivered, which keeps the poll
+          interval short.
+        """
+        if self.dan.state != 'RESUME':
+            return False
+
+        samples = self.dan.csmapi.pull(self.dan.mac_addr, self.df_name)
+
+        if not samples:
+            return False
+
+        if self.timestamp is None:
+            new_samples = samples[:1]
+        else:
+            # IoTtalk timestamps sort as strings, the latest sample comes first
+            new_samples = [sample for sample in samples if sample[0] > self.timestamp]
+
+        if not new_samples:
+            return False
+
+        self.timestamp = new_samples[0][0]
+
+        for timestamp, data in reversed(new_samples):
+            if not data:
+                continue
+
+            for subscription in list(self.subscriptions):
+                subscription.deliver(self.df_name, timestamp, data)
+
+        return True
@@ -0,0 +1,414 @@
+"""Dependency-free metrics in the Prometheus text exposition format.
+
+Recording is lock-free: every thread accumulates into a shard of its own and
+the shards are only merged when the metrics are collected. The shards of the
+finished threads are folded into a single one on collection. Under gevent the
+greenlets of an OS thread share its shard, they never run at the same time.
+
+uWSGI workers are separate processes. In multiprocess mode every process
+periodically writes a snapshot of its metrics to ``<multiprocess_dir>/<pid>.json``
+and ``/metrics`` sums the snapshots of all processes. The counters of the dead
+processes are kept in an archive, their gauges are dropped.
+"""
+import bisect
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger('VoiceTalk.metrics')
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)
+ARCHIVE_FILE_NAME = 'archive.json'
+
+
+class Metric:
+    type = None
+
+    def __init__(self, registry, name: str, documentation: str, labelnames: tuple = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        shard = self.registry.get_shard()
+        key = (self.name, label_values)
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    """The samples of a histogram are the count of every bucket, the ``+Inf``
+    bucket included, followed by the sum and the count of the observations.
+    """
+    type = 'histogram'
+
+    def __init__(self, registry, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *label_values) -> None:
+        shard = self.registry.get_shard()
+        key = (self.name, label_values)
+        samples = shard.get(key)
+
+        if samples is None:
+            samples = shard[key] = [0] * (len(self.buckets) + 3)
+
+        samples[bisect.bisect_left(self.buckets, value)] += 1
+        samples[-2] += value
+        samples[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, *label_values):
+        """Observe the seconds spent in the ``with`` block"""
+        started_at = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, *label_values)
+
+
+class CallbackMetric(Metric):
+    """A metric whose value is read from ``func()`` on collection.
+
+    ``func`` returns a number, or ``{label values: number}`` for a labeled
+    metric. The gauges of the processes are not summed but labeled with ``pid``.
+    """
+
+    def __init__(self, registry, name: str, documentation: str, func,
+                 labelnames: tuple = (), type: str = 'gauge'):
+        super().__init__(registry, name, documentation, labelnames)
+        self.func = func
+        self.type = type
+
+    def read(self) -> dict:
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.debug('Fail to read the metric %s: %s', self.name, e)
+            return {}
+
+        if isinstance(value, dict):
+            return {tuple(label_values): value for label_values, value in value.items()}
+
+        return {(): value}
+
+
+class Registry:
+    def __init__(self):
+        self.multiprocess_dir = None
+        self.__metrics = OrderedDict()
+        self.__lock = threading.Lock()
+        self.__local = _new_thread_local()
+        self.__shards = []
+        self.__retired = {}
+        os.register_at_fork(after_in_child=self.__reset_after_fork)
+
+    def configure(self, multiprocess_dir: str = None) -> None:
+        """Enable the multiprocess mode, call it before forking the workers.
+
+        The snapshots left by a previous run are removed.
+        """
+        self.multiprocess_dir = multiprocess_dir or None
+
+        if self.multiprocess_dir is None:
+            return
+
+        path = Path(self.multiprocess_dir)
+        path.mkdir(parents=True, exist_ok=True)
+
+        for snapshot in path.glob('*.json'):
+            snapshot.unlink()
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()) -> Counter:
+        return self.__register(Counter(self, name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.__register(Histogram(self, name, documentation, labelnames, buckets))
+
+    def callback(self, name: str, documentation: str, func, labelnames: tuple = (),
+                 type: str = 'gauge') -> CallbackMetric:
+        """Register a metric read from ``func()``, see ``CallbackMetric``"""
+        return self.__register(CallbackMetric(self, name, documentation, func,
+                                              labelnames, type))
+
+    def get_shard(self) -> dict:
+        """Get the shard of the current thread"""
+        try:
+            return self.__local.shard
+        except AttributeError:
+            shard = self.__local.shard = {}
+
+            # A greenlet is seen as a thread that never ends, the shard of an OS
+            # thread of gevent is kept for good
+            thread = None if _is_gevent_patched() else threading.current_thread()
+
+            with self.__lock:
+                self.__shards.append((thread, shard))
+
+            return shard
+
+    def collect(self) -> dict:
+        """Merge the shards of the threads and read the callback metrics
+
+        :return: ``{(name, label values): value}``, the value of a histogram is
+          the list of its samples
+        :rtype: dict
+        """
+        with self.__lock:
+            alive_shards = []
+
+            for thread, shard in self.__shards:
+                if thread is None or thread.is_alive():
+                    alive_shards.append((thread, shard))
+                else:
+                    _merge(self.__retired, shard.copy())
+
+            self.__shards = alive_shards
+            merged = _merge({}, self.__retired)
+
+        for _, shard in alive_shards:
+            _merge(merged, shard.copy())
+
+        for metric in list(self.__metrics.values()):
+            if isinstance(metric, CallbackMetric):
+                for label_values, value in metric.read().items():
+                    merged[(metric.name, label_values)] = value
+
+        return merged
+
+    def flush(self) -> None:
+        """Write the snapshot of this process in the multiprocess directory"""
+        if self.multiprocess_dir is None:
+            return
+
+        path = Path(self.multiprocess_dir) / '{}.json'.format(os.getpid())
+        _write_snapshot(path, self.collect())
+
+    def expose(self) -> str:
+        """Render the metrics in the Prometheus text format
+
+        :rtype: str
+        """
+        if self.multiprocess_dir is None:
+            samples = self.collect()
+        else:
+            self.flush()
+            samples = self.__collect_processes()
+
+        lines = []
+        by_name = OrderedDict((name, []) for name in self.__metrics)
+
+        for (name, label_values), value in samples.items():
+            if name in by_name:
+                by_name[name].append((label_values, value))
+
+        for name, metric_samples in by_name.items():
+            metric = self.__metrics[name]
+            lines.append('# HELP {} {}'.format(name, metric.documentation))
+            lines.append('# TYPE {} {}'.format(name, metric.type))
+
+            for label_values, value in sorted(metric_samples,
+                                              key=lambda s: tuple(map(str, s[0]))):
+                labels = list(zip(metric.labelnames, label_values))
+
+                if len(label_values) > len(metric.labelnames):
+                    # Labeled with the pid by the multiprocess mode
+                    labels.append(('pid', label_values[-1]))
+
+                if isinstance(metric, Histogram):
+                    lines.extend(_format_histogram(metric, labels, value))
+                else:
+                    lines.append(_format_sample(name, labels, value))
+
+        return '\n'.join(lines) + '\n'
+
+    def __register(self, metric: Metric) -> Metric:
+        with self.__lock:
+            if metric.name in self.__metrics:
+                raise ValueError('Duplicated metric: {}'.format(metric.name))
+
+            self.__metrics[metric.name] = metric
+
+        return metric
+
+    def __collect_processes(self) -> dict:
+        """Sum the snapshots of the processes, archive the ones of dead processes"""
+        directory = Path(self.multiprocess_dir)
+        gauges = {name for name, metric in self.__metrics.items() if metric.type == 'gauge'}
+        merged = {}
+
+        with open(str(directory / '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            archive_path = directory / ARCHIVE_FILE_NAME
+            archive = _read_snapshot(archive_path)
+            archived = False
+
+            for snapshot_path in directory.glob('[0-9]*.json'):
+                pid = snapshot_path.stem
+                snapshot = _read_snapshot(snapshot_path)
+
+                if not _is_alive(int(pid)):
+                    _merge(archive, {key: value for key, value in snapshot.items()
+                                     if key[0] not in gauges})
+                    snapshot_path.unlink()
+                    archived = True
+                    continue
+
+                for (name, label_values), value in snapshot.items():
+                    if name in gauges:
+                        merged[(name, label_values + (pid,))] = value
+                    else:
+                        _merge(merged, {(name, label_values): value})
+
+            if archived:
+                _write_snapshot(archive_path, archive)
+
+        return _merge(merged, archive)
+
+    def __reset_after_fork(self):
+        """Forget the metrics recorded by the parent process"""
+        self.__lock = threading.Lock()
+        self.__local = _new_thread_local()
+        self.__shards = []
+        self.__retired = {}
+
+
+def _is_gevent_patched() -> bool:
+    monkey = sys.modules.get('gevent.monkey')
+
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+def _new_thread_local():
+    """Storage local to the OS thread, gevent patches ``threading.local`` into a
+    storage local to the greenlet
+    """
+    if _is_gevent_patched():
+        return sys.modules['gevent.monkey'].get_original('threading', 'local')()
+
+    return threading.local()
+
+
+def _merge(target: dict, source: dict) -> dict:
+    for key, value in source.items():
+        current = target.get(key)
+
+        if current is None:
+            target[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(value, list):
+            target[key] = [a + b for a, b in zip(current, value)]
+        else:
+            target[key] = current + value
+
+    return target
+
+
+def _write_snapshot(path: Path, samples: dict) -> None:
+    temp_path = path.with_suffix('.tmp')
+
+    with temp_path.open('w') as f:
+        json.dump([[name, list(label_values), value]
+                   for (name, label_values), value in samples.items()], f)
+
+    # Atomic, the readers never see a partial snapshot
+    os.replace(str(temp_path), str(path))
+
+
+def _read_snapshot(path: Path) -> dict:
+    try:
+        with path.open() as f:
+            return {(name, tuple(label_values)): value
+                    for name, label_values, value in json.load(f)}
+    except (OSError, ValueError):
+        return {}
+
+
+def _is_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_sample(name: str, labels: list, value) -> str:
+    if labels:
+        name = '{}{{{}}}'.format(
+            name, ','.join('{}="{}"'.format(key, _escape(value)) for key, value in labels))
+
+    return '{} {}'.format(name, float(value))
+
+
+def _format_histogram(metric: Histogram, labels: list, samples: list) -> list:
+    lines = []
+    cumulative = 0
+
+    for bound, count in zip(metric.buckets + (float('inf'),), samples):
+        cumulative += count
+        le = '+Inf' if bound == float('inf') else repr(float(bound))
+        lines.append(_format_sample(metric.name + '_bucket', labels + [('le', le)],
+                                    cumulative))
+
+    lines.append(_format_sample(metric.name + '_sum', labels, samples[-2]))
+    lines.append(_format_sample(metric.name + '_count', labels, samples[-1]))
+
+    return lines
+
+
+registry = Registry()
+
+# Instruments of the hot paths
+request_total = registry.counter(
+    'voicetalk_requests_total', 'Handled HTTP requests',
+    ('route', 'intent', 'status'))
+request_duration = registry.histogram(
+    'voicetalk_request_duration_seconds', 'Latency of the HTTP requests',
+    ('route', 'intent'))
+db_session_duration = registry.histogram(
+    'voicetalk_db_session_duration_seconds', 'Duration of the DB session scopes')
+db_checkout_duration = registry.histogram(
+    'voicetalk_db_checkout_duration_seconds', 'Wait for a connection of the DB pool')
+password_duration = registry.histogram(
+    'voicetalk_password_duration_seconds', 'Duration of the argon2 operations',
+    ('operation',), buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+password_rejected_total = registry.counter(
+    'voicetalk_password_rejected_total',
+    'Password operations rejected because the workers are saturated')
+csmapi_duration = registry.histogram(
+    'voicetalk_csmapi_duration_seconds', 'Latency of the IoTtalk CSM API calls',
+    ('method', 'status'))
+homegraph_duration = registry.histogram(
+    'voicetalk_homegraph_duration_seconds', 'Latency of the Home Graph API calls',
+    ('method', 'status'))
+poll_duration = registry.histogram(
+    'voicetalk_poll_duration_seconds', 'Latency of the periodic polls', ('job',))
+push_wait_duration = registry.histogram(
+    'voicetalk_push_queue_wait_seconds', 'Time the pushes wait for a push worker')
+push_service_duration = registry.histogram(
+    'voicetalk_push_queue_service_seconds', 'Time the push workers run the pushes',
+    ('outcome',))
@@ -1,8 +1,15 @@
 from datetime import datetime
 
+from sqlalchemy.exc import IntegrityError
+
 from voicetalk.db import models
+from voicetalk.utils import get_one_hour_after_timestamp, get_random_token
+
+__all__ = ['access_token_exists', 'refresh_token_exists', 'claim_authorization_code',
+           'issue_tokens', 'rotate_access_token']
 
-__all__ = ['access_token_exists', 'refresh_token_exists']
+# Attempts to insert a token before giving up on unique constraint conflicts
+TOKEN_ATTEMPTS = 3
 
 
 def access_token_exists(db_session, access_token: str) -> bool:
@@ -64,6 +71,115 @@ def validate_authorization_code(authorization_code_instance: models.Authorizatio
         return True
 
 
+def claim_authorization_code(db_session, code: str, redirect_uri: str):
+    """Consume the given authorization code
+
+    The code is deleted whether it is valid or not. Only the request whose
+    ``DELETE`` removes the row gets the user ID, so a code replayed
+    concurrently is never exchanged twice.
+
+    :param db_session: SQLAlchemy session
+    :param code: Authorization code
+    :type code: str
+    :param redirect_uri: Redirect URI of the token request
+    :type redirect_uri: str
+    :return: The user ID of a valid code, None otherwise
+    :rtype: int
+    """
+    authorization_code = (db_session.query(models.AuthorizationCode.id,
+                                           models.AuthorizationCode.u_id,
+                                           models.AuthorizationCode.expires_at,
+                                           models.AuthorizationCode.redirect_uri)
+                                    .filter_by(code=code)
+                                    .first())
+
+    if authorization_code is None:
+        return None
+
+    deleted = (db_session.query(models.AuthorizationCode)
+                         .filter_by(id=authorization_code.id)
+                         .delete(synchronize_session=False))
+
+    if deleted != 1 or not validate_authorization_code(authorization_code, redirect_uri):
+        return None
+
+    return authorization_code.u_id
+
+
+def issue_tokens(db_session, u_id: int, signed_token_codec=None) -> tuple:
+    """Insert a new pair of access token and refresh token of the given user
+
+    The unique constraints of the tokens are enforced by the DB, the tokens are
+    regenerated on conflict.
+
+    :param db_session: SQLAlchemy session
+    :param u_id: User ID
+    :type u_id: int
+    :param signed_token_codec: Sign the access token with this codec instead
+      of generating an opaque one
+    :type signed_token_codec: voicetalk.oauth2.signed_token.SignedTokenCodec
+    :raise IntegrityError: If every attempt conflicts.
+    :return: The access token and the refresh token
+    :rtype: tuple
+    """
+    for attempt in range(TOKEN_ATTEMPTS):
+        expires_at = get_one_hour_after_timestamp()
+        access_token_instance = models.AccessToken(
+            token=_new_access_token(u_id, expires_at, signed_token_codec),
+            expires_at=expires_at,
+            u_id=u_id)
+        refresh_token_instance = models.RefreshToken(token=get_random_token(64), u_id=u_id)
+        refresh_token_instance.access_token = access_token_instance
+
+        try:
+            with db_session.begin_nested():
+                db_session.add(refresh_token_instance)
+        except IntegrityError:
+            if attempt == TOKEN_ATTEMPTS - 1:
+                raise
+            continue
+
+        return access_token_instance.token, refresh_token_instance.token
+
+
+def rotate_access_token(db_session, refresh_token_instance: models.RefreshToken,
+                        signed_token_codec=None) -> str:
+    """Replace the access token of the given refresh token by a new one
+
+    :param db_session: SQLAlchemy session
+    :param refresh_token_instance: Refresh token instance
+    :param signed_token_codec: Sign the access token with this codec instead
+      of generating an opaque one
+    :type signed_token_codec: voicetalk.oauth2.signed_token.SignedTokenCodec
+    :raise IntegrityError: If every attempt conflicts.
+    :return: The new access token
+    :rtype: str
+    """
+    for attempt in range(TOKEN_ATTEMPTS):
+        expires_at = get_one_hour_after_timestamp()
+        new_access_token = _new_access_token(refresh_token_instance.u_id, expires_at,
+                                             signed_token_codec)
+
+        try:
+            with db_session.begin_nested():
+                refresh_token_instance.access_token.token = new_access_token
+                refresh_token_instance.access_token.expires_at = expires_at
+        except IntegrityError:
+            if attempt == TOKEN_ATTEMPTS - 1:
+                raise
+            db_session.refresh(refresh_token_instance)
+            continue
+
+        return new_access_token
+
+
+def _new_access_token(u_id: int, expires_at: float, signed_token_codec=None) -> str:
+    if signed_token_codec is None:
+        return get_random_token(64)
+
+    return signed_token_codec.encode(u_id, expires_at)
+
+
 def _token_exists(db_session, model, token: str, column_name: str) -> bool:
     """Check the given token exists in the given table(model) or not
 
@@ -0,0 +1,352 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import os
+import struct
+import threading
+import time
+
+from voicetalk.db import models
+from voicetalk.db.db import DB
+
+__all__ = ['SignedTokenCodec', 'RevocationList', 'RevocationStore', 'parse_keys',
+           'is_signed']
+
+logger = logging.getLogger('VoiceTalk.oauth2.signed_token')
+
+# u_id, issued at in milliseconds, expires at and a random nonce keeping the
+# tokens unique
+_PAYLOAD = struct.Struct('>QQI6s')
+
+
+def parse_keys(value: str) -> list:
+    """Parse the signing keys of the config
+
+    :param value: Comma separated ``<key ID>:<secret>``, the first key signs the
+      new tokens, the others are only accepted, e.g. during a key rotation.
+    :type value: str
+    :return: List of ``(key ID, secret)``
+    :rtype: list
+    """
+    keys = []
+
+    for item in value.split(','):
+        if not item.strip():
+            continue
+
+        kid, sep, secret = item.strip().partition(':')
+
+        if not sep or not kid or not secret or '.' in kid:
+            raise ValueError('Invalid signing key: {}'.format(kid or item.strip()))
+
+        keys.append((kid, secret))
+
+    return keys
+
+
+def is_signed(token: str) -> bool:
+    """Tell a signed token from an opaque one, opaque tokens have no dots"""
+    return bool(token) and '.' in token
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+class RevocationStore:
+    """The revocations persisted in the ``RevokedToken`` table"""
+
+    def add_token(self, u_id: int, nonce: bytes, expires_at: float,
+                  db_session=None) -> None:
+        """
+        :param db_session: Add it in this SQLAlchemy session, in a new
+          transaction by default
+        """
+        self.__add(db_session, u_id, _b64encode(nonce), int(time.time() * 1000),
+                   expires_at)
+
+    def add_user(self, u_id: int, revoked_at: int, expires_at: float,
+                 db_session=None) -> None:
+        """
+        :param revoked_at: Timestamp in milliseconds, the tokens of the user
+          issued until then are revoked
+        :type revoked_at: int
+        :param db_session: Add it in this SQLAlchemy session, in a new
+          transaction by default
+        """
+        self.__add(db_session, u_id, None, revoked_at, expires_at)
+
+    def load(self) -> tuple:
+        """Load the revocations that have not expired, the expired ones are deleted
+
+        :return: ``({nonce: expires_at}, {u_id: revoked_at})``
+        :rtype: tuple
+        """
+        now = time.time()
+        tokens = {}
+        users = {}
+
+        with DB().get_session_scope() as db_session:
+            (db_session.query(models.RevokedToken)
+                       .filter(models.RevokedToken.expires_at < now)
+                       .delete(synchronize_session=False))
+
+            for revoked_token in db_session.query(models.RevokedToken):
+                if revoked_token.nonce is not None:
+                    tokens[_b64decode(revoked_token.nonce)] = revoked_token.expires_at
+                else:
+                    users[revoked_token.u_id] = max(users.get(revoked_token.u_id, 0),
+                                                    revoked_token.revoked_at)
+
+        return tokens, users
+
+    @staticmethod
+    def __add(db_session, u_id, nonce, revoked_at, expires_at):
+        revoked_token = models.RevokedToken(u_id=u_id, nonce=nonce, revoked_at=revoked_at,
+                                            expires_at=int(expires_at))
+
+        if db_session is not None:
+            db_session.add(revoked_token)
+            return
+
+        with DB().get_session_scope() as db_session:
+            db_session.add(revoked_token)
+
+
+class RevocationList:
+    """Small list of revoked signed tokens.
+
+    A token is revoked on its own, e.g. when it is refreshed, or together
+    with every token of a user issued so far, e.g. on DISCONNECT. An entry is
+    dropped once the tokens it revokes have expired, so the list never grows
+    beyond the tokens issued within a token lifetime.
+
+    The list is checked in memory. With a ``store``, the revocations are
+    persisted too and the list is reloaded from the store every
+    ``sync_interval`` seconds, so a revocation survives a restart and reaches
+    the other processes within that delay. Without a store, a revocation only
+    affects the process that performs it.
+    """
+
+    def __init__(self, lifetime: float = 3600, store: RevocationStore = None,
+                 sync_interval: float = 5):
+        """
+        :param lifetime: Seconds an access token lives
+        :type lifetime: float
+        :param store: Where the revocations are persisted
+        :type store: RevocationStore
+        :param sync_interval: Seconds between two reloads from the store
+        :type sync_interval: float
+        """
+        self.lifetime = lifetime
+        self.store = store
+        self.sync_interval = sync_interval
+        self.__tokens = {}
+        self.__users = {}
+        self.__synced_at = None
+        self.__lock = threading.Lock()
+        self.__sync_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__tokens) + len(self.__users)
+
+    def revoke_token(self, u_id: int, nonce: bytes, expires_at: float,
+                     db_session=None) -> None:
+        """
+        :param db_session: Persist the revocation in this SQLAlchemy session
+        """
+        if self.store is not None:
+            self.store.add_token(u_id, nonce, expires_at, db_session)
+
+        with self.__lock:
+            self.__prune()
+            self.__tokens[nonce] = expires_at
+
+    def revoke_user(self, u_id: int, db_session=None) -> None:
+        """Revoke the tokens of the given user issued until now
+
+        :param db_session: Persist the revocation in this SQLAlchemy session
+        """
+        revoked_at = int(time.time() * 1000)
+
+        if self.store is not None:
+            self.store.add_user(u_id, revoked_at, revoked_at / 1000 + self.lifetime,
+                                db_session)
+
+        with self.__lock:
+            self.__prune()
+            self.__users[u_id] = max(self.__users.get(u_id, 0), revoked_at)
+
+    def is_revoked(self, u_id: int, issued_at: int, nonce: bytes) -> bool:
+        """
+        :param issued_at: Timestamp in milliseconds at which the token is issued
+        :type issued_at: int
+        """
+        if self.store is not None:
+            self.sync()
+
+        # Read without the lock, a dict lookup is atomic
+        revoked_at = self.__users.get(u_id)
+
+        if revoked_at is not None and issued_at <= revoked_at:
+            return True
+
+        return nonce in self.__tokens
+
+    def sync(self, force: bool = False) -> None:
+        """Reload the list from the store if it is older than ``sync_interval``
+
+        A single thread reloads it, the others keep checking the current list,
+        except before the first load. The list is kept if the store fails.
+        """
+        if not force and self.__is_fresh():
+            return
+
+        if not self.__sync_lock.acquire(blocking=force or self.__synced_at is None):
+            return
+
+        try:
+            if not force and self.__is_fresh():
+                return
+
+            try:
+                tokens, users = self.store.load()
+            except Exception:
+                logger.exception('Failed to load the revoked tokens')
+            else:
+                with self.__lock:
+                    self.__tokens = tokens
+                    self.__users = users
+
+            # Retried after an interval on failure too, the store is not hammered
+            self.__synced_at = time.monotonic()
+        finally:
+            self.__sync_lock.release()
+
+    def __is_fresh(self) -> bool:
+        if self.__synced_at is None:
+            return False
+
+        return time.monotonic() < self.__synced_at + self.sync_interval
+
+    def __prune(self) -> None:
+        now = time.time()
+        self.__tokens = {nonce: expires_at for nonce, expires_at in self.__tokens.items()
+                         if expires_at >= now}
+        self.__users = {u_id: revoked_at for u_id, revoked_at in self.__users.items()
+                        if revoked_at / 1000 + self.lifetime >= now}
+
+
+class SignedTokenCodec:
+    """Stateless access tokens signed by HMAC-SHA256.
+
+    A token is ``<key ID>.<payload>.<signature>`` in base64url, the payload
+    carries the user ID and the expiry, so it is verified without the DB.
+    """
+
+    def __init__(self, keys: list, revocation_list: RevocationList = None):
+        """
+        :param keys: List of ``(key ID, secret)``, see ``parse_keys()``
+        :type keys: list
+        :param revocation_list: Revoked tokens, a new list by default
+        :type revocation_list: RevocationList
+        """
+        if not keys:
+            raise ValueError('At least a signing key is required')
+
+        self.kid = keys[0][0]
+        # An empty list is falsy
+        self.revocation_list = (revocation_list if revocation_list is not None
+                                else RevocationList())
+        self.__keys = {kid: secret.encode() for kid, secret in keys}
+
+    def encode(self, u_id: int, expires_at: float) -> str:
+        """Sign a token of the given user
+
+        :param u_id: User ID
+        :type u_id: int
+        :param expires_at: Timestamp at which the token expires
+        :type expires_at: float
+        :rtype: str
+        """
+        payload = _b64encode(_PAYLOAD.pack(u_id, int(time.time() * 1000), int(expires_at),
+                                           os.urandom(6)))
+        signing_input = '{}.{}'.format(self.kid, payload)
+
+        return '{}.{}'.format(signing_input,
+                              _b64encode(self.__sign(self.__keys[self.kid], signing_input)))
+
+    def decode(self, token: str) -> tuple or None:
+        """Verify the signature and the expiry of the given token
+
+        :param token: Signed access token
+        :type token: str
+        :return: ``(u_id, issued_at, expires_at, nonce)``, ``issued_at`` in
+          milliseconds. ``None`` if the token is forged, expired or signed by an
+          unknown key.
+        :rtype: tuple or None
+        """
+        try:
+            signing_input, signature = token.rsplit('.', 1)
+            kid, payload = signing_input.split('.')
+            key = self.__keys[kid]
+
+            if not hmac.compare_digest(self.__sign(key, signing_input),
+                                       _b64decode(signature)):
+                return None
+
+            claims = _PAYLOAD.unpack(_b64decode(payload))
+        except (AttributeError, KeyError, ValueError, binascii.Error, struct.error):
+            return None
+
+        if time.time() > claims[2]:
+            return None
+
+        return claims
+
+    def verify(self, token: str) -> int or None:
+        """Get the user ID of a valid, unrevoked token
+
+        :param token: Signed access token
+        :type token: str
+        :return: The user ID, ``None`` if the token is invalid.
+        :rtype: int or None
+        """
+        claims = self.decode(token)
+
+        if claims is None:
+            return None
+
+        u_id, issued_at, _, nonce = claims
+
+        if self.revocation_list.is_revoked(u_id, issued_at, nonce):
+            return None
+
+        return u_id
+
+    def revoke(self, token: str, db_session=None) -> None:
+        """Revoke the given token until it expires, invalid tokens are ignored
+
+        :param db_session: Persist the revocation in this SQLAlchemy session
+        """
+        claims = self.decode(token)
+
+        if claims is not None:
+            self.revocation_list.revoke_token(claims[0], claims[3], claims[2], db_session)
+
+    def revoke_user(self, u_id: int, db_session=None) -> None:
+        """Revoke every token of the given user issued until now
+
+        :param db_session: Persist the revocation in this SQLAlchemy session
+        """
+        self.revocation_list.revoke_user(u_id, db_session)
+
+    @staticmethod
+    def __sign(key: bytes, signing_input: str) -> bytes:
+        return hmac.new(key, signing_input.encode(), hashlib.sha256).digest()
@@ -0,0 +1,127 @@
+import threading
+import time
+
+from collections import OrderedDict
+
+__all__ = ['TokenCache']
+
+
+class TokenCache:
+    """Bounded, TTL-aware cache of validated access tokens.
+
+    The cache maps a bearer token to ``(u_id, expires_at)`` so that
+    ``/fulfillment`` can skip the ``AccessToken`` lookup for tokens it has
+    already seen. An entry is served for ``ttl`` seconds at most and never
+    after the ``expires_at`` of its token, and the least recently used entry
+    is evicted when the cache is full.
+
+    The cache lives in the process memory, so an invalidation only affects the
+    process that performs it. A token refreshed in another process, or whose
+    user is removed by the CLI, is rejected within ``ttl`` seconds.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 30):
+        """
+        :param max_size: Maximum number of cached tokens. ``0`` disables the cache.
+        :type max_size: int
+        :param ttl: Seconds a token is cached
+        :type ttl: float
+        """
+        self.max_size = max(0, max_size)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, token: str) -> int or None:
+        """Get the user ID of a cached and unexpired token
+
+        :param token: Access token
+        :type token: str
+        :return: The user ID on a cache hit, ``None`` otherwise.
+        :rtype: int or None
+        """
+        with self.__lock:
+            entry = self.__entries.get(token)
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            u_id, expires_at = entry
+
+            if time.time() > expires_at:
+                del self.__entries[token]
+                self.misses += 1
+                return None
+
+            self.__entries.move_to_end(token)
+            self.hits += 1
+
+            return u_id
+
+    def put(self, token: str, u_id: int, expires_at: float) -> None:
+        """Cache a validated token for ``ttl`` seconds, or until it expires
+
+        :param token: Access token
+        :type token: str
+        :param u_id: ID of the user who owns the token
+        :type u_id: int
+        :param expires_at: Timestamp at which the token expires
+        :type expires_at: float
+        """
+        now = time.time()
+
+        if not token or not self.max_size or now > expires_at:
+            return
+
+        with self.__lock:
+            self.__entries[token] = (u_id, min(expires_at, now + self.ttl))
+            self.__entries.move_to_end(token)
+
+            while len(self.__entries) > self.max_size:
+                self.__entries.popitem(last=False)
+
+    def invalidate(self, token: str) -> None:
+        """Drop the given token from the cache
+
+        :param token: Access token
+        :type token: str
+        """
+        with self.__lock:
+            self.__entries.pop(token, None)
+
+    def invalidate_user(self, u_id: int) -> None:
+        """Drop the tokens of the given user from the cache
+
+        :param u_id: User ID
+        :type u_id: int
+        """
+        with self.__lock:
+            for token in [token for token, (owner, _) in self.__entries.items()
+                          if owner == u_id]:
+                del self.__entries[token]
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+
+    @property
+    def stats(self) -> dict:
+        """Hit/miss counters and the current occupancy of the cache
+
+        :rtype: dict
+        """
+        with self.__lock:
+            size = len(self.__entries)
+
+        lookups = self.hits + self.misses
+
+        return {
+            'size': size,
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
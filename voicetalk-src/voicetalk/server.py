@@ -1,9 +1,13 @@
+import concurrent.futures
 import logging
+import os
+import threading
+import time
 import urllib
 
 from datetime import datetime, timedelta
 
-from flask import (Flask, jsonify, render_template, request, redirect,
+from flask import (Flask, g, jsonify, render_template, request, redirect,
                    make_response)
 from flask_login import (current_user, login_required, login_user, logout_user,
                          LoginManager)
@@ -11,54 +15,178 @@ from flask_login import (current_user, login_required, login_user, logout_user,
 from voicetalk import account
 from voicetalk import const as CONST
 from voicetalk import device
+from voicetalk import metrics
+from voicetalk import tracing
 from voicetalk import cli
+from voicetalk import db
 from voicetalk.config import config
 from voicetalk.db import models
 from voicetalk.db.db import DB
-from voicetalk.iottalk import DAN
-from voicetalk.oauth2 import oauth2
-from voicetalk.utils import get_one_hour_after_timestamp, get_random_token, password
+from voicetalk.device.catalog import DeviceCatalog
+from voicetalk.device.state import DeviceStateStore, IoTtalkStateFeed
+from voicetalk.homegraph.reporter import StateReporter
+from voicetalk.homegraph.sink import create_sink
+from voicetalk.iottalk import csmapi
+from voicetalk.iottalk.circuit_breaker import STATE_VALUES
+from voicetalk.iottalk.coalescer import PushCoalescer
+from voicetalk.iottalk.poller import Poller
+from voicetalk.iottalk.push_queue import PushQueue, PushQueueFull
+from voicetalk.iottalk.registry import DANRegistry
+from voicetalk.oauth2 import oauth2, signed_token
+from voicetalk.oauth2.token_cache import TokenCache
+from voicetalk.utils import get_random_token, password
 
 app = Flask(__name__)
-dan_instance = DAN.DAN()
 login_manager = LoginManager()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('VoiceTalk')
 
-# Parse the command line arguments
-parser, args = cli.parse_args()
+# Built by ``init_app()`` once the configuration is loaded
+async_http_client = None
+poller = None
+dan_registry = None
+device_catalog = None
+device_state_store = None
+token_cache = None
+signed_token_codec = None
+push_queue = None
+push_coalescer = None
+state_reporter = None
 
-# Load the configuration
-cli.load_config(args)
-
-iottalk_profile = {
-    'd_name': config.iottalk_conf['device_name'],
-    'dm_name': config.iottalk_conf['device_model_name'],
-    'df_list': [config.iottalk_conf['device_feature']],
-    'is_sim': False
-}
+ready = threading.Event()
 
 login_manager.init_app(app)
 
 
 @login_manager.user_loader
 def load_user(id):
-    db_instance = DB()
-    with db_instance.get_session_scope() as db_session:
-        user = (db_session.query(models.User)
-                .filter_by(id=id)
-                          .first())
-        # Expunge the user instance so it can be accessed after the session is committed
-        db_session.expunge(user)
+    try:
+        u_id = int(id)
+    except (TypeError, ValueError):
+        return None
 
-    return user
+    # None logs out the session of a deleted user
+    return account.get_identity(u_id)
 
 
-@app.before_first_request
-def f():
-    db_instance = DB()
-    db_instance.connect(config.db_conf['url'])
+def set_up():
+    """Initialise what is shared by all the workers, when the app is built.
+
+    Under uWSGI the app is built in the master process before the workers are
+    forked, so the default user is hashed once instead of once per worker. No
+    connection or thread is left behind for the workers to inherit.
+    """
+    metrics.registry.configure(config.metrics_conf['multiprocess_dir'])
+    db.connect()
     add_default_user(config.username, config.password)
+    DB().dispose()
+    device_catalog.load()
+    password.get_password_hasher()
+
+
+def warm_up(register_linked_users: bool = True):
+    """Warm up a worker process before it serves its first request.
+
+    It runs in the uWSGI postfork hook, or right before the development server
+    starts. ``/ready`` answers 200 once it completes.
+
+    :param register_linked_users: Register the DAs of the linked users. Only
+      the first uWSGI worker does, the others register a DA on its first use.
+    :type register_linked_users: bool
+    """
+    db.connect()
+
+    if not config.db_conf['url'].startswith('sqlite'):
+        DB().fill_pool(config.db_conf['pool_size'])
+
+    poller.add(dan_registry.evict_idle, interval=60, max_interval=60)
+    poller.add(device_state_store.prune, interval=60, max_interval=60)
+
+    if metrics.registry.multiprocess_dir:
+        flush_interval = config.metrics_conf['flush_interval']
+        poller.add(metrics.registry.flush, interval=flush_interval,
+                   max_interval=flush_interval)
+
+    if config.iottalk_conf['state_feature']:
+        IoTtalkStateFeed(dan_registry,
+                         config.iottalk_conf['state_feature'],
+                         device_state_store,
+                         config.iottalk_conf['state_poll_interval'],
+                         config.iottalk_conf['state_poll_max_interval']).start()
+
+    if state_reporter is not None:
+        poller.add(device_catalog.refresh,
+                   interval=config.homegraph_conf['catalog_check_interval'],
+                   max_interval=config.homegraph_conf['catalog_check_interval'])
+
+    # Register the DAs of the linked users in the background, IoTtalk being slow
+    # or down must not hold the worker back
+    if register_linked_users:
+        for u_id in get_linked_users(dan_registry.max_instances):
+            dan_registry.register_in_background(u_id)
+
+    ready.set()
+    logger.info('Worker %d is ready', os.getpid())
+
+
+def get_linked_users(limit: int = None) -> list:
+    """Get the IDs of the users who linked their account to Google"""
+    with DB().get_session_scope() as db_session:
+        query = db_session.query(models.RefreshToken.u_id).distinct()
+
+        if limit is not None:
+            query = query.limit(limit)
+
+        return [u_id for u_id, in query]
+
+
+def request_sync_linked_users():
+    """Ask Google to SYNC every linked user, the device catalog changed"""
+    state_reporter.request_sync(get_linked_users())
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started_at = time.perf_counter()
+    g.trace = tracing.start_trace(request.path, method=request.method)
+    g.trace.__enter__()
+
+
+@app.teardown_request
+def finish_request_trace(exc):
+    trace = g.pop('trace', None)
+
+    if trace is not None:
+        trace.__exit__(type(exc) if exc else None, exc, None)
+
+
+@app.after_request
+def observe_request(response):
+    started_at = g.get('request_started_at')
+
+    if started_at is None:
+        return response
+
+    route = request.url_rule.rule if request.url_rule else 'unknown'
+    intent = get_request_intent()
+    metrics.request_duration.observe(time.perf_counter() - started_at, route, intent)
+    metrics.request_total.inc(route, intent, str(response.status_code))
+
+    return response
+
+
+def get_request_intent() -> str:
+    """The intent of a fulfillment request or the grant type of a token request"""
+    if request.path == '/fulfillment':
+        payload = request.get_json(silent=True) or {}
+        inputs = payload.get('inputs') or [{}]
+        intent = inputs[0].get('intent', '') if isinstance(inputs[0], dict) else ''
+
+        return intent.rsplit('.', 1)[-1]
+    elif request.path == '/token':
+        return request.form.get('grant_type', '')
+
+    return ''
 
 
 @app.route('/fulfillment', methods=['POST'])
@@ -75,65 +203,158 @@ def fulfillment():
     except IndexError:
         access_token = None
 
-    with db_instance.get_session_scope() as db_session:
-        access_token_instance = (db_session.query(models.AccessToken)
-                                           .filter_by(token=access_token)
-                                           .first())
-        if not oauth2.validate_access_token(access_token_instance):
+    if signed_token_codec is not None and signed_token.is_signed(access_token):
+        # Stateless, verified without the DB
+        u_id = signed_token_codec.verify(access_token)
+
+        if u_id is None:
             return '', 401
+    else:
+        u_id = token_cache.get(access_token)
 
-        u_id = access_token_instance.u_id
+    if u_id is None:
+        with db_instance.get_session_scope() as db_session:
+            access_token_instance = (db_session.query(models.AccessToken)
+                                               .filter_by(token=access_token)
+                                               .first())
+            if not oauth2.validate_access_token(access_token_instance):
+                return '', 401
+
+            u_id = access_token_instance.u_id
+            token_cache.put(access_token, u_id, access_token_instance.expires_at)
 
-    request_payload = request.get_json()
+    with tracing.span('parse_json'):
+        request_payload = request.get_json()
 
     if not request_payload:
         return jsonify({}), 200
 
     inputs = request_payload.get('inputs', [])
     request_id = request_payload.get('requestId')
+    tracing.set_trace_id(request_id)
     response_payload = {}
     response = {'requestId': request_id, 'payload': response_payload}
+    execute_deadline = time.monotonic() + config.iottalk_conf['execute_deadline']
 
     for input_data in inputs:
-        logger.info('{} request'.format(input_data['intent']))
-        req_response_payload = {}
-        if input_data['intent'] == 'action.devices.SYNC':
-            logger.info('SYNC intent')
-            req_response_payload = \
-                {
-                    'devices': device.get_device_data(
-                        getattr(args, 'device_json_file_path')),
-                    'agentUserId': u_id
-                }
-        elif input_data['intent'] == 'action.devices.EXECUTE':
-            logger.info('EXECUTE intent')
-            dan_instance.push(config.iottalk_conf['device_feature'], input_data)
-            req_response_payload = \
-                {
-                    'commands': device.handle_execute_intent(
-                        input_data['payload'].get('commands', [[]]))
-                }
-        elif input_data['intent'] == 'action.devices.QUERY':
-            logger.info('QUERY intent')
-            '''
-            Currently, this intent is not available.
-            Use 'actionNotAvailable' ERROR to response
-            '''
-            req_response_payload = \
-                {
-                    'devices': device.hanlde_query_intent(
-                        input_data['payload'].get('devices', []))
+        with tracing.span(input_data['intent']):
+            logger.info('{} request'.format(input_data['intent']))
+            req_response_payload = {}
+            if input_data['intent'] == 'action.devices.SYNC':
+                logger.info('SYNC intent')
+                device_catalog.refresh()
+
+                # A SYNC request usually carries a single input, respond with the
+                # devices serialized when the catalog was loaded
+                if len(inputs) == 1:
+                    return app.response_class(
+                        device_catalog.sync_response_json(request_id, u_id),
+                        mimetype='application/json')
+
+                req_response_payload = \
+                    {
+                        'devices': device_catalog.devices,
+                        'agentUserId': u_id
+                    }
+            elif input_data['intent'] == 'action.devices.EXECUTE':
+                logger.info('EXECUTE intent')
+                commands = input_data['payload'].get('commands', [])
+                device_commands = device.split_execute_commands(commands)
+
+                # Push the commands asynchronously, a slow IoTtalk server must not
+                # stall the response. The coalescer merges the commands of the user
+                # into a single PUT, and resolves a future per device.
+                push_futures = {
+                    device_id: push_coalescer.submit(u_id, device_commands[device_id])
+                    for device_id in device_commands
                 }
-        elif input_data['intent'] == 'action.devices.DISCONNECT':
-            logger.info('DISCONNECT intent')
-            # Google Smarthome is unlinking, deregister the corresponding DA on the IoTtalk
-            dan_instance.deregister()
 
-        response_payload.update(req_response_payload)
+                # Wait for the acknowledgements of IoTtalk within the deadline budget
+                # of the whole request, an unacknowledged push is PENDING
+                with tracing.span('wait_pushes', count=len(push_futures)):
+                    concurrent.futures.wait(
+                        push_futures.values(),
+                        timeout=max(0, execute_deadline - time.monotonic()))
+                results = {device_id: get_push_result(future)
+                           for device_id, future in push_futures.items()}
+
+                device_state_store.record_execute_commands(
+                    u_id, [command
+                           for device_id, result in results.items()
+                           if result['status'] != 'ERROR'
+                           for command in device_commands[device_id]])
+
+                req_response_payload = \
+                    {
+                        'commands': device.handle_execute_intent(commands, results)
+                    }
+            elif input_data['intent'] == 'action.devices.QUERY':
+                logger.info('QUERY intent')
+                req_response_payload = \
+                    {
+                        'devices': device.handle_query_intent(
+                            input_data['payload'].get('devices', []),
+                            device_state_store, u_id)
+                    }
+            elif input_data['intent'] == 'action.devices.DISCONNECT':
+                logger.info('DISCONNECT intent')
+                # Google Smarthome is unlinking, deregister the user's DA on the IoTtalk
+                token_cache.invalidate_user(u_id)
+
+                if signed_token_codec is not None:
+                    signed_token_codec.revoke_user(u_id)
+
+                try:
+                    push_queue.submit(dan_registry.deregister, u_id, key=u_id)
+                except PushQueueFull:
+                    logger.warning('IoTtalk push queue is full, skip the deregistration')
+
+            response_payload.update(req_response_payload)
 
     return make_response(jsonify(response), 200)
 
 
+def push_execute_commands(u_id, device_commands: list) -> list:
+    """Push the EXECUTE commands of a user as a single EXECUTE intent
+
+    It runs on the push queue workers, see ``PushCoalescer``.
+
+    :param device_commands: The commands of every device coalesced within the
+      window, see ``device.split_execute_commands()``
+    :type device_commands: list
+    :return: The result of the push for every device
+    :rtype: list
+    """
+    intent = {
+        'intent': 'action.devices.EXECUTE',
+        'payload': {'commands': device.merge_execute_commands(device_commands)}
+    }
+    result = dan_registry.get(u_id).push(config.iottalk_conf['device_feature'], intent)
+
+    return [result] * len(device_commands)
+
+
+def get_push_result(future) -> dict:
+    """Translate the outcome of a push into the result of an EXECUTE command
+
+    :param future: The future of the push
+    :type future: concurrent.futures.Future
+    :rtype: dict
+    """
+    if not future.done():
+        return {'status': 'PENDING'}
+    elif isinstance(future.exception(), PushQueueFull):
+        logger.warning('IoTtalk push queue is full, drop the EXECUTE command')
+        return {'status': 'ERROR', 'errorCode': 'transientError'}
+    elif future.exception() is not None:
+        return {'status': 'ERROR', 'errorCode': 'transientError'}
+    elif future.result() is None:
+        # The DA is suspended on the IoTtalk
+        return {'status': 'ERROR', 'errorCode': 'deviceOffline'}
+
+    return {'status': 'SUCCESS'}
+
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     db_instance = DB()
@@ -167,11 +388,27 @@ def login():
 
             try:
                 password.verify(user.password, plaintext_password)
+            except password.PasswordHasherBusy:
+                return render_template(
+                    'login.html',
+                    error_msg='The server is busy, please try again later.'
+                ), 503, {'Retry-After': '1'}
             except RuntimeError:
                 return render_template('login.html',
                                        error_msg='Wrong username or password.')
 
-            login_user(user)
+            if password.needs_rehash(user.password):
+                try:
+                    account.change_password(user, plaintext_password)
+                except (password.PasswordHasherBusy, RuntimeError):
+                    # Keep the old hash, it is rehashed on a later login
+                    pass
+                else:
+                    logger.info('Rehash the password of user %s', user.username)
+
+            identity = account.UserIdentity.from_user(user)
+            account.identity_cache.put(identity)
+            login_user(identity)
 
         if not redirect_uri:
             redirect_uri = '/'
@@ -239,12 +476,11 @@ def oauth():
     authorization_code_instance = models.AuthorizationCode(
         code=authorization_code,
         expires_at=(datetime.now() + timedelta(minutes=10)).timestamp(),
-        redirect_uri=redirect_uri)
+        redirect_uri=redirect_uri,
+        u_id=current_user.id)
 
     with db_instance.get_session_scope() as db_session:
-        # Add the current user to the session since it has been detached
-        db_session.add(current_user)
-        current_user.authorization_codes.append(authorization_code_instance)
+        db_session.add(authorization_code_instance)
 
     return redirect('{}?code={}&state={}'.format(urllib.parse.unquote(redirect_uri),
                                                  authorization_code,
@@ -274,56 +510,27 @@ def token():
 
     if grant_type == 'authorization_code':
         with db_instance.get_session_scope() as db_session:
-            authorization_code_instance = (db_session.query(models.AuthorizationCode)
-                                                     .filter_by(code=code)
-                                                     .first())
-            # Validate the authorization code
-            if not oauth2.validate_authorization_code(authorization_code_instance,
-                                                      urllib.parse.unquote(redirect_uri)):
-                # Delete the invalid authorization code
-                if not authorization_code_instance:
-                    db_session.delete(authorization_code_instance)
+            u_id = oauth2.claim_authorization_code(db_session, code,
+                                                   urllib.parse.unquote(redirect_uri or ''))
+
+            if u_id is None:
                 logger.warn(
                     'Receive a token request,'
                     'but it contains an invalid authorization code')
                 return make_response(jsonify(CONST.INVALID_GRANT_RESPONSE), 400)
 
-            access_token = get_random_token(64)
-            refresh_token = get_random_token(64)
-
-            # Make sure no repeated tokens
-            while True:
-                if not oauth2.access_token_exists(db_session, access_token):
-                    break
-            while True:
-                if not oauth2.refresh_token_exists(db_session, refresh_token):
-                    break
-
-            access_token_instance = models.AccessToken(
-                token=access_token,
-                expires_at=get_one_hour_after_timestamp(),
-                u_id=authorization_code_instance.u_id)
-            refresh_token_instance = models.RefreshToken(
-                token=refresh_token,
-                u_id=authorization_code_instance.u_id)
-            refresh_token_instance.access_token = access_token_instance
-
-            db_session.add(access_token_instance)
-            db_session.add(refresh_token_instance)
-            db_session.delete(authorization_code_instance)
-
-            response_object = {
-                'token_type': 'Bearer',
-                'access_token': access_token,
-                'refresh_token': refresh_token,
-                'expires_in': 3600
-            }
-
-            # Register on the IoTtalk
-            dan_instance.device_registration_with_retry(iottalk_profile,
-                                                        config.iottalk_conf['host'])
-
-            return jsonify(response_object)
+            access_token, refresh_token = oauth2.issue_tokens(db_session, u_id,
+                                                              signed_token_codec)
+
+        # Register the user's DA on the IoTtalk, off the request path
+        dan_registry.register_in_background(u_id)
+
+        return jsonify({
+            'token_type': 'Bearer',
+            'access_token': access_token,
+            'refresh_token': refresh_token,
+            'expires_in': 3600
+        })
     elif grant_type == 'refresh_token':
         with db_instance.get_session_scope() as db_session:
             refresh_token_instance = (db_session.query(models.RefreshToken)
@@ -332,17 +539,23 @@ def token():
             if not refresh_token_instance:
                 return make_response(jsonify(CONST.INVALID_GRANT_RESPONSE), 400)
 
-            # Update the access token
-            new_access_token = get_random_token(64)
-            refresh_token_instance.access_token.token = new_access_token
-            refresh_token_instance.access_token.expires_at = get_one_hour_after_timestamp()
-            response_object = {
-                'token_type': 'Bearer',
-                'access_token': new_access_token,
-                'expires_in': 3600
-            }
-
-            return jsonify(response_object)
+            if refresh_token_instance.access_token is not None:
+                # The old access token must not be served from the cache
+                old_access_token = refresh_token_instance.access_token.token
+                token_cache.invalidate(old_access_token)
+
+                if signed_token_codec is not None:
+                    signed_token_codec.revoke(old_access_token, db_session)
+
+            new_access_token = oauth2.rotate_access_token(db_session,
+                                                          refresh_token_instance,
+                                                          signed_token_codec)
+
+        return jsonify({
+            'token_type': 'Bearer',
+            'access_token': new_access_token,
+            'expires_in': 3600
+        })
     else:
         logger.warn(
             'Receive a token request,'
@@ -350,6 +563,20 @@ def token():
         return make_response(jsonify(CONST.INVALID_GRANT_RESPONSE), 400)
 
 
+@app.route('/metrics')
+def export_metrics():
+    return app.response_class(metrics.registry.expose(),
+                              mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/ready')
+def readiness():
+    if not ready.is_set():
+        return 'Warming up', 503
+
+    return 'OK', 200
+
+
 @app.route('/')
 def index():
     return render_template('index.html', current_user=current_user)
@@ -368,13 +595,193 @@ def add_default_user(username: str, plaintext_password: str):
 
         if user:
             logger.warning('Update default user\'s password')
-            user.password = password.hash(plaintext_password)
+            account.change_password(user, plaintext_password)
         else:
             account.add_an_user(username, plaintext_password)
 
 
+def init_app(args):
+    """Build the IoTtalk clients and the stores from the loaded configuration
+
+    :param args: Parsed command line arguments, see ``cli.parse_args()``
+    :return: The Flask app
+    """
+    global async_http_client, poller, dan_registry, device_catalog, \
+        device_state_store, token_cache, signed_token_codec, push_queue, push_coalescer, \
+        state_reporter
+
+    iottalk_profile = {
+        'd_name': config.iottalk_conf['device_name'],
+        'dm_name': config.iottalk_conf['device_model_name'],
+        'df_list': [config.iottalk_conf['device_feature']],
+        'is_sim': False
+    }
+
+    if config.iottalk_conf['state_feature']:
+        iottalk_profile['df_list'].append(config.iottalk_conf['state_feature'])
+
+    csmapi.session_pool.configure(
+        max_sessions=config.iottalk_conf['http_pool_max_sessions'],
+        idle_timeout=config.iottalk_conf['http_pool_idle_timeout'],
+        pool_connections=config.iottalk_conf['http_pool_connections'],
+        pool_maxsize=config.iottalk_conf['http_pool_maxsize'])
+    csmapi.breakers.configure(
+        failure_threshold=config.iottalk_conf['breaker_failure_threshold'],
+        open_seconds=config.iottalk_conf['breaker_open_seconds'],
+        min_timeout=config.iottalk_conf['timeout_min'],
+        max_timeout=config.iottalk_conf['timeout_max'],
+        timeout_percentile=config.iottalk_conf['timeout_percentile'],
+        timeout_multiplier=config.iottalk_conf['timeout_multiplier'],
+        retry_attempts=config.iottalk_conf['retry_attempts'],
+        retry_backoff=config.iottalk_conf['retry_backoff'],
+        retry_max_backoff=config.iottalk_conf['retry_max_backoff'],
+        retry_budget=config.iottalk_conf['retry_budget'])
+
+    if config.iottalk_conf['http_client'] == 'aiohttp':
+        from voicetalk.iottalk.async_csmapi import AsyncHTTPClient
+        async_http_client = AsyncHTTPClient(
+            limit_per_host=config.iottalk_conf['http_limit_per_host'],
+            keepalive_timeout=config.iottalk_conf['http_keepalive_timeout'])
+
+    poller = Poller(workers=config.iottalk_conf['poll_workers'],
+                    interval=config.iottalk_conf['control_channel_interval'],
+                    max_interval=config.iottalk_conf['control_channel_max_interval'])
+    dan_registry = DANRegistry(
+        config.iottalk_conf['host'],
+        iottalk_profile,
+        max_instances=config.iottalk_conf['max_dan_instances'],
+        idle_timeout=config.iottalk_conf['dan_idle_timeout'],
+        poller=poller,
+        async_client=async_http_client,
+        registration_workers=config.iottalk_conf['registration_workers'],
+        registration_attempts=config.iottalk_conf['registration_attempts'],
+        registration_backoff=config.iottalk_conf['registration_backoff'],
+        registration_max_backoff=config.iottalk_conf['registration_max_backoff'])
+    device_catalog = DeviceCatalog(getattr(args, 'device_json_file_path'))
+    # Only a state feed tells whether a device is still online, the states set by
+    # EXECUTE alone never go stale
+    stale_after = None
+
+    if config.iottalk_conf['state_feature']:
+        stale_after = config.device_conf['state_stale_after']
+
+    device_state_store = DeviceStateStore(stale_after,
+                                          config.device_conf['state_expire_after'])
+    token_cache = TokenCache(config.oauth2_conf['token_cache_size'],
+                             config.oauth2_conf['token_cache_ttl'])
+    account.identity_cache.configure(config.user_cache_conf['max_size'],
+                                     config.user_cache_conf['ttl'])
+
+    if config.oauth2_conf['access_token_format'] == 'signed':
+        signed_token_codec = signed_token.SignedTokenCodec(
+            signed_token.parse_keys(config.oauth2_conf['signing_keys']),
+            signed_token.RevocationList(
+                store=signed_token.RevocationStore(),
+                sync_interval=config.oauth2_conf['revocation_sync_interval']))
+    push_queue = PushQueue(workers=config.iottalk_conf['push_workers'],
+                           max_size=config.iottalk_conf['push_queue_size'],
+                           overflow_policy=config.iottalk_conf['push_overflow_policy'],
+                           block_timeout=config.iottalk_conf['push_block_timeout'])
+    push_coalescer = PushCoalescer(push_execute_commands,
+                                   push_queue,
+                                   config.iottalk_conf['push_coalesce_window_ms'] / 1000)
+    homegraph_sink = create_sink(config.homegraph_conf['sink'],
+                                 config.homegraph_conf['service_account_file'],
+                                 config.google_conf['api_key'])
+
+    if homegraph_sink is not None:
+        state_reporter = StateReporter(homegraph_sink,
+                                       config.homegraph_conf['report_state_debounce'],
+                                       config.homegraph_conf['report_state_max_delay'],
+                                       device_catalog)
+        device_state_store.add_listener(state_reporter.record)
+        device_catalog.add_listener(request_sync_linked_users)
+
+    register_metric_callbacks()
+    tracing.tracer.configure(config.tracing_conf['sample_rate'],
+                             config.tracing_conf['output'])
+
+    set_up()
+
+    return app
+
+
+def register_metric_callbacks():
+    """Export the statistics of the components built by ``init_app()``"""
+    registry = metrics.registry
+    registry.callback('voicetalk_token_cache_hits_total', 'Hits of the access token cache',
+                      lambda: token_cache.stats['hits'], type='counter')
+    registry.callback('voicetalk_token_cache_misses_total',
+                      'Misses of the access token cache',
+                      lambda: token_cache.stats['misses'], type='counter')
+    registry.callback('voicetalk_token_cache_hit_ratio',
+                      'Hit ratio of the access token cache',
+                      lambda: token_cache.stats['hit_rate'])
+    registry.callback('voicetalk_token_cache_size', 'Tokens in the access token cache',
+                      lambda: token_cache.stats['size'])
+    registry.callback('voicetalk_user_cache_hit_ratio', 'Hit ratio of the user cache',
+                      lambda: account.identity_cache.stats['hit_rate'])
+    registry.callback('voicetalk_user_cache_size', 'Users in the user cache',
+                      lambda: account.identity_cache.stats['size'])
+    registry.callback('voicetalk_homegraph_pending',
+                      'Users waiting for a Report State or a Request Sync',
+                      lambda: state_reporter.pending())
+    registry.callback('voicetalk_push_queue_depth', 'Pushes waiting for a push worker',
+                      lambda: push_queue.stats()['depth'])
+    registry.callback('voicetalk_dan_instances', 'DANs kept in memory',
+                      lambda: len(dan_registry))
+    registry.callback('voicetalk_http_sessions_in_use', 'CSMAPI sessions checked out',
+                      lambda: csmapi.session_pool.stats()['in_use'])
+    registry.callback('voicetalk_http_sessions_idle', 'CSMAPI sessions idle in the pool',
+                      lambda: csmapi.session_pool.stats()['idle'])
+    registry.callback('voicetalk_http_sessions_created_total', 'CSMAPI sessions created',
+                      lambda: csmapi.session_pool.stats()['created'], type='counter')
+    registry.callback('voicetalk_http_sessions_reused_total',
+                      'CSMAPI sessions reused from the pool',
+                      lambda: csmapi.session_pool.stats()['reused'], type='counter')
+    registry.callback('voicetalk_http_sessions_evicted_total',
+                      'CSMAPI sessions closed for being idle or over the pool size',
+                      lambda: csmapi.session_pool.stats()['evicted'], type='counter')
+    registry.callback('voicetalk_http_sessions_overflow_total',
+                      'Transient CSMAPI sessions created while the pool was full',
+                      lambda: csmapi.session_pool.stats()['overflow'], type='counter')
+    registry.callback('voicetalk_csmapi_breaker_state',
+                      'State of the circuit breaker of an IoTtalk host, '
+                      '0 closed, 1 half-open, 2 open',
+                      lambda: get_breaker_stats('state', STATE_VALUES.get),
+                      labelnames=('host',))
+    registry.callback('voicetalk_csmapi_timeout_seconds',
+                      'Adaptive timeout of the calls to an IoTtalk host',
+                      lambda: get_breaker_stats('timeout'), labelnames=('host',))
+    registry.callback('voicetalk_csmapi_rejected_total',
+                      'Calls rejected by the open circuit breaker of an IoTtalk host',
+                      lambda: get_breaker_stats('rejected'), labelnames=('host',),
+                      type='counter')
+    registry.callback('voicetalk_csmapi_retries_total',
+                      'Retries of the failed calls to an IoTtalk host',
+                      lambda: get_breaker_stats('retries'), labelnames=('host',),
+                      type='counter')
+    registry.callback('voicetalk_db_pool_checked_out',
+                      'Connections checked out of the DB pool',
+                      lambda: DB().pool_stats().get('checked_out', 0))
+    registry.callback('voicetalk_db_pool_saturation',
+                      'Ratio of checked out connections to the DB pool capacity',
+                      lambda: DB().pool_stats().get('saturation', 0.0))
+
+
+def get_breaker_stats(key: str, convert=None) -> dict:
+    """Map the IoTtalk hosts to a stat of their circuit breakers, for the metrics"""
+    return {(host,): convert(stats[key]) if convert else stats[key]
+            for host, stats in csmapi.breakers.stats().items()}
+
+
 # For development use
 def main():
+    parser, args = cli.parse_args()
+    cli.load_config(args)
+    cli.load_flask_config(app)
+    init_app(args)
+    warm_up()
     app.run(host=config.bind_address,
             port=config.bind_port,
             debug=False)
@@ -0,0 +1,299 @@
+"""Sampled request tracing exported in the Chrome trace event format.
+
+A trace is started for a sampled fraction of the requests and the spans
+opened by the thread handling it are nested under the root span. Other threads
+join the trace by ``attach()``-ing the context ``capture()``-d by the request,
+e.g. the push queue workers.
+
+The finished traces are appended to a file, or stdout, as a JSON array of
+complete (``"ph": "X"``) events, which ``chrome://tracing``, Perfetto or
+speedscope render as flame charts. Every event carries the trace ID, i.e.
+the ``requestId`` of Google, in its ``args``.
+
+When a request is not sampled, ``span()`` returns a shared no-op context
+manager after a single thread-local lookup.
+"""
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+
+from functools import wraps
+
+logger = logging.getLogger('VoiceTalk.tracing')
+
+_local = threading.local()
+_span_ids = itertools.count(1)
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def set(self, **args) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    def __init__(self, trace_id=None):
+        self.trace_id = trace_id
+        self.events = []
+        self.finished = False
+
+
+class Span:
+    def __init__(self, trace: Trace, name: str, args: dict):
+        self.trace = trace
+        self.name = name
+        self.args = args
+        self.span_id = next(_span_ids)
+        self.parent_id = None
+        self.started_at = None
+
+    def __enter__(self):
+        stack = _get_stack()
+        self.parent_id = stack[-1].span_id if stack else None
+        stack.append(self)
+        self.started_at = time.perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration = time.perf_counter() - self.started_at
+        stack = _get_stack()
+
+        if stack and stack[-1] is self:
+            stack.pop()
+
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+
+        tracer.record(self, duration)
+
+        return False
+
+    def set(self, **args) -> None:
+        """Add arguments to the event of the span"""
+        self.args.update(args)
+
+
+class Tracer:
+    def __init__(self):
+        self.sample_rate = 0.0
+        self.output = '-'
+        self.__lock = threading.Lock()
+        self.__trace_lock = threading.Lock()
+        self.__file = None
+        self.__pid = None
+        # Offset of perf_counter() to the wall clock, so the events of all the
+        # processes line up
+        self.__epoch = time.time() - time.perf_counter()
+
+    def configure(self, sample_rate: float = 0.0, output: str = '-') -> None:
+        """
+        :param sample_rate: Fraction of the requests traced, 0 disables tracing.
+        :type sample_rate: float
+        :param output: File the traces are appended to, ``-`` for stdout.
+          ``{pid}`` is replaced by the process ID, so the uWSGI workers do not
+          write the same file.
+        :type output: str
+        """
+        self.sample_rate = max(0.0, min(1.0, sample_rate))
+        self.output = output or '-'
+
+    def record(self, span: Span, duration: float) -> None:
+        trace = span.trace
+        event = {
+            'name': span.name,
+            'ph': 'X',
+            'ts': round((self.__epoch + span.started_at) * 1e6),
+            'dur': round(duration * 1e6),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': dict(span.args, span_id=span.span_id, parent_id=span.parent_id)
+        }
+
+        with self.__trace_lock:
+            finished = trace.finished
+
+            if not finished:
+                trace.events.append(event)
+
+        if finished:
+            # A span ending after its request, e.g. a push still in flight
+            self.export(trace, [event])
+
+    def finish(self, trace: Trace) -> None:
+        """Export the spans recorded so far, the later ones are exported alone"""
+        with self.__trace_lock:
+            trace.finished = True
+            events, trace.events = trace.events, []
+
+        self.export(trace, events)
+
+    def export(self, trace: Trace, events: list) -> None:
+        for event in events:
+            event['args']['trace_id'] = trace.trace_id
+
+        lines = ''.join(json.dumps(event) + ',\n' for event in events)
+
+        try:
+            with self.__lock:
+                self.__get_file().write(lines)
+                self.__file.flush()
+        except OSError as e:
+            logger.warning('Fail to export a trace: %s', e)
+
+    def __get_file(self):
+        if self.output == '-':
+            self.__file = sys.stdout
+            return self.__file
+
+        if self.__file is None or self.__pid != os.getpid():
+            # The file of the parent process is not shared after a fork
+            self.__pid = os.getpid()
+            self.__file = open(self.output.format(pid=self.__pid), 'a')
+
+            if self.__file.tell() == 0:
+                # The closing bracket is optional in the trace event format
+                self.__file.write('[\n')
+
+        return self.__file
+
+
+tracer = Tracer()
+
+
+class _TraceScope:
+    """Root span of a trace, the trace is exported when it exits"""
+
+    def __init__(self, trace: Trace, name: str, args: dict):
+        self.trace = trace
+        self.span = Span(trace, name, args)
+
+    def __enter__(self):
+        _local.trace = self.trace
+        _local.stack = []
+
+        return self.span.__enter__()
+
+    def __exit__(self, *exc_info):
+        try:
+            self.span.__exit__(*exc_info)
+        finally:
+            _local.trace = None
+            _local.stack = []
+            tracer.finish(self.trace)
+
+        return False
+
+
+def start_trace(name: str, trace_id=None, **args):
+    """Start a trace in the current thread if the request is sampled
+
+    :param name: Name of the root span, e.g. the route
+    :param trace_id: ID of the trace, it can be set later by ``set_trace_id()``
+    :return: A context manager of the root span
+    """
+    if tracer.sample_rate <= 0 or random.random() >= tracer.sample_rate:
+        return NOOP_SPAN
+
+    return _TraceScope(Trace(trace_id), name, args)
+
+
+def set_trace_id(trace_id) -> None:
+    """Set the ID of the trace of the current thread, e.g. once the body is parsed"""
+    trace = getattr(_local, 'trace', None)
+
+    if trace is not None:
+        trace.trace_id = trace_id
+
+
+def span(name: str, **args):
+    """Open a span nested in the current span, if the current thread is traced
+
+    :return: A context manager, its ``set(**args)`` adds arguments to the span.
+    """
+    trace = getattr(_local, 'trace', None)
+
+    if trace is None:
+        return NOOP_SPAN
+
+    return Span(trace, name, args)
+
+
+def traced(name: str = None):
+    """Decorate a function to run it in a span named after it"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @wraps(func)
+        def wrap(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+
+        return wrap
+
+    return decorator
+
+
+def capture():
+    """Capture the trace and the current span of the current thread
+
+    :return: A context to ``attach()`` in another thread, ``None`` if the
+      current thread is not traced
+    """
+    trace = getattr(_local, 'trace', None)
+
+    if trace is None:
+        return None
+
+    stack = _get_stack()
+
+    return trace, stack[-1] if stack else None
+
+
+class _Attachment:
+    def __init__(self, context):
+        self.trace, self.parent = context
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'trace', None), getattr(_local, 'stack', [])
+        _local.trace = self.trace
+        _local.stack = [self.parent] if self.parent is not None else []
+
+    def __exit__(self, *exc_info):
+        _local.trace, _local.stack = self.previous
+
+        return False
+
+
+def attach(context):
+    """Continue a captured trace in the current thread
+
+    :param context: The return value of ``capture()``
+    :return: A context manager, the spans opened in it belong to the trace.
+    """
+    if context is None:
+        return NOOP_SPAN
+
+    return _Attachment(context)
+
+
+def _get_stack() -> list:
+    stack = getattr(_local, 'stack', None)
+
+    if stack is None:
+        stack = _local.stack = []
+
+    return stack
@@ -4,6 +4,12 @@ import shutil
 from datetime import datetime, timedelta
 from pathlib import Path
 
+try:
+    from importlib.resources import as_file, files
+except ImportError:
+    # Python < 3.9
+    from importlib_resources import as_file, files
+
 
 def copy_sample_file(sample_file_path: str, sample_file_destination: str,
                      error_msg: str = 'Sample file does not exist') -> None:
@@ -56,3 +62,16 @@ def get_random_token(length: int = 48) -> str:
     :rtype: bytes
     """
     return secrets.token_urlsafe(length)
+
+
+def resource_path(resource: str):
+    """Get a file of the ``voicetalk`` package on the file system.
+
+    The file is extracted to a temporary file if the package is zipped, so the
+    returned context manager should be exited once the file is not needed.
+
+    :param resource: Path relative to the package, e.g. ``conf/voicetalk.ini.sample``
+    :type resource: str
+    :return: A context manager giving the ``pathlib.Path`` of the file
+    """
+    return as_file(files('voicetalk').joinpath(resource))
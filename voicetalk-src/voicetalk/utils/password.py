@@ -1,12 +1,115 @@
 import logging
-import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 
 from argon2 import PasswordHasher
 from argon2.exceptions import (HashingError, VerificationError, VerifyMismatchError,
                                InvalidHash)
 
+from voicetalk import metrics
+from voicetalk import tracing
+from voicetalk.config import config
+
 logger = logging.getLogger('VoiceTalk.utils.password')
-password_hasher = PasswordHasher(parallelism=2 * multiprocessing.cpu_count())
+
+# The hasher and the worker pool are built from the config on first use, the
+# config is not loaded yet when this module is imported.
+_password_hasher = None
+_executor = None
+_slots = None
+_pid = os.getpid()
+_lock = threading.Lock()
+
+
+class PasswordHasherBusy(Exception):
+    """Too many passwords are waiting to be hashed or verified"""
+
+
+def get_password_hasher() -> PasswordHasher:
+    """Get the argon2 hasher tuned by the ``[core]`` config"""
+    global _password_hasher
+
+    with _lock:
+        if _password_hasher is None:
+            conf = config.password_hasher_conf
+            _password_hasher = PasswordHasher(time_cost=conf['time_cost'],
+                                              memory_cost=conf['memory_cost'],
+                                              parallelism=conf['parallelism'])
+
+        return _password_hasher
+
+
+def _new_executor(workers: int):
+    """Pool of native threads running the argon2 calls
+
+    gevent patches the threads of ``ThreadPoolExecutor`` into greenlets, argon2
+    would then block the hub and every request of the worker. gevent has its own
+    executor running on native threads.
+    """
+    monkey = sys.modules.get('gevent.monkey')
+
+    if monkey is not None and monkey.is_module_patched('threading'):
+        from gevent.threadpool import ThreadPoolExecutor as NativeThreadPoolExecutor
+
+        return NativeThreadPoolExecutor(max_workers=workers)
+
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='PasswordHasher')
+
+
+def _run(func, *args):
+    """Run an argon2 call on the password workers and wait for its result.
+
+    The workers are sized independently of the web workers. At most
+    ``password-workers + password-queue-size`` calls are admitted at once, the
+    others are rejected right away instead of piling up. Under gevent, the
+    calls run on native threads and the waiting greenlet yields to the others.
+
+    :raise PasswordHasherBusy: If the workers are saturated.
+    """
+    global _executor, _slots, _pid
+
+    with _lock:
+        if _pid != os.getpid():
+            # The worker threads of the parent process do not survive a fork
+            _executor = None
+            _pid = os.getpid()
+
+        if _executor is None:
+            conf = config.password_hasher_conf
+            workers = max(1, conf['workers'])
+            _executor = _new_executor(workers)
+            _slots = threading.BoundedSemaphore(workers + max(0, conf['queue_size']))
+
+        executor, slots = _executor, _slots
+
+    if not slots.acquire(blocking=False):
+        logger.warning('Password workers are saturated, reject the request')
+        metrics.password_rejected_total.inc()
+        raise PasswordHasherBusy('Too many pending password operations')
+
+    try:
+        future = executor.submit(_timed, tracing.capture(), func, *args)
+    except Exception:
+        slots.release()
+        raise
+
+    future.add_done_callback(lambda _: slots.release())
+
+    return future.result()
+
+
+def _timed(trace_context, func, *args):
+    started_at = time.perf_counter()
+
+    try:
+        with tracing.attach(trace_context), tracing.span('password.' + func.__name__):
+            return func(*args)
+    finally:
+        metrics.password_duration.observe(time.perf_counter() - started_at, func.__name__)
 
 
 def hash(plaintext_password: str) -> str:
@@ -17,6 +120,7 @@ def hash(plaintext_password: str) -> str:
     :type plaintext_password: ``str``
     :raise RuntimeError: If password hashing failed.
     :raise ValueError: If the ``plaintext_password`` is empty.
+    :raise PasswordHasherBusy: If the password workers are saturated.
     :return: Hashed password on success,
         rasie `ValueError` or `RuntimeError` otherwise.
     :rtype: ``str``
@@ -25,7 +129,7 @@ def hash(plaintext_password: str) -> str:
         raise ValueError('Password can not be empty')
 
     try:
-        return password_hasher.hash(plaintext_password)
+        return _run(get_password_hasher().hash, plaintext_password)
     except HashingError:
         raise RuntimeError('Password hashing failed')
 
@@ -38,10 +142,22 @@ def verify(hashed_password: str, plaintext_password: str) -> bool:
     :type hashed_password: str
     :param plaintext_password: Plaintext password
     :type plaintext_password: str
+    :raise PasswordHasherBusy: If the password workers are saturated.
     :return: ``True`` on success, raise ``RuntimeError`` otherwise.
     :rtype: ``bool``
     """
     try:
-        return password_hasher.verify(hashed_password, plaintext_password)
+        return _run(get_password_hasher().verify, hashed_password, plaintext_password)
     except (VerifyMismatchError, VerificationError, InvalidHash):
         raise RuntimeError('Password verification failed')
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """
+    Check the hashed password was hashed with other argon2 parameters.
+
+    :param hashed_password: Hashed password
+    :type hashed_password: str
+    :rtype: bool
+    """
+    return get_password_hasher().check_needs_rehash(hashed_password)
@@ -1,7 +1,4 @@
 from voicetalk import cli
 
-
-def application(*args, **kwargs):
-    app = cli.main()
-
-    return app(*args, **kwargs)
+# Build the app once when uWSGI loads this module, not on every request
+application = cli.main()